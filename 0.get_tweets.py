@@ -1,45 +1,65 @@
-import requests
-import csv
 import os
 import sys
 import time
 from utils.twitter_utils import ACCESS_TOKEN
-
-def get_user_id_by_username(username, access_token):
+from utils.user_cache import UserCache, normalize_username
+from utils.scheduler import RequestScheduler, PageJob
+from utils.stages import load_stage
+from utils.retry_utils import get_with_retry, RequestFailed, DeadLetterLog
+from utils.csv_io import write_csv_atomic, ensure_dir
+from utils.raw_archive import RawArchive
+from utils.page_parser import TweetPage, decode_json
+from utils.profiling import run_main
+
+# Rate limit constants
+RATE_LIMIT = 900  # requests per window
+RATE_LIMIT_WINDOW = 900  # 15 minutes in seconds
+
+OUTPUT_DIR = "twitter_files/0_original_tweets"
+# retweet_count lets step 1 skip tweets nobody retweeted and fetch the most productive tweets first
+ORIGINAL_TWEETS_HEADER = ['id', 'retweet_count']
+
+# Key functions timed with --profile (see utils/profiling.py)
+PROFILED_FUNCTIONS = {
+    'get_user_id_by_username': 'fetch',
+    'get_original_tweets': 'fetch',
+    'fetch_original_tweets_page': 'fetch',
+    'filter_original_tweets': 'parse',
+    'save_original_tweets_to_csv': 'csv',
+}
+
+
+def get_user_id_by_username(username, access_token, cache=None):
     """
     Get user ID from username using Twitter API v2.
+    Lookups go through the persistent user cache, so repeat runs cost no API call.
     """
     # Remove @ if present
     username = username.lstrip('@')
 
-    url = f"https://api.twitter.com/2/users/by/username/{username}"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
+    cache = cache or UserCache()
+    user_id = cache.resolve([username], access_token).get(normalize_username(username))
 
-    try:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            data = response.json()
-            user_id = data.get('data', {}).get('id')
-            user_name = data.get('data', {}).get('name')
-            print(f"✅ Found user: {user_name} (@{username})")
-            print(f"   User ID: {user_id}")
-            return user_id
-        else:
-            print(f"❌ Error fetching user: {response.status_code}")
-            print(f"   Response: {response.text}")
-            return None
-    except Exception as e:
-        print(f"❌ Exception: {e}")
-        return None
+    if user_id:
+        print(f"✅ Found user: @{cache.get_username(user_id)}")
+        print(f"   User ID: {user_id}")
+    return user_id
 
 
-def get_original_tweets(user_id, access_token, max_results=100):
+def filter_original_tweets(tweets):
     """
-    Fetch original tweets from a user (no retweets, replies, or quotes).
-    Returns a list of tweet IDs.
+    Return [id, retweet_count] rows of a page's original tweets (quote tweets have
+    referenced_tweets with type 'quoted'). The page is walked once, see utils/page_parser.py.
+    """
+    return TweetPage(tweets).original_rows()
+
+
+def fetch_original_tweets_page(user_id, access_token, pagination_token=None, max_results=100, archive=None):
+    """
+    Fetch one page of a user's tweets and keep only original ones (no retweets, replies, or quotes).
+    Transient failures (429, 5xx, timeouts) are retried with backoff.
+    If a RawArchive is given, the raw page is archived before it is filtered.
+    Returns ([id, retweet_count] rows, next_token). Raises RequestFailed if the page cannot be fetched.
     """
     url = f"https://api.twitter.com/2/users/{user_id}/tweets"
 
@@ -48,86 +68,112 @@ def get_original_tweets(user_id, access_token, max_results=100):
         "Content-Type": "application/json"
     }
 
-    all_tweet_ids = []
+    params = {
+        "max_results": max_results,
+        "tweet.fields": "id,referenced_tweets,public_metrics",
+        "exclude": "retweets,replies"
+    }
+
+    if pagination_token:
+        params["pagination_token"] = pagination_token
+
+    try:
+        response = get_with_retry(url, headers, params, endpoint='users_tweets')
+    except RequestFailed as e:
+        if archive:
+            archive.append_failure(user_id, pagination_token, e)
+        raise
+    data = decode_json(response.content)
+    if archive:
+        archive.append(user_id, pagination_token, data)
+    tweets = data.get('data', [])
+    meta = data.get('meta', {})
+
+    # Filter out quote tweets
+    original_tweets = filter_original_tweets(tweets)
+
+    print(f"   Page for user {user_id}: Found {len(tweets)} tweets, {len(original_tweets)} are original")
+    return original_tweets, meta.get('next_token')
+
+
+def get_original_tweets(user_id, access_token, max_results=100):
+    """
+    Fetch original tweets from a user (no retweets, replies, or quotes).
+    Returns a list of [id, retweet_count] rows.
+    """
+    all_tweets = []
     pagination_token = None
-    page_count = 0
 
     print(f"\n Fetching original tweets...")
 
     while True:
-        page_count += 1
+        try:
+            tweets, pagination_token = fetch_original_tweets_page(user_id, access_token, pagination_token, max_results)
+        except RequestFailed as e:
+            print(f"❌ Error fetching tweets: {e}")
+            break
 
-        params = {
-            "max_results": max_results,
-            "tweet.fields": "id,referenced_tweets",
-            "exclude": "retweets,replies"
-        }
+        all_tweets.extend(tweets)
 
+        # Check for more pages
         if pagination_token:
-            params["pagination_token"] = pagination_token
-
-        try:
-            response = requests.get(url, headers=headers, params=params)
-
-            if response.status_code == 200:
-                data = response.json()
-                tweets = data.get('data', [])
-                meta = data.get('meta', {})
-
-                # Filter out quote tweets (they have referenced_tweets with type 'quoted')
-                for tweet in tweets:
-                    referenced_tweets = tweet.get('referenced_tweets', [])
-                    is_quote = any(ref.get('type') == 'quoted' for ref in referenced_tweets)
-
-                    if not is_quote:
-                        all_tweet_ids.append(tweet.get('id'))
-
-                print(f"   Page {page_count}: Found {len(tweets)} tweets, {len([t for t in tweets if not any(ref.get('type') == 'quoted' for ref in t.get('referenced_tweets', []))])} are original")
-
-                # Check for more pages
-                pagination_token = meta.get('next_token')
-                if pagination_token:
-                    time.sleep(0.5)
-                else:
-                    break
-
-            elif response.status_code == 429:
-                print(f"⚠️  Rate limit reached. Waiting 15 minutes...")
-                time.sleep(900)
-                continue
-            else:
-                print(f"❌ Error fetching tweets: {response.status_code}")
-                print(f"   Response: {response.text}")
-                break
-
-        except Exception as e:
-            print(f"❌ Exception: {e}")
+            time.sleep(0.5)
+        else:
             break
 
-    return all_tweet_ids
+    return all_tweets
 
 
-def save_tweet_ids_to_csv(tweet_ids, username):
+def save_original_tweets_to_csv(tweets, username):
     """
-    Save tweet IDs to CSV file in organized folder structure.
+    Save [id, retweet_count] rows of original tweets to CSV file in organized folder structure.
     """
-    output_dir = "twitter_files/0_original_tweets"
-    os.makedirs(output_dir, exist_ok=True)
+    ensure_dir(OUTPUT_DIR)
 
     clean_username = username.lstrip('@').lower()
-    filename = os.path.join(output_dir, f"tweet_id_{clean_username}.csv")
-
-    with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(['id'])
+    filename = os.path.join(OUTPUT_DIR, f"tweet_id_{clean_username}.csv")
 
-        for tweet_id in tweet_ids:
-            writer.writerow([tweet_id])
+    write_csv_atomic(filename, ORIGINAL_TWEETS_HEADER, tweets)
 
-    print(f"\n Saved {len(tweet_ids)} tweet IDs to {filename}")
+    print(f"\n Saved {len(tweets)} tweet IDs to {filename}")
     return filename
 
 
+def report_original_tweets(tweets, username, error=None, scheduler=None):
+    """
+    Save a user's original tweets once all of their pages were fetched.
+    With a scheduler, also queue step 1 (retweeting users) for these tweets right away.
+    If a page failed, nothing is saved and the user is added to the dead-letter list.
+    """
+    username = username.lstrip('@')
+
+    if error:
+        dead_letters = DeadLetterLog('0_original_tweets')
+        dead_letters.add(username.lower(), error, items_fetched=len(tweets))
+        print(f"\n💀 Could not fetch all tweets of @{username} ({error.failure_class}), added to {dead_letters.path}")
+        return
+
+    if not tweets:
+        print(f"\n❌ No original tweets found for @{username} (or all tweets are retweets/replies/quotes)")
+        return
+
+    print(f"\n✅ Found {len(tweets)} original tweets for @{username}")
+
+    # Save to CSV
+    filename = save_original_tweets_to_csv(tweets, username)
+
+    print(f"🎉 Done! Tweet IDs saved to {filename}")
+    if len(tweets) >= 3000:
+        print(f"   You may have reached this limit ({len(tweets)} tweets fetched)")
+
+    if scheduler:
+        retweet_counts = {tweet_id: int(count) for tweet_id, count in tweets if count}
+        queued, _ = load_stage(1).submit_retweeting_users_jobs(scheduler, [tweet_id for tweet_id, _ in tweets],
+                                                            username.lower(), target=username.lower(),
+                                                            retweet_counts=retweet_counts)
+        print(f"   ➡️  Queued {queued} tweets for step 1 (retweeting users)")
+
+
 def main():
     print("Twitter Original Tweets Fetcher")
     print("=" * 50)
@@ -136,38 +182,75 @@ def main():
     if len(sys.argv) < 2:
         print("\n❌ Error: Please provide a Twitter username")
         print("\nUsage:")
-        print("  python 0.get_tweets.py <username>")
+        print("  python 0.get_tweets.py <username> [username2] ...")
         print("\nExample:")
         print("  python 0.get_tweets.py ethstatus")
         print("  python 0.get_tweets.py @ethstatus")
+        print("  python 0.get_tweets.py ethstatus keycard logos")
+        print("\nOptions:")
+        print("  --with-retweets   Also run step 1 for each account as soon as its tweets are in,")
+        print("                    using both endpoints' rate budgets at the same time")
+        print("  --requeue         Retry the usernames in the dead-letter list")
+        print("  --archive         Also keep every raw API page in a compressed archive (see replay_archive.py)")
         return
 
-    username = sys.argv[1]
+    with_retweets = '--with-retweets' in sys.argv[1:]
+    archived = '--archive' in sys.argv[1:]
+    archives = []
+    usernames = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
 
-    print(f"\n Looking up user: {username}")
+    if '--requeue' in sys.argv[1:]:
+        dead_letters = DeadLetterLog('0_original_tweets')
+        requeued = dead_letters.read_ids()
+        dead_letters.clear(requeued)
+        print(f"\n💀 Re-queueing {len(requeued)} usernames from {dead_letters.path}")
+        usernames = list(dict.fromkeys(usernames + requeued))
 
-    # Get user ID from username
-    user_id = get_user_id_by_username(username, ACCESS_TOKEN)
-    if not user_id:
-        print("\n❌ Could not find user. Please check the username and try again.")
+    if not usernames:
         return
 
-    # Fetch original tweets
-    tweet_ids = get_original_tweets(user_id, ACCESS_TOKEN)
-
-    if not tweet_ids:
-        print("\n❌ No original tweets found (or all tweets are retweets/replies/quotes)")
+    print(f"\n Looking up {len(usernames)} user(s): {', '.join(usernames)}")
+
+    # Resolve all usernames in one batch (cached lookups cost no API call)
+    cache = UserCache()
+    user_ids = cache.resolve(usernames, ACCESS_TOKEN)
+
+    # All targets share one rate budget: their pages are fetched in turn
+    scheduler = RequestScheduler()
+    scheduler.register_endpoint('users_tweets', limit=RATE_LIMIT, window=RATE_LIMIT_WINDOW, min_interval=0.5)
+    if with_retweets:
+        retweets_stage = load_stage(1)
+        scheduler.register_endpoint('retweeted_by', limit=retweets_stage.RATE_LIMIT,
+                                    window=retweets_stage.RATE_LIMIT_WINDOW, min_interval=1)
+
+    for username in usernames:
+        user_id = user_ids.get(normalize_username(username))
+        if not user_id:
+            print(f"\n❌ Could not find user @{username.lstrip('@')}. Please check the username and try again.")
+            continue
+
+        print(f"✅ Found user: @{cache.get_username(user_id)} (ID: {user_id})")
+        archive = RawArchive('0_original_tweets', normalize_username(username)) if archived else None
+        if archive:
+            archives.append(archive)
+        scheduler.submit('users_tweets', PageJob(
+            user_id,
+            lambda token, user_id=user_id, archive=archive: fetch_original_tweets_page(user_id, ACCESS_TOKEN, token, archive=archive),
+            lambda tweets, error, username=username: report_original_tweets(
+                tweets, username, error, scheduler if with_retweets else None)
+        ), target=username.lstrip('@'))
+
+    if not scheduler.pending():
         return
 
-    print(f"\n✅ Found {len(tweet_ids)} original tweets")
-
-    # Save to CSV
-    filename = save_tweet_ids_to_csv(tweet_ids, username)
+    print(f"\n Fetching original tweets...")
+    scheduler.run()
+    scheduler.show_progress()
 
-    print(f"\n🎉 Done! Tweet IDs saved to {filename}")
-    if len(tweet_ids) >= 3000:
-        print(f"   You may have reached this limit ({len(tweet_ids)} tweets fetched)")
+    for archive in archives:
+        archive.close()
+        print(f"🗄️  Archived {archive.pages} raw pages to {archive.directory}")
 
 
 if __name__ == "__main__":
-    main()
+    run_main(globals())
@@ -1,21 +1,40 @@
-import requests
 import csv
 import os
 import sys
 import time
 from datetime import datetime, timedelta
-from utils.twitter_utils import ACCESS_TOKEN, test_authentication, RateLimiter
+from utils.twitter_utils import ACCESS_TOKEN, test_authentication
+from utils.scheduler import RequestScheduler, PageJob
+from utils.retry_utils import get_with_retry, RequestFailed, DeadLetterLog
+from utils.csv_io import write_csv_atomic, ensure_dir, ShardedCsvWriter
+from utils.raw_archive import RawArchive
+from utils.page_parser import decode_json
+from utils.discovery import SaturationTracker, plan_tweets
+from utils.profiling import run_main
 
 # Rate limit constants
 RATE_LIMIT = 75  # requests per window
 RATE_LIMIT_WINDOW = 900  # 15 minutes in seconds
 
+OUTPUT_DIR = "twitter_files/1_retweeting_users"
+RETWEETING_USERS_HEADER = ['user_id', 'username', 'name', 'created_at', 'description', 'location', 'verified']
 
-def get_retweeting_users(tweet_id, access_token):
+# Key functions timed with --profile (see utils/profiling.py)
+PROFILED_FUNCTIONS = {
+    'get_retweeting_users': 'fetch',
+    'fetch_retweeting_users_page': 'fetch',
+    'save_retweeting_users_to_csv': 'csv',
+    'read_tweet_ids': 'csv',
+    'read_retweet_counts': 'csv',
+}
+
+
+def fetch_retweeting_users_page(tweet_id, access_token, pagination_token=None, archive=None):
     """
-    Fetch ALL users who retweeted a specific tweet using Twitter API v2.
-    Handles pagination to get all users beyond the 100-user limit per request.
-    Returns a list of user data dictionaries and the total count.
+    Fetch one page (up to 100) of users who retweeted a specific tweet using Twitter API v2.
+    Transient failures (429, 5xx, timeouts) are retried with backoff.
+    If a RawArchive is given, the raw page is archived as well.
+    Returns (users, next_token). Raises RequestFailed if the page cannot be fetched.
     """
     url = f"https://api.twitter.com/2/tweets/{tweet_id}/retweeted_by"
 
@@ -24,108 +43,111 @@ def get_retweeting_users(tweet_id, access_token):
         "Content-Type": "application/json"
     }
 
+    # Request user fields for more detailed information
+    params = {
+        "max_results": 100,
+        "user.fields": "id,name,username,created_at,description,location,verified"
+    }
+
+    if pagination_token:
+        params["pagination_token"] = pagination_token
+
+    try:
+        response = get_with_retry(url, headers, params, endpoint='retweeted_by')
+    except RequestFailed as e:
+        if e.status == 403:
+            print(f"❌ Error fetching retweets for tweet {tweet_id}: 403 Forbidden")
+            print(f"   Response: {e.detail}")
+            print(f"     This could mean:")
+            print(f"       - The tweet is from a protected/private account")
+            print(f"       - The tweet doesn't exist or was deleted")
+        else:
+            print(f"❌ Error fetching retweets for tweet {tweet_id}: {e}")
+        if archive:
+            archive.append_failure(tweet_id, pagination_token, e)
+        raise
+
+    data = decode_json(response.content)
+    if archive:
+        archive.append(tweet_id, pagination_token, data)
+    return data.get('data', []), data.get('meta', {}).get('next_token')
+
+
+def get_retweeting_users(tweet_id, access_token):
+    """
+    Fetch ALL users who retweeted a specific tweet using Twitter API v2.
+    Handles pagination to get all users beyond the 100-user limit per request.
+    Returns a list of user data dictionaries and the total count.
+    Raises RequestFailed if a page cannot be fetched, rather than returning a partial list.
+    """
     all_users = []
     pagination_token = None
     page_count = 0
-    total_fetched = 0
 
     while True:
         page_count += 1
 
-        # Request user fields for more detailed information
-        params = {
-            "max_results": 100,
-            "user.fields": "id,name,username,created_at,description,location,verified"
-        }
+        users, pagination_token = fetch_retweeting_users_page(tweet_id, access_token, pagination_token)
+        all_users.extend(users)
 
         if pagination_token:
-            params["pagination_token"] = pagination_token
-
-        try:
-            response = requests.get(url, headers=headers, params=params)
-
-            if response.status_code == 200:
-                data = response.json()
-                users = data.get('data', [])
-                meta = data.get('meta', {})
-
-                # Debug: Print raw response for first tweet
-                if page_count == 1 and total_fetched == 0:
-                    print(f"      🔍 Debug - API Response: {data}")
-
-                # Add users from this page
-                all_users.extend(users)
-                total_fetched += len(users)
-
-                # Check if there are more pages
-                pagination_token = meta.get('next_token')
-
-                if pagination_token:
-                    print(f"  Fetched page {page_count}: {len(users)} users (total so far: {total_fetched})")
-                    time.sleep(1)
-                else:
-                    break
-
-            elif response.status_code == 429:
-                print(f"⚠️  Rate limit reached. Waiting 15 minutes...")
-                time.sleep(900)
-                # Don't increment page_count, retry the same request
-                continue
-            elif response.status_code == 403:
-                print(f"❌ Error fetching retweets for tweet {tweet_id}: 403 Forbidden")
-                print(f"   Response: {response.text}")
-                print(f"     This could mean:")
-                print(f"       - The tweet is from a protected/private account")
-                print(f"       - The tweet doesn't exist or was deleted")
-                print(f"   Skipping this tweet...")
-                break
-            else:
-                print(f"❌ Error fetching retweets for tweet {tweet_id}: {response.status_code}")
-                print(f"   Response: {response.text}")
-                break
-
-        except Exception as e:
-            print(f"❌ Exception for tweet {tweet_id}: {e}")
+            print(f"  Fetched page {page_count}: {len(users)} users (total so far: {len(all_users)})")
+            time.sleep(1)
+        else:
             break
 
-    return all_users, total_fetched
+    return all_users, len(all_users)
 
 
-def save_retweeting_users_to_csv(tweet_id, users, account_name=''):
-    output_dir = "twitter_files/1_retweeting_users"
-    os.makedirs(output_dir, exist_ok=True)
+def save_retweeting_users_to_csv(tweet_id, users, account_name='', writer=None):
+    """
+    Save a tweet's retweeting users, either to their own file (written atomically)
+    or, if a ShardedCsvWriter is given, to the account's rolling shard files.
+    """
+    rows = [
+        [
+            user.get('id', ''),
+            user.get('username', ''),
+            user.get('name', ''),
+            user.get('created_at', ''),
+            user.get('description', '').replace('\n', ' '),  # Remove newlines from description
+            user.get('location', ''),
+            user.get('verified', False)
+        ]
+        for user in users
+    ]
+
+    if writer:
+        writer.write_entity(tweet_id, rows)
+        if not users:
+            print(f"   No retweeting users found for tweet {tweet_id}")
+        else:
+            print(f"   Saved {len(users)} retweeting users of tweet {tweet_id} to shard")
+        return writer.output_dir
+
+    ensure_dir(OUTPUT_DIR)
 
     if account_name:
-        filename = os.path.join(output_dir, f"{account_name}_{tweet_id}_retweeting_users.csv")
+        filename = os.path.join(OUTPUT_DIR, f"{account_name}_{tweet_id}_retweeting_users.csv")
     else:
-        filename = os.path.join(output_dir, f"{tweet_id}_retweeting_users.csv")
+        filename = os.path.join(OUTPUT_DIR, f"{tweet_id}_retweeting_users.csv")
+
+    write_csv_atomic(filename, RETWEETING_USERS_HEADER, rows)
 
     if not users:
         print(f"   No retweeting users found for tweet {tweet_id}")
-        with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(['user_id', 'username', 'name', 'created_at', 'description', 'location', 'verified'])
-        return filename
-
-    with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(['user_id', 'username', 'name', 'created_at', 'description', 'location', 'verified'])
-
-        for user in users:
-            writer.writerow([
-                user.get('id', ''),
-                user.get('username', ''),
-                user.get('name', ''),
-                user.get('created_at', ''),
-                user.get('description', '').replace('\n', ' '),  # Remove newlines from description
-                user.get('location', ''),
-                user.get('verified', False)
-            ])
-
-    print(f"   Saved {len(users)} retweeting users to {filename}")
+    else:
+        print(f"   Saved {len(users)} retweeting users to {filename}")
     return filename
 
 
+def open_sharded_writer(account_name=''):
+    """
+    Rolling shard writer for an account's retweeting users (see utils/csv_io.py).
+    """
+    return ShardedCsvWriter(OUTPUT_DIR, account_name, '_retweeting_users.csv', 'tweet_id', RETWEETING_USERS_HEADER)
+
+
 def read_tweet_ids(csv_file):
     """
     Read tweet IDs from the CSV file.
@@ -140,6 +162,91 @@ def read_tweet_ids(csv_file):
     return tweet_ids
 
 
+def read_retweet_counts(csv_file):
+    """
+    Read {tweet_id: retweet_count} from a stage 0 CSV (empty for files without the column).
+    """
+    retweet_counts = {}
+    with open(csv_file, 'r', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            tweet_id = row.get('id', '').strip()
+            count = (row.get('retweet_count') or '').strip()
+            if tweet_id and count.isdigit():
+                retweet_counts[tweet_id] = int(count)
+    return retweet_counts
+
+
+def submit_retweeting_users_jobs(scheduler, tweet_ids, account_name='', target='', priority=0, writer=None, archive=None,
+                                 retweet_counts=None, saturation=None):
+    """
+    Queue one retweeting-users job per tweet on the scheduler's 'retweeted_by' endpoint.
+    Tweets whose pages cannot all be fetched are not saved (no partial CSV) but added
+    to the account's dead-letter list instead.
+
+    With retweet_counts, tweets without retweets are skipped and the others are queued
+    by expected users per request, most first (see utils/discovery.py). With saturation
+    (new unique users per request), the account's tweets not started yet are dropped once
+    its last requests discovered fewer new users than that.
+    Returns (number of tweets queued, predicted number of requests).
+    """
+    dead_letters = DeadLetterLog('1_retweeting_users', account_name)
+    planned, skipped = plan_tweets(tweet_ids, retweet_counts or {})
+    if skipped:
+        print(f"   ⏭️  Skipping {len(skipped)} tweets without retweets" + (f" of @{account_name}" if account_name else ""))
+
+    tracker = SaturationTracker(saturation) if saturation else None
+    queued_ids = {tweet_id for tweet_id, _, _ in planned}
+    stopped = []
+
+    def fetch_page(tweet_id, token):
+        users, next_token = fetch_retweeting_users_page(tweet_id, ACCESS_TOKEN, token, archive)
+        if tracker:
+            tracker.record(users)
+            if tracker.saturated() and not stopped:
+                stopped.append(True)
+                cancelled = scheduler.cancel('retweeted_by', lambda job: job.key in queued_ids)
+                print(f"   🛑 {'@' + account_name if account_name else target}: {tracker.rate():.1f} new users per request "
+                      f"over the last {tracker.window} requests ({len(tracker.seen)} unique so far), "
+                      f"skipping {len(cancelled)} remaining tweets")
+        return users, next_token
+
+    def on_complete(tweet_id, users, error):
+        if error:
+            dead_letters.add(tweet_id, error, items_fetched=len(users))
+            print(f"   💀 Tweet {tweet_id} added to {dead_letters.path} ({error.failure_class})")
+            return
+        save_retweeting_users_to_csv(tweet_id, users, account_name, writer)
+
+    for tweet_id, expected_users, _ in planned:
+        scheduler.submit('retweeted_by', PageJob(
+            tweet_id,
+            lambda token, tweet_id=tweet_id: fetch_page(tweet_id, token),
+            lambda users, error, tweet_id=tweet_id: on_complete(tweet_id, users, error)
+        ), priority=priority + expected_users, target=target)
+    return len(planned), sum(pages for _, _, pages in planned)
+
+
+def parse_option(name, default):
+    for arg in sys.argv[1:]:
+        if arg.startswith(f'--{name}='):
+            return arg[len(name) + 3:]
+    return default
+
+
+def resolve_target(arg):
+    """
+    Map a command line target to (account_name, csv_file).
+    Accepts either a stage 0 file name (tweet_id_ethstatus.csv) or an account name (ethstatus).
+    """
+    arg = arg.lstrip('@')
+    if arg.endswith('.csv'):
+        account_name = ''
+        if arg.startswith('tweet_id_'):
+            account_name = arg.replace('tweet_id_', '').replace('.csv', '')
+        return account_name, arg
+    return arg, f"tweet_id_{arg}.csv"
+
+
 def main():
     print(" Twitter Retweeting Users Fetcher")
     print("=" * 50)
@@ -148,76 +255,101 @@ def main():
     if len(sys.argv) < 2:
         print("\n❌ Error: Please provide a CSV file with tweet IDs")
         print("\nUsage:")
-        print("  python 1.get_retweets.py <csv_file>")
+        print("  python 1.get_retweets.py <csv_file|account_name> [csv_file2|account_name2] ...")
         print("\nExample:")
         print("  python 1.get_retweets.py tweet_id_ethstatus.csv")
+        print("  python 1.get_retweets.py ethstatus keycard logos")
+        print("\nSeveral targets share one rate budget: their requests are interleaved.")
+        print("\nOptions:")
+        print("  --requeue   Only retry the tweets in the accounts' dead-letter lists")
+        print("  --sharded   Append to rolling shard files instead of one file per tweet")
+        print("  --archive   Also keep every raw API page in a compressed archive (see replay_archive.py)")
+        print("  --saturation=RATE")
+        print("              Stop an account once its last 50 requests found fewer than RATE new")
+        print("              unique users per request on average")
+        print("\nTweets without retweets are skipped; the others go by expected users per request.")
         return
 
-    csv_file = sys.argv[1]
+    requeue = '--requeue' in sys.argv[1:]
+    sharded = '--sharded' in sys.argv[1:]
+    archived = '--archive' in sys.argv[1:]
+    saturation = float(parse_option('saturation', 0))
+    writers = []
+    archives = []
+    targets = [resolve_target(arg) for arg in sys.argv[1:] if not arg.startswith('--')]
 
-    # Extract account name from CSV filename
-    account_name = ''
-    if csv_file.startswith('tweet_id_') and csv_file.endswith('.csv'):
-        account_name = csv_file.replace('tweet_id_', '').replace('.csv', '')
-        print(f"\n Detected account: @{account_name}")
-
-    # Test authentication first
+    # Test authentication first (once for all targets)
     print("\n Testing authentication...")
     if not test_authentication(ACCESS_TOKEN):
         print("\n❌ Authentication failed. Please check your access token.")
         return
 
-    # Check if file exists
-    input_dir = "twitter_files/0_original_tweets"
-    csv_path = os.path.join(input_dir, csv_file)
+    scheduler = RequestScheduler()
+    scheduler.register_endpoint('retweeted_by', limit=RATE_LIMIT, window=RATE_LIMIT_WINDOW, min_interval=1)
 
-    if not os.path.exists(csv_path):
-        print(f"❌ Error: {csv_file} not found!")
-        print(f"   Looked in: {csv_path}")
-        print(f"   Make sure you've run: python 0.get_tweets.py <username>")
+    input_dir = "twitter_files/0_original_tweets"
+    total_tweets = 0
+    predicted_requests = 0
+
+    for account_name, csv_file in targets:
+        csv_path = os.path.join(input_dir, csv_file)
+
+        if not os.path.exists(csv_path):
+            print(f"❌ Error: {csv_file} not found!")
+            print(f"   Looked in: {csv_path}")
+            print(f"   Make sure you've run: python 0.get_tweets.py <username>")
+            continue
+
+        if requeue:
+            dead_letters = DeadLetterLog('1_retweeting_users', account_name)
+            tweet_ids = dead_letters.read_ids()
+            dead_letters.clear(tweet_ids)
+            print(f"\n💀 Re-queueing {len(tweet_ids)} tweets from {dead_letters.path}")
+        else:
+            print(f"\n📂 Reading tweet IDs from {csv_path}...")
+            tweet_ids = read_tweet_ids(csv_path)
+        print(f" Found {len(tweet_ids)} tweet IDs to process" + (f" for @{account_name}" if account_name else ""))
+
+        writer = open_sharded_writer(account_name) if sharded else None
+        if writer:
+            writers.append(writer)
+        archive = RawArchive('1_retweeting_users', account_name) if archived else None
+        if archive:
+            archives.append(archive)
+        queued, requests = submit_retweeting_users_jobs(scheduler, tweet_ids, account_name, target=account_name or csv_file,
+                                                        writer=writer, archive=archive,
+                                                        retweet_counts=read_retweet_counts(csv_path),
+                                                        saturation=saturation)
+        total_tweets += queued
+        predicted_requests += requests
+
+    if not total_tweets:
+        print("\n❌ No tweet IDs to process")
         return
 
-    print(f"\n📂 Reading tweet IDs from {csv_path}...")
-    tweet_ids = read_tweet_ids(csv_path)
-    print(f" Found {len(tweet_ids)} tweet IDs to process")
-
     # Rate limit information
     print(f"\n⚠️  Rate Limit Info:")
-    print(f"   - Twitter API limit: {RATE_LIMIT} requests per 15 minutes")
-    print(f"   - Your request count: {len(tweet_ids)} tweets")
-    if len(tweet_ids) > RATE_LIMIT:
-        batches = (len(tweet_ids) + RATE_LIMIT - 1) // RATE_LIMIT
-        print(f"   - This will require {batches} batches with 15-minute waits between them")
+    print(f"   - Twitter API limit: {RATE_LIMIT} requests per 15 minutes (shared by all targets)")
+    print(f"   - Your request count: about {predicted_requests} (one per 100 retweets, at least one per tweet)")
+    if predicted_requests > RATE_LIMIT:
+        batches = (predicted_requests + RATE_LIMIT - 1) // RATE_LIMIT
+        print(f"   - This will require at least {batches} batches with 15-minute waits between them")
     else:
         print(f"   - ✅ You're within the rate limit!")
 
-    rate_limiter = RateLimiter(limit=RATE_LIMIT, window=RATE_LIMIT_WINDOW)
-
-    for i, tweet_id in enumerate(tweet_ids, 1):
-        rate_limiter.wait_if_needed()
-
-        print(f"[{i}/{len(tweet_ids)}] Processing tweet {tweet_id}...")
+    scheduler.run()
+    scheduler.show_progress()
 
-        users, total_count = get_retweeting_users(tweet_id, ACCESS_TOKEN)
-
-        # Count actual API requests made (including pagination)
-        # Each page of 100 users = 1 API request
-        pages_fetched = (total_count + 99) // 100 if total_count > 0 else 1
-        rate_limiter.increment(pages_fetched)
-
-        print(f"   ✅ Found {total_count} retweeting users (fetched in {pages_fetched} API request{'s' if pages_fetched > 1 else ''})")
-
-        save_retweeting_users_to_csv(tweet_id, users, account_name)
-
-        # Show progress on rate limit
-        rate_limiter.show_progress(warn_threshold=10, total_items=len(tweet_ids), current_item=i)
-
-        # Small delay between requests
-        if i < len(tweet_ids):
-            time.sleep(1)
+    for writer in writers:
+        writer.close()
+        print(f"💾 Wrote {len(writer.finalized)} shard file(s) to {writer.output_dir}")
+    for archive in archives:
+        archive.close()
+        print(f"🗄️  Archived {archive.pages} raw pages to {archive.directory}")
 
-    print(f"\n🎉 Done! Processed {len(tweet_ids)} tweets")
+    completed = scheduler.stats()['retweeted_by']['completed_jobs']
+    print(f"\n🎉 Done! Processed {completed} of {total_tweets} tweets in {scheduler.requests} API requests")
 
 
 if __name__ == "__main__":
-    main()
+    run_main(globals())
@@ -1,25 +1,33 @@
-import csv
 import os
 import sys
-import glob
+from utils.csv_io import find_entity_files, iter_entity_rows, write_csv_atomic
+from utils.profiling import run_main
+
+# Key functions timed with --profile (see utils/profiling.py)
+PROFILED_FUNCTIONS = {
+    'read_retweeting_users_files': 'csv',
+    'save_engaged_accounts': 'csv',
+}
+
 
 def read_retweeting_users_files(account_name=''):
     """
     Read retweeting users CSV files for a specific account and collect unique users.
+    Each user's engagement_count is the number of distinct tweets of the account they
+    retweeted, so a tweet saved in more than one file (e.g. re-fetched by a --sharded
+    rerun) is counted once.
     Returns a dictionary of users keyed by user_id.
     """
     users_dict = {}
+    users_tweets = {}
 
     input_dir = "twitter_files/1_retweeting_users"
 
-    if account_name:
-        pattern = os.path.join(input_dir, f'{account_name}_*_retweeting_users.csv')
-    else:
-        pattern = os.path.join(input_dir, '*_retweeting_users.csv')
-
-    csv_files = glob.glob(pattern)
+    # Both layouts: one file per tweet, or rolling shards written with --sharded
+    csv_files = find_entity_files(input_dir, account_name, '_retweeting_users.csv')
 
     if not csv_files:
+        pattern = os.path.join(input_dir, f'{account_name}_*_retweeting_users.csv' if account_name else '*_retweeting_users.csv')
         print(f"❌ No files matching pattern '{pattern}' found in current directory")
         return users_dict
 
@@ -28,32 +36,36 @@ def read_retweeting_users_files(account_name=''):
 
     for csv_file in csv_files:
         try:
-            with open(csv_file, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    user_id = row.get('user_id', '').strip()
-
-                    # Skip empty rows or header rows
-                    if not user_id or user_id == 'user_id':
-                        continue
-
-                    # Store user info (only keep first occurrence of each user)
-                    if user_id not in users_dict:
-                        users_dict[user_id] = {
-                            'user_id': user_id,
-                            'username': row.get('username', ''),
-                            'name': row.get('name', ''),
-                            'created_at': row.get('created_at', ''),
-                            'description': row.get('description', ''),
-                            'location': row.get('location', ''),
-                            'verified': row.get('verified', '')
-                        }
+            for tweet_id, row in iter_entity_rows(csv_file, account_name, '_retweeting_users.csv', 'tweet_id'):
+                user_id = row.get('user_id', '').strip()
+
+                # Skip empty rows or header rows
+                if not user_id or user_id == 'user_id':
+                    continue
+
+                # Store user info (only keep first occurrence of each user)
+                if user_id not in users_dict:
+                    users_dict[user_id] = {
+                        'user_id': user_id,
+                        'username': row.get('username', ''),
+                        'name': row.get('name', ''),
+                        'created_at': row.get('created_at', ''),
+                        'description': row.get('description', ''),
+                        'location': row.get('location', ''),
+                        'verified': row.get('verified', ''),
+                        'engagement_count': 0
+                    }
+                    users_tweets[user_id] = set()
+                users_tweets[user_id].add(tweet_id)
 
             print(f"   ✅ Processed {csv_file}")
 
         except Exception as e:
             print(f"   ❌ Error reading {csv_file}: {e}")
 
+    for user_id, tweet_ids in users_tweets.items():
+        users_dict[user_id]['engagement_count'] = len(tweet_ids)
+
     return users_dict
 
 
@@ -73,21 +85,9 @@ def save_engaged_accounts(users_dict, account_name=''):
         print(f"\n❌ No engaged accounts found to save")
         return
 
-    with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(['user_id', 'username', 'name', 'created_at', 'description', 'location', 'verified'])
-
-        for user_id in sorted(users_dict.keys()):
-            user = users_dict[user_id]
-            writer.writerow([
-                user['user_id'],
-                user['username'],
-                user['name'],
-                user['created_at'],
-                user['description'],
-                user['location'],
-                user['verified']
-            ])
+    header = ['user_id', 'username', 'name', 'created_at', 'description', 'location', 'verified', 'engagement_count']
+    write_csv_atomic(filename, header, ([users_dict[user_id][field] for field in header]
+                                        for user_id in sorted(users_dict.keys())))
 
     print(f"\n💾 Saved {len(users_dict)} unique engaged accounts to {filename}")
     return filename
@@ -120,6 +120,7 @@ def main():
 
     print(f"\n Statistics:")
     print(f"   - Total unique accounts: {len(users_dict)}")
+    print(f"   - Accounts that retweeted more than one tweet: {sum(1 for user in users_dict.values() if user['engagement_count'] > 1)}")
 
     save_engaged_accounts(users_dict, account_name)
 
@@ -127,4 +128,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    run_main(globals())
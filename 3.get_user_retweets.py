@@ -1,23 +1,54 @@
-import requests
 import csv
 import os
 import sys
+import threading
 import time
 from datetime import datetime, timedelta
-from utils.twitter_utils import ACCESS_TOKEN, test_authentication, RateLimiter
+from utils.twitter_utils import ACCESS_TOKEN, test_authentication
+from utils.scheduler import RequestScheduler, PageJob
+from utils.retry_utils import get_with_retry, RequestFailed, DeadLetterLog
+from utils.csv_io import write_csv_atomic, ensure_dir, ShardedCsvWriter
+from utils.raw_archive import RawArchive
+from utils.page_parser import TweetPage, decode_json
+from utils.snapshot_utils import build_snapshot
+from utils.work_shards import (ShardQueue, default_worker_name, get_part_name, merge_worker_outputs,
+                               missing_users_by_shard, parse_shard, select_shard)
+from utils.profiling import run_main
 
 # Rate limit constants
 RATE_LIMIT = 900  # requests per window
 RATE_LIMIT_WINDOW = 900  # 15 minutes in seconds
 
+OUTPUT_DIR = "twitter_files/3_user_retweets"
+INPUT_DIR = "twitter_files/2_engaged_accounts"
+USER_TWEETS_HEADER = ['retweet_id', 'text', 'created_at', 'retweeted_tweet_id', 'lang', 'conversation_id']
 
-def get_user_tweets(user_id, access_token, max_results=100):
+# Key functions timed with --profile (see utils/profiling.py)
+PROFILED_FUNCTIONS = {
+    'get_user_tweets': 'fetch',
+    'fetch_user_tweets_page': 'fetch',
+    'parse_retweet_rows': 'parse',
+    'save_user_tweets_to_csv': 'csv',
+    'read_engaged_accounts': 'csv',
+}
+
+
+def parse_retweet_rows(tweets):
     """
-    Fetch retweets from a specific user using Twitter API v2.
-    Filters to get only retweets (not original tweets, replies, or quotes).
-    Handles pagination to get all retweets beyond the 100-tweet limit per request.
-    Returns a list of retweet data dictionaries and the total count.
+    Keep only retweets (not original tweets, replies, or quotes) from a page of tweets,
+    as CSV rows (see USER_TWEETS_HEADER). The page is walked once, see utils/page_parser.py.
+    """
+    return TweetPage(tweets).retweet_rows()
+
 
+def fetch_user_tweets_page(user_id, access_token, pagination_token=None, max_results=100, archive=None):
+    """
+    Fetch one page of a user's tweets using Twitter API v2 and keep only retweets
+    (not original tweets, replies, or quotes).
+    Transient failures (429, 5xx, timeouts) are retried with backoff.
+    If a RawArchive is given, the raw page is archived before it is filtered.
+    Returns (retweet_rows, next_token), the rows ready for save_user_tweets_to_csv.
+    Raises RequestFailed if the page cannot be fetched.
     """
     url = f"https://api.twitter.com/2/users/{user_id}/tweets"
 
@@ -26,125 +57,113 @@ def get_user_tweets(user_id, access_token, max_results=100):
         "Content-Type": "application/json"
     }
 
+    params = {
+        "max_results": max_results,
+        "tweet.fields": "id,text,author_id,created_at,public_metrics,lang,conversation_id,referenced_tweets"
+    }
+
+    if pagination_token:
+        params["pagination_token"] = pagination_token
+
+    try:
+        response = get_with_retry(url, headers, params, endpoint='users_tweets')
+    except RequestFailed as e:
+        if e.status == 403:
+            print(f"❌ Error fetching tweets for user {user_id}: 403 Forbidden")
+            print(f"   Response: {e.detail}")
+            print(f"   ⚠️  This could mean:")
+            print(f"       - The user account is protected/private")
+            print(f"       - The user doesn't exist or was suspended")
+        elif e.status == 401:
+            print(f"❌ Authorization error for user {user_id}: 401 Unauthorized")
+            print(f"   Your access token may have expired. Please refresh it.")
+        else:
+            print(f"❌ Error fetching tweets for user {user_id}: {e}")
+        if archive:
+            archive.append_failure(user_id, pagination_token, e)
+        raise
+
+    data = decode_json(response.content)
+    if archive:
+        archive.append(user_id, pagination_token, data)
+
+    # Filter to keep only retweets
+    retweet_rows = parse_retweet_rows(data.get('data', []))
+
+    return retweet_rows, data.get('meta', {}).get('next_token')
+
+
+def get_user_tweets(user_id, access_token, max_results=100):
+    """
+    Fetch retweets from a specific user using Twitter API v2.
+    Filters to get only retweets (not original tweets, replies, or quotes).
+    Handles pagination to get all retweets beyond the 100-tweet limit per request.
+    Returns a list of retweet CSV rows and the total count.
+    Raises RequestFailed if a page cannot be fetched, rather than returning a partial list.
+    """
     all_tweets = []
     pagination_token = None
     page_count = 0
-    total_fetched = 0
 
     while True:
         page_count += 1
 
-        params = {
-            "max_results": max_results,
-            "tweet.fields": "id,text,author_id,created_at,public_metrics,lang,conversation_id,referenced_tweets"
-        }
+        retweets, pagination_token = fetch_user_tweets_page(user_id, access_token, pagination_token, max_results)
+        all_tweets.extend(retweets)
 
         if pagination_token:
-            params["pagination_token"] = pagination_token
-
-        try:
-            response = requests.get(url, headers=headers, params=params)
-
-            if response.status_code == 200:
-                data = response.json()
-                tweets = data.get('data', [])
-                meta = data.get('meta', {})
-
-                # Filter to keep only retweets
-                retweets = []
-                for tweet in tweets:
-                    referenced_tweets = tweet.get('referenced_tweets', [])
-                    is_retweet = any(ref.get('type') == 'retweeted' for ref in referenced_tweets)
-                    if is_retweet:
-                        retweets.append(tweet)
-
-                # Add retweets from this page
-                all_tweets.extend(retweets)
-                total_fetched += len(retweets)
-
-                pagination_token = meta.get('next_token')
-
-                if pagination_token:
-                    print(f"      📄 Fetched page {page_count}: {len(tweets)} tweets (total so far: {total_fetched})")
-                    time.sleep(0.5)  # Small delay between pagination requests
-                else:
-                    break
-
-            elif response.status_code == 429:
-                print(f"⚠️  Rate limit reached. Waiting 15 minutes...")
-                time.sleep(900)
-                # Don't increment page_count, retry the same request
-                continue
-            elif response.status_code == 403:
-                print(f"❌ Error fetching tweets for user {user_id}: 403 Forbidden")
-                print(f"   Response: {response.text}")
-                print(f"   ⚠️  This could mean:")
-                print(f"       - The user account is protected/private")
-                print(f"       - The user doesn't exist or was suspended")
-                print(f"   Skipping this user...")
-                break
-            elif response.status_code == 401:
-                print(f"❌ Authorization error for user {user_id}: 401 Unauthorized")
-                print(f"   Your access token may have expired. Please refresh it.")
-                break
-            else:
-                print(f"❌ Error fetching tweets for user {user_id}: {response.status_code}")
-                print(f"   Response: {response.text}")
-                break
-
-        except Exception as e:
-            print(f"❌ Exception for user {user_id}: {e}")
+            print(f"      📄 Fetched page {page_count}: {len(retweets)} retweets (total so far: {len(all_tweets)})")
+            time.sleep(0.5)  # Small delay between pagination requests
+        else:
             break
 
-    return all_tweets, total_fetched
+    return all_tweets, len(all_tweets)
 
 
-def save_user_tweets_to_csv(user_id, username, tweets, account_name=''):
+def save_user_tweets_to_csv(user_id, username, rows, account_name='', writer=None):
     """
-    Save user tweets data to a CSV file in organized folder structure.
+    Save a user's retweet rows (as returned by fetch_user_tweets_page), either to the
+    user's own file (written atomically) or, if a ShardedCsvWriter is given, to the
+    account's rolling shard files.
     """
-    output_dir = "twitter_files/3_user_retweets"
-    os.makedirs(output_dir, exist_ok=True)
+    if writer:
+        writer.write_entity(user_id, rows)
+        if not rows:
+            print(f"   No retweets found for user @{username}")
+        else:
+            print(f"   💾 Saved {len(rows)} tweets of @{username} to shard")
+        return writer.output_dir
 
+    ensure_dir(OUTPUT_DIR)
 
     if account_name:
-        filename = os.path.join(output_dir, f"{account_name}_{user_id}_tweets.csv")
+        filename = os.path.join(OUTPUT_DIR, f"{account_name}_{user_id}_tweets.csv")
     else:
-        filename = os.path.join(output_dir, f"{user_id}_tweets.csv")
+        filename = os.path.join(OUTPUT_DIR, f"{user_id}_tweets.csv")
+
+    write_csv_atomic(filename, USER_TWEETS_HEADER, rows)
 
-    if not tweets:
+    if not rows:
         print(f"   No retweets found for user @{username}")
-        with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(['retweet_id', 'text', 'created_at', 'retweeted_tweet_id', 'lang', 'conversation_id'])
-        return filename
-
-    with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(['retweet_id', 'text', 'created_at', 'retweeted_tweet_id', 'lang', 'conversation_id'])
-
-        for tweet in tweets:
-            referenced_tweets = tweet.get('referenced_tweets', [])
-
-            retweeted_tweet_id = ''
-            for ref in referenced_tweets:
-                if ref.get('type') == 'retweeted':
-                    retweeted_tweet_id = ref.get('id', '')
-                    break
-
-            writer.writerow([
-                tweet.get('id', ''),
-                tweet.get('text', '').replace('\n', ' '),
-                tweet.get('created_at', ''),
-                retweeted_tweet_id,
-                tweet.get('lang', ''),
-                tweet.get('conversation_id', '')
-            ])
-
-    print(f"   💾 Saved {len(tweets)} tweets to {filename}")
+    else:
+        print(f"   💾 Saved {len(rows)} tweets to {filename}")
     return filename
 
 
+def open_sharded_writer(account_name=''):
+    """
+    Rolling shard writer for an account's user retweets (see utils/csv_io.py).
+    """
+    return ShardedCsvWriter(OUTPUT_DIR, account_name, '_tweets.csv', 'user_id', USER_TWEETS_HEADER)
+
+
+def parse_option(name, default):
+    for arg in sys.argv[1:]:
+        if arg.startswith(f'--{name}='):
+            return arg[len(name) + 3:]
+    return default
+
+
 def read_engaged_accounts(csv_file):
     """
     Read user IDs from the engaged_accounts.csv file.
@@ -155,11 +174,117 @@ def read_engaged_accounts(csv_file):
         for row in reader:
             user_id = row.get('user_id', '').strip()
             username = row.get('username', '').strip()
+            engagement_count = row.get('engagement_count', '').strip()
             if user_id:  # Skip empty rows
-                user_accounts.append({'user_id': user_id, 'username': username})
+                user_accounts.append({
+                    'user_id': user_id,
+                    'username': username,
+                    'engagement_count': int(engagement_count) if engagement_count.isdigit() else 0
+                })
     return user_accounts
 
 
+def fetch_user_retweets(user_accounts, account_name, part_name=None, sharded=False, archive=None,
+                        on_progress=None):
+    """
+    Fetch and save the retweets of a list of engaged accounts, most engaged first.
+    part_name (a work shard's name, see utils/work_shards.py) keeps the rolling shard
+    files and dead letters of concurrent workers apart. on_progress is called after
+    every user, e.g. to renew a shard claim; when it returns False (the claim was
+    lost), no more users are fetched or saved and the rolling shard files written
+    so far are discarded.
+    Returns {'successful', 'failed', 'tweets', 'dead_letters', 'claim_lost'}.
+    """
+    # Most engaged users first: they matter most if the run is interrupted
+    scheduler = RequestScheduler(progress_every=50)
+    scheduler.register_endpoint('users_tweets', limit=RATE_LIMIT, window=RATE_LIMIT_WINDOW, min_interval=0.5)
+
+    results = {'successful': 0, 'failed': 0, 'tweets': 0}
+    writer = open_sharded_writer(part_name or account_name) if sharded else None
+    dead_letters = DeadLetterLog('3_user_retweets', part_name or account_name)
+    lost = threading.Event()
+
+    def on_complete(account, tweets, error):
+        if lost.is_set():
+            return
+        if on_progress and not on_progress():
+            lost.set()
+            cancelled = scheduler.cancel('users_tweets', lambda job: True)
+            print(f"\n⚠️  Shard claim lost to another worker, dropping {len(cancelled)} queued users")
+            return
+        if error:
+            # Never save a partial timeline: record the user for a cheap re-queue instead
+            results['failed'] += 1
+            dead_letters.add(account['user_id'], error, items_fetched=len(tweets))
+            print(f"   💀 @{account['username']} added to {dead_letters.path} ({error.failure_class})")
+            return
+        if tweets:
+            results['successful'] += 1
+            results['tweets'] += len(tweets)
+            print(f"   ✅ @{account['username']}: {len(tweets)} retweets")
+        else:
+            results['failed'] += 1
+        save_user_tweets_to_csv(account['user_id'], account['username'], tweets, account_name, writer)
+
+    for account in user_accounts:
+        scheduler.submit('users_tweets', PageJob(
+            account['user_id'],
+            lambda token, user_id=account['user_id']: fetch_user_tweets_page(user_id, ACCESS_TOKEN, token, archive=archive),
+            lambda tweets, error, account=account: on_complete(account, tweets, error)
+        ), priority=account['engagement_count'])
+
+    scheduler.run()
+    scheduler.show_progress()
+
+    if writer and lost.is_set():
+        print(f"🗑️  Discarded {writer.discard()} shard file(s) of the lost claim")
+    elif writer:
+        writer.close()
+        print(f"💾 Wrote {len(writer.finalized)} shard file(s) to {writer.output_dir}")
+
+    results['dead_letters'] = dead_letters.count
+    results['claim_lost'] = lost.is_set()
+    return results
+
+
+def requeue_dead_letters(user_accounts, name):
+    """
+    Keep only the accounts in the dead-letter list of an account (or work shard) and clear them from it.
+    """
+    dead_letters = DeadLetterLog('3_user_retweets', name)
+    requeued = set(dead_letters.read_ids())
+    dead_letters.clear(requeued)
+    print(f"💀 Re-queueing {sum(1 for a in user_accounts if a['user_id'] in requeued)} users from {dead_letters.path}")
+    return [account for account in user_accounts if account['user_id'] in requeued]
+
+
+def merge_workers(account_name, worker_dirs, shard_count):
+    """
+    Combine the tweet files of distributed workers into the local output directory,
+    report which shards still miss users and build the snapshot for step 4.
+    """
+    print(f"\n Merging the tweet files of {len(worker_dirs)} worker(s) for: @{account_name}")
+    stats = merge_worker_outputs(worker_dirs, OUTPUT_DIR, account_name, '_tweets.csv')
+    print(f"   - Files copied: {stats['copied']} (already up to date: {stats['skipped']})")
+    if stats['dead_letters']:
+        print(f"   - Dead-letter lists copied: {stats['dead_letters']}")
+
+    csv_path = os.path.join(INPUT_DIR, f'{account_name}_engaged_accounts.csv')
+    if os.path.exists(csv_path):
+        missing = missing_users_by_shard(read_engaged_accounts(csv_path), OUTPUT_DIR, account_name,
+                                         '_tweets.csv', 'user_id', shard_count)
+        if missing:
+            print(f"   ⚠️  {sum(missing.values())} engaged users have no tweet file yet")
+            if shard_count > 1:
+                for shard in sorted(missing):
+                    print(f"      shard {shard}/{shard_count}: {missing[shard]} users")
+        else:
+            print(f"   ✅ Every engaged user has a tweet file")
+
+    print()
+    build_snapshot(account_name)
+
+
 def main():
     print(" Twitter User Retweets Fetcher")
     print("=" * 50)
@@ -172,9 +297,39 @@ def main():
         print("\nExample:")
         print("  python 3.get_user_retweets.py ethstatus")
         print("\nThis will read from: ethstatus_engaged_accounts.csv")
+        print("\nOptions:")
+        print("  --snapshot-only   Compact existing tweet files into a binary snapshot (no API calls)")
+        print("  --requeue         Only retry the users in the account's dead-letter list")
+        print("  --sharded         Append to rolling shard files instead of one file per user")
+        print("  --archive         Also keep every raw API page in a compressed archive (see replay_archive.py)")
+        print("\nDistributed mode (one worker per machine/credentials, see utils/work_shards.py):")
+        print("  --shard=I/N       Only fetch shard I (0..N-1) of the engaged accounts")
+        print("  --queue=PATH --shards=N")
+        print("                    Claim shards from a shared SQLite queue until none is left")
+        print("  --merge=DIR[,DIR] Copy the workers' tweet files here and build the snapshot (no API calls)")
         return
 
     account_name = sys.argv[1].lstrip('@')  # Remove @ if present
+    options = sys.argv[2:]
+
+    if '--snapshot-only' in options:
+        print(f"\n Compacting tweet files for: @{account_name}")
+        build_snapshot(account_name)
+        return
+
+    try:
+        shard_spec = parse_option('shard', None)
+        shard, shard_count = parse_shard(shard_spec) if shard_spec else (None, int(parse_option('shards', '1')))
+    except ValueError as e:
+        print(f"❌ {e}")
+        return
+    queue_path = parse_option('queue', None)
+
+    merge_dirs = parse_option('merge', None)
+    if merge_dirs:
+        merge_workers(account_name, [d for d in merge_dirs.split(',') if d], shard_count)
+        return
+
     print(f"\n Processing engaged accounts for: @{account_name}")
 
     # Test authentication first
@@ -184,12 +339,11 @@ def main():
         return
 
     # Read engaged accounts from CSV with account name prefix
-    input_dir = "twitter_files/2_engaged_accounts"
     csv_filename = f'{account_name}_engaged_accounts.csv'
-    csv_path = os.path.join(input_dir, csv_filename)
+    csv_path = os.path.join(INPUT_DIR, csv_filename)
 
     if not os.path.exists(csv_path):
-        print(f"❌ Error: {csv_filename} not found in {input_dir}!")
+        print(f"❌ Error: {csv_filename} not found in {INPUT_DIR}!")
         print(f"   Please run: python 2.get_engaged_accounts.py {account_name}")
         return
 
@@ -197,54 +351,96 @@ def main():
     user_accounts = read_engaged_accounts(csv_path)
     print(f" Found {len(user_accounts)} engaged accounts to process")
 
+    requeue = '--requeue' in options
+    if requeue and shard is None and not queue_path:
+        user_accounts = requeue_dead_letters(user_accounts, account_name)
+
     # Rate limit information
     print(f"\n⚠️  Rate Limit Info:")
     print(f"   - Twitter API limit: {RATE_LIMIT} requests per 15 minutes")
     print(f"   - This is a HIGH rate limit endpoint!")
     print(f"   - Note: Each user may require multiple API requests if they have >100 tweets")
     print(f"   - The script will automatically manage rate limits and wait when needed")
+    print(f"   - Users who retweeted the most of @{account_name}'s tweets are fetched first")
+
+    sharded = '--sharded' in options
+    archive = RawArchive('3_user_retweets', account_name) if '--archive' in options else None
+    results = {'successful': 0, 'failed': 0, 'tweets': 0, 'dead_letters': 0}
+    processed = 0
+
+    def run_shard(shard, on_progress=None):
+        part_name = get_part_name(account_name, shard)
+        shard_accounts = select_shard(user_accounts, shard, shard_count)
+        if requeue:
+            shard_accounts = requeue_dead_letters(shard_accounts, part_name)
+        print(f"\n🧩 Shard {shard}/{shard_count}: {len(shard_accounts)} engaged accounts")
+        shard_results = fetch_user_retweets(shard_accounts, account_name, part_name, sharded, archive, on_progress)
+        if shard_results.pop('claim_lost'):
+            return None
+        for key, value in shard_results.items():
+            results[key] += value
+        return len(shard_accounts)
+
+    if queue_path:
+        queue = ShardQueue(queue_path, account_name, shard_count)
+        worker = default_worker_name()
+        print(f"\n🧩 Worker {worker} claiming shards of @{account_name} from {queue_path}")
+        while True:
+            shard = queue.claim(worker)
+            if shard is None:
+                break
+            try:
+                shard_users = run_shard(shard, lambda shard=shard: queue.heartbeat(shard, worker))
+            except BaseException:
+                queue.release(shard, worker)
+                raise
+            if shard_users is None:
+                print(f"🧩 Shard {shard} was reclaimed by another worker after its lease expired here, moving on")
+                continue
+            if not queue.finish(shard, worker, shard_users):
+                print(f"🧩 Shard {shard} was reclaimed by another worker before it finished here")
+            processed += shard_users
+        status = queue.status()
+        queue.close()
+        print(f"\n🧩 No shard left to claim ({status.get('done', 0)}/{shard_count} done, "
+              f"{status.get('claimed', 0)} still claimed by other workers)")
+    elif shard is not None:
+        processed = run_shard(shard)
+    else:
+        processed = len(user_accounts)
+        results = fetch_user_retweets(user_accounts, account_name, sharded=sharded, archive=archive)
 
-    rate_limiter = RateLimiter(limit=RATE_LIMIT, window=RATE_LIMIT_WINDOW)
-    successful_accounts = 0
-    failed_accounts = 0
-    total_tweets = 0
-
-    for i, account in enumerate(user_accounts, 1):
-        user_id = account['user_id']
-        username = account['username']
-
-        rate_limiter.wait_if_needed()
-
-        print(f"[{i}/{len(user_accounts)}] Processing @{username} (ID: {user_id})...")
-
-        tweets, total_count = get_user_tweets(user_id, ACCESS_TOKEN)
-
-        # Count actual API requests made (including pagination)
-        # Each page of 100 tweets = 1 API request
-        pages_fetched = (total_count + 99) // 100 if total_count > 0 else 1
-        rate_limiter.increment(pages_fetched)
-
-        if total_count > 0:
-            successful_accounts += 1
-            total_tweets += total_count
-            print(f"   ✅ Found {total_count} retweets (fetched in {pages_fetched} API request{'s' if pages_fetched > 1 else ''})")
-        else:
-            failed_accounts += 1
-
-        save_user_tweets_to_csv(user_id, username, tweets, account_name)
-
-        rate_limiter.show_progress(warn_threshold=50, total_items=len(user_accounts), current_item=i)
+    if archive:
+        archive.close()
+        print(f"🗄️  Archived {archive.pages} raw pages to {archive.directory}")
 
-        # Small delay between requests
-        if i < len(user_accounts):
-            time.sleep(0.5)
+    successful_accounts = results['successful']
+    failed_accounts = results['failed']
+    total_tweets = results['tweets']
 
-    print(f"\n🎉 Done! Processed {len(user_accounts)} accounts")
+    print(f"\n🎉 Done! Processed {processed} accounts")
     print(f"   ✅ Successful: {successful_accounts}")
     print(f"   ❌ Failed/Empty: {failed_accounts}")
+    if results['dead_letters']:
+        print(f"   💀 Failed permanently: {results['dead_letters']} (re-run with --requeue)")
     print(f"   📊 Total retweets collected: {total_tweets}")
-    print(f"\n💾 Output files: {account_name}_{{user_id}}_tweets.csv")
+    distributed = shard is not None or queue_path
+    if sharded and distributed:
+        print(f"\n💾 Output files: {account_name}_part-{{i}}_shard-{{n}}_tweets.csv")
+    elif sharded:
+        print(f"\n💾 Output files: {account_name}_shard-{{n}}_tweets.csv")
+    else:
+        print(f"\n💾 Output files: {account_name}_{{user_id}}_tweets.csv")
+
+    if distributed:
+        # The snapshot covers every worker's files, so it is built by the merge step
+        print(f"\n🧩 When every shard is done, run: python 3.get_user_retweets.py {account_name} --merge=<worker dirs>")
+        return
+
+    # Compact into a columnar snapshot so step 4 can skip the CSV parse
+    print()
+    build_snapshot(account_name)
 
 
 if __name__ == "__main__":
-    main()
+    run_main(globals())
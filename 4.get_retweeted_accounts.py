@@ -1,8 +1,35 @@
 import csv
 import os
 import sys
-import glob
 import re
+from utils.snapshot_utils import load_fresh_snapshot
+from utils.csv_io import find_accounts_files, find_entity_files, iter_entity_rows
+from utils.heavy_hitters import DistinctHeavyHitters
+from utils.handle_counts import HandleCounts, get_counts_state_path
+from utils.cograph import read_user_handles
+from utils.reports import compare_rankings, get_comparison_path
+from utils.profiling import run_main
+
+INPUT_DIR = "twitter_files/3_user_retweets"
+
+# Key functions timed with --profile (see utils/profiling.py)
+PROFILED_FUNCTIONS = {
+    'read_tweets_files': 'read',
+    'find_changed_files': 'read',
+    'read_user_handles': 'csv',
+    'update_handle_counts': 'aggregate',
+    'read_tweets_files_by_account': 'read',
+    'compare_rankings': 'aggregate',
+    'save_comparison': 'csv',
+    'verify_comparison': 'read',
+    'read_snapshot': 'read',
+    'read_snapshot_files': 'read',
+    'extract_retweeted_handle': 'regex',
+    'resolve_handle_ids': 'fetch',
+    'save_handle_counts': 'csv',
+    'save_top_retweeted_accounts': 'csv',
+}
+
 
 def extract_retweeted_handle(text):
     """
@@ -18,66 +45,110 @@ def extract_retweeted_handle(text):
     return None
 
 
-def read_tweets_files(account_names=None):
+def read_snapshot(snapshot, handles_users, counter=None):
+    """
+    Add the (handle, user) pairs of a memory-mapped snapshot to handles_users,
+    or stream them into counter (a DistinctHeavyHitters) if one is given.
+    Returns the number of tweets and of retweets with handles read.
+    """
+    if counter is not None:
+        handles = snapshot.dictionary('handle')
+        total_handles_extracted = 0
+        for code, user_id in zip(snapshot['handle'], snapshot['user_id']):
+            if code >= 0:
+                total_handles_extracted += 1
+                counter.add(handles[code], str(user_id))
+        return snapshot.rows, total_handles_extracted
+
+    users_by_code = {}
+    total_handles_extracted = 0
+
+    for code, user_id in zip(snapshot['handle'], snapshot['user_id']):
+        if code < 0:
+            continue
+        total_handles_extracted += 1
+        if code in users_by_code:
+            users_by_code[code].add(user_id)
+        else:
+            users_by_code[code] = {user_id}
+
+    handles = snapshot.dictionary('handle')
+    for code, user_ids in users_by_code.items():
+        handle = handles[code]
+        if handle not in handles_users:
+            handles_users[handle] = set()
+        handles_users[handle].update(str(user_id) for user_id in user_ids)
+
+    return snapshot.rows, total_handles_extracted
+
+
+def read_tweets_files(account_names=None, use_snapshots=True, counter=None):
     """
     Read all *_tweets.csv files for specific accounts and collect retweeted handles.
+    Accounts with an up-to-date snapshot (see 3.get_user_retweets.py --snapshot-only)
+    are loaded from it instead of parsing their CSVs.
     Returns a dictionary mapping handles to sets of users who retweeted them.
+    If a counter is given (anything with add(handle, user_id), e.g. DistinctHeavyHitters
+    or clustering.IncidenceBuilder), the pairs are streamed into it instead and the
+    returned dictionary stays empty.
     """
     handles_users = {}
     all_csv_files = []
+    snapshot_accounts = []
+
+    input_dir = INPUT_DIR
 
-    input_dir = "twitter_files/3_user_retweets"
+    total_tweets_processed = 0
+    total_handles_extracted = 0
 
     if account_names:
         for account_name in account_names:
-            pattern = os.path.join(input_dir, f'{account_name}_*_tweets.csv')
-            csv_files = glob.glob(pattern)
-            all_csv_files.extend(csv_files)
+            snapshot = load_fresh_snapshot(account_name, input_dir) if use_snapshots else None
+            if snapshot:
+                with snapshot:
+                    tweets_count, handles_count = read_snapshot(snapshot, handles_users, counter)
+                total_tweets_processed += tweets_count
+                total_handles_extracted += handles_count
+                snapshot_accounts.append(account_name)
+                print(f" Loaded {tweets_count} tweets for @{account_name} from snapshot {snapshot.path}")
+                continue
+
+            # Both layouts: one file per user, or rolling shards written with --sharded
+            csv_files = find_entity_files(input_dir, account_name, '_tweets.csv')
+            all_csv_files.extend((account_name, csv_file) for csv_file in csv_files)
             if csv_files:
                 print(f" Found {len(csv_files)} tweet files for @{account_name}")
     else:
-        pattern = os.path.join(input_dir, '*_tweets.csv')
-        all_csv_files = glob.glob(pattern)
+        all_csv_files = [('', csv_file) for csv_file in find_entity_files(input_dir, '', '_tweets.csv')]
 
-    if not all_csv_files:
+    if not all_csv_files and not snapshot_accounts:
         print(f"❌ No matching tweet files found")
         return handles_users
 
     print(f" Total files to process: {len(all_csv_files)}")
     print()
 
-    total_tweets_processed = 0
-    total_handles_extracted = 0
-
-    for csv_file in all_csv_files:
+    for account_name, csv_file in all_csv_files:
         try:
-            filename = os.path.basename(csv_file)
-
-            user_id = filename
-            if account_names:
-                for account_name in account_names:
-                    user_id = user_id.replace(f'{account_name}_', '')
-            user_id = user_id.replace('_tweets.csv', '')
+            for user_id, row in iter_entity_rows(csv_file, account_name, '_tweets.csv', 'user_id'):
+                text = row.get('text', '').strip()
 
-            with open(csv_file, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    text = row.get('text', '').strip()
-
-                    if not text:
-                        continue
+                if not text:
+                    continue
 
-                    total_tweets_processed += 1
+                total_tweets_processed += 1
 
-                    handle = extract_retweeted_handle(text)
+                handle = extract_retweeted_handle(text)
 
-                    if handle:
-                        total_handles_extracted += 1
-                        # Track which users retweeted this handle (deduplicated by set)
-                        if handle in handles_users:
-                            handles_users[handle].add(user_id)
-                        else:
-                            handles_users[handle] = {user_id}
+                if handle:
+                    total_handles_extracted += 1
+                    if counter is not None:
+                        counter.add(handle, user_id)
+                    # Track which users retweeted this handle (deduplicated by set)
+                    elif handle in handles_users:
+                        handles_users[handle].add(user_id)
+                    else:
+                        handles_users[handle] = {user_id}
 
             print(f"   ✅ Processed {csv_file}")
 
@@ -88,14 +159,163 @@ def read_tweets_files(account_names=None):
     print(f"📊 Statistics:")
     print(f"   - Total tweets processed: {total_tweets_processed}")
     print(f"   - Total retweets with handles: {total_handles_extracted}")
-    print(f"   - Unique retweeted accounts: {len(handles_users)}")
+    if counter is None:
+        print(f"   - Unique retweeted accounts: {len(handles_users)}")
 
     return handles_users
 
 
-def save_retweeted_accounts(handles_users, account_names=None):
+def read_tweets_files_by_account(account_names, use_snapshots=True):
+    """
+    Read several accounts' tweet files in a single pass over the input directory,
+    each row tagged with the account whose file it came from (accounts with an
+    up-to-date snapshot are loaded from it instead).
+    An account's audience is the users with at least one non-empty tweet row, the
+    rows a snapshot keeps, so both sources give the same shares.
+    Returns ({account: {handle: set of user IDs}}, {account: set of user IDs read}).
+    """
+    handles_users_by_account = {account_name: {} for account_name in account_names}
+    audiences = {account_name: set() for account_name in account_names}
+
+    csv_accounts = []
+    for account_name in account_names:
+        snapshot = load_fresh_snapshot(account_name, INPUT_DIR) if use_snapshots else None
+        if not snapshot:
+            csv_accounts.append(account_name)
+            continue
+        with snapshot:
+            tweets_count, _ = read_snapshot(snapshot, handles_users_by_account[account_name])
+            audiences[account_name].update(str(user_id) for user_id in snapshot['user_id'])
+        print(f" Loaded {tweets_count} tweets for @{account_name} from snapshot {snapshot.path}")
+
+    files_by_account = find_accounts_files(INPUT_DIR, csv_accounts, '_tweets.csv')
+    for account_name in csv_accounts:
+        handles_users = handles_users_by_account[account_name]
+        audience = audiences[account_name]
+        print(f" Found {len(files_by_account[account_name])} tweet files for @{account_name}")
+        for csv_file in files_by_account[account_name]:
+            try:
+                for user_id, row in iter_entity_rows(csv_file, account_name, '_tweets.csv', 'user_id'):
+                    text = row.get('text', '').strip()
+                    if not text:
+                        continue
+                    audience.add(user_id)
+                    handle = extract_retweeted_handle(text)
+                    if not handle:
+                        continue
+                    if handle in handles_users:
+                        handles_users[handle].add(user_id)
+                    else:
+                        handles_users[handle] = {user_id}
+            except Exception as e:
+                print(f"   ❌ Error reading {csv_file}: {e}")
+
+    return handles_users_by_account, audiences
+
+
+def read_snapshot_files(snapshot):
+    """
+    Split a snapshot back into the per-file contributions HandleCounts keeps:
+    {path: (mtime, size, {user_id: set of handles})}, with the mtime and size the
+    files had when the snapshot was built.
+    """
+    handles = snapshot.dictionary('handle')
+    files = snapshot.header['files']
+    user_handles_by_file = [{} for _ in files]
+    for file_index, user_id, code in zip(snapshot['file'], snapshot['user_id'], snapshot['handle']):
+        user_handles = user_handles_by_file[file_index].setdefault(str(user_id), set())
+        if code >= 0:
+            user_handles.add(handles[code])
+    return {path: (mtime, size, user_handles)
+            for (path, mtime, size), user_handles in zip(files, user_handles_by_file)}
+
+
+def find_changed_files(account_names, sources):
+    """
+    Compare the accounts' tweet files with the counted ones. Returns (changed, deleted):
+    the (account, file, mtime, size) of new or rewritten files, and the counted files that are gone.
+    """
+    changed = []
+    current = set()
+    for account_name in account_names:
+        for csv_file in find_entity_files(INPUT_DIR, account_name, '_tweets.csv'):
+            stat = os.stat(csv_file)
+            current.add(csv_file)
+            if sources.get(csv_file) != [stat.st_mtime, stat.st_size]:
+                changed.append((account_name, csv_file, stat.st_mtime, stat.st_size))
+    deleted = [csv_file for csv_file in sources if csv_file not in current]
+    return changed, deleted
+
+
+def update_handle_counts(account_names, rebuild=False, use_snapshots=True):
+    """
+    Bring the accounts' incremental handle counts up to date: only new, rewritten and
+    deleted tweet files are read (see utils/handle_counts.py).
+    Without a state file (first run or rebuild), the counts are seeded from the accounts'
+    up-to-date snapshots, so only the files of accounts without one are parsed.
+    Returns a dictionary mapping handles to their number of unique users.
+    """
+    state_path = get_counts_state_path(account_names)
+    counts = None if rebuild else HandleCounts.load(state_path)
+    seeded = counts is None
+    if seeded:
+        counts = HandleCounts()
+        for account_name in account_names:
+            snapshot = load_fresh_snapshot(account_name, INPUT_DIR) if use_snapshots else None
+            if snapshot:
+                with snapshot:
+                    counts.update(read_snapshot_files(snapshot))
+                print(f" Seeded counts of {snapshot.header['source_files']} tweet files for @{account_name} "
+                      f"from snapshot {snapshot.path}")
+    else:
+        print(f" Loaded counts of {len(counts.sources)} tweet files ({counts.user_count()} users) from {state_path}")
+
+    changed_files, deleted_files = find_changed_files(account_names, counts.sources)
+    if not changed_files and not deleted_files:
+        if seeded:
+            counts.save(state_path)
+        print(f" No new, changed or deleted tweet files, the counts are up to date")
+        return counts.as_dict()
+
+    print(f" Reading {len(changed_files)} new or changed tweet files"
+          + (f", dropping {len(deleted_files)} deleted ones" if deleted_files else "") + "...")
+    changed = {}
+    for account_name, csv_file, mtime, size in changed_files:
+        try:
+            changed[csv_file] = (mtime, size, read_user_handles(csv_file, account_name))
+        except Exception as e:
+            print(f"   ❌ Error reading {csv_file}: {e}")
+
+    changed_users = counts.update(changed, deleted_files)
+    counts.save(state_path)
+    handle_counts = counts.as_dict()
+
+    print()
+    print(f"📊 Statistics:")
+    print(f"   - Tweet files counted: {len(counts.sources)} ({len(changed)} read this run)")
+    print(f"   - Users whose handles changed: {changed_users} (of {counts.user_count()})")
+    print(f"   - Unique retweeted accounts: {len(handle_counts)}")
+    return handle_counts
+
+
+def resolve_handle_ids(handles):
+    """
+    Resolve retweeted handles to stable user IDs through the persistent user cache.
+    Only handles missing from the cache cost API calls (100 handles per request),
+    throttled to the users lookup rate limit, so a large ranking waits for the
+    budget instead of hitting 429s. Returns a dict of lowercase handle -> user ID.
+    """
+    from utils.twitter_utils import ACCESS_TOKEN
+    from utils.user_cache import UserCache
+
+    cache = UserCache()
+    return cache.resolve(handles, ACCESS_TOKEN)
+
+
+def save_handle_counts(handle_counts, account_names=None, handle_ids=None):
     """
-    Save retweeted accounts to CSV, sorted by number of unique users.
+    Save {handle: unique users} to CSV, sorted by number of unique users.
+    If handle_ids is given, a user_id column is added next to each handle.
     """
     output_dir = "twitter_files/4_retweeted_accounts"
     os.makedirs(output_dir, exist_ok=True)
@@ -106,22 +326,25 @@ def save_retweeted_accounts(handles_users, account_names=None):
     else:
         filename = os.path.join(output_dir, 'retweeted_accounts.csv')
 
-    if not handles_users:
+    if not handle_counts:
         print(f"\n❌ No retweeted accounts found to save")
         return
 
-    # Convert sets to counts and sort by count (descending), then by username (ascending)
-    handles_count = [(handle, len(users)) for handle, users in handles_users.items()]
-    sorted_handles = sorted(handles_count, key=lambda x: (-x[1], x[0]))
+    # Sort by count (descending), then by username (ascending)
+    sorted_handles = sorted(handle_counts.items(), key=lambda x: (-x[1], x[0]))
 
     with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
         writer = csv.writer(csvfile)
-        writer.writerow(['username', 'unique_users_count'])
-
-        for username, count in sorted_handles:
-            writer.writerow([username, count])
-
-    print(f"\n Saved {len(handles_users)} unique retweeted accounts to {filename}")
+        if handle_ids is None:
+            writer.writerow(['username', 'unique_users_count'])
+            for username, count in sorted_handles:
+                writer.writerow([username, count])
+        else:
+            writer.writerow(['username', 'user_id', 'unique_users_count'])
+            for username, count in sorted_handles:
+                writer.writerow([username, handle_ids.get(username.lower(), ''), count])
+
+    print(f"\n Saved {len(handle_counts)} unique retweeted accounts to {filename}")
     print(f"   (Sorted by unique user count, highest first)")
 
     # Show top 10
@@ -132,6 +355,138 @@ def save_retweeted_accounts(handles_users, account_names=None):
     return filename
 
 
+def save_top_retweeted_accounts(counter, top, account_names=None, handle_ids=None):
+    """
+    Save the approximate top handles of a streaming count to CSV, highest estimate first.
+    The error_bound column is the most a handle's estimate can be inflated by evictions;
+    sketched handles also have a standard error of counter.relative_error.
+    """
+    output_dir = "twitter_files/4_retweeted_accounts"
+    os.makedirs(output_dir, exist_ok=True)
+
+    if account_names:
+        accounts_str = '_'.join(account_names)
+        filename = os.path.join(output_dir, f'{accounts_str}_retweeted_accounts.csv')
+    else:
+        filename = os.path.join(output_dir, 'retweeted_accounts.csv')
+
+    top_handles = counter.top(top)
+    if not top_handles:
+        print(f"\n❌ No retweeted accounts found to save")
+        return
+
+    with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile)
+        if handle_ids is None:
+            writer.writerow(['username', 'unique_users_count', 'error_bound'])
+            for username, estimate, error in top_handles:
+                writer.writerow([username, estimate, error])
+        else:
+            writer.writerow(['username', 'user_id', 'unique_users_count', 'error_bound'])
+            for username, estimate, error in top_handles:
+                writer.writerow([username, handle_ids.get(username.lower(), ''), estimate, error])
+
+    print(f"\n Saved the top {len(top_handles)} retweeted accounts to {filename}")
+    print(f"   (Approximate unique user counts: each may be too high by its error_bound,")
+    print(f"    and off by about ±{counter.relative_error:.1%} once above {counter.exact_threshold} users)")
+    print(f"   Tracked {counter.capacity} candidates over {counter.pairs} retweets, {counter.evictions} evictions")
+
+    print(f"\n Top 10 most retweeted accounts (by estimated unique users):")
+    for i, (username, estimate, error) in enumerate(top_handles[:10], 1):
+        bound = f" (±{error})" if error else ""
+        print(f"   {i}. @{username} - retweeted by ~{estimate}{bound} unique users")
+
+    return filename
+
+
+def save_comparison(comparison, handle_ids=None):
+    """
+    Save a comparison (see utils/reports.py compare_rankings) to CSV: one row per handle with
+    each account's unique users, audience share and distinctiveness side by side.
+    """
+    account_names = comparison['accounts']
+    filename = get_comparison_path(account_names)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+    header = ['username'] + (['user_id'] if handle_ids is not None else []) + ['total_users', 'accounts_count']
+    for account in account_names:
+        header += [f'{account}_users', f'{account}_share', f'{account}_distinctiveness']
+
+    with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(header)
+        for row in comparison['rows']:
+            values = [row['handle']]
+            if handle_ids is not None:
+                values.append(handle_ids.get(row['handle'].lower(), ''))
+            values += [row['total_users'], row['accounts_count']]
+            for account in account_names:
+                values += [row['users'][account], f"{row['share'][account]:.4f}",
+                           f"{row['distinctiveness'][account]:.3f}"]
+            writer.writerow(values)
+
+    print(f"\n Saved the comparison of {len(comparison['rows'])} retweeted accounts to {filename}")
+    return filename
+
+
+def verify_comparison(account_names, comparison):
+    """
+    Recompute a comparison from the tweet CSVs alone and report where it differs from
+    the given one (loaded from snapshots where they exist). Returns True if they match.
+    """
+    print(f"\n Verifying the comparison against the tweet CSVs...")
+    csv_comparison = compare_rankings(*read_tweets_files_by_account(account_names, use_snapshots=False))
+    if csv_comparison == comparison:
+        print(f"✅ Snapshots and CSVs give the same comparison ({len(comparison['rows'])} handles)")
+        return True
+
+    print(f"❌ Snapshots and CSVs disagree")
+    if csv_comparison['audience_sizes'] != comparison['audience_sizes']:
+        print(f"   Audience sizes: {comparison['audience_sizes']} (CSVs: {csv_comparison['audience_sizes']})")
+    csv_rows = {row['handle']: row for row in csv_comparison['rows']}
+    differing = [row['handle'] for row in comparison['rows'] if csv_rows.pop(row['handle'], None) != row]
+    differing.extend(csv_rows)
+    if differing:
+        print(f"   {len(differing)} handles differ, e.g. {', '.join('@' + handle for handle in differing[:10])}")
+    return False
+
+
+def show_comparison(comparison, top, min_users):
+    """
+    Print each account's top handles and its most distinctive ones (retweeted by at least
+    min_users of its users), then the shared and unique handle counts.
+    """
+    rows = comparison['rows']
+    for account in comparison['accounts']:
+        size = comparison['audience_sizes'][account]
+        print(f"\n @{account} ({size} users with retweets read):")
+        ranked = sorted((row for row in rows if row['users'][account]), key=lambda row: (-row['users'][account], row['handle']))
+        print(f"   Most retweeted:")
+        for i, row in enumerate(ranked[:top], 1):
+            print(f"   {i}. @{row['handle']} - {row['users'][account]} users ({row['share'][account]:.1%}), "
+                  f"distinctiveness {row['distinctiveness'][account]:.2f}")
+        distinctive = sorted((row for row in ranked if row['users'][account] >= min_users),
+                             key=lambda row: (-row['distinctiveness'][account], row['handle']))
+        print(f"   Most distinctive (retweeted by {min_users}+ users):")
+        for i, row in enumerate(distinctive[:top], 1):
+            print(f"   {i}. @{row['handle']} - {row['distinctiveness'][account]:.2f}x, "
+                  f"{row['users'][account]} users ({row['share'][account]:.1%})")
+
+    print(f"\n📊 Shared and unique handles:")
+    print(f"   - Retweeted by the audiences of all {len(comparison['accounts'])} accounts: {comparison['shared_by_all']}")
+    for account, count in comparison['unique'].items():
+        print(f"   - Only by @{account}'s audience: {count}")
+
+
+def parse_int_option(name, default):
+    for arg in sys.argv[1:]:
+        if arg.startswith(f'--{name}='):
+            value = arg[len(name) + 3:]
+            if value.isdigit():
+                return int(value)
+    return default
+
+
 def main():
     print(" Retweeted Accounts Extractor")
     print("=" * 50)
@@ -146,25 +501,91 @@ def main():
         print("  python 4.get_retweeted_accounts.py ethstatus keycard")
         print("  python 4.get_retweeted_accounts.py ethstatus keycard logos")
         print("\nThis will process all files matching: <account>_*_tweets.csv")
+        print("\nRe-runs only read new or changed tweet files (the counts are kept in a state file).")
+        print("\nOptions:")
+        print("  --rebuild       Recount every tweet file into a new state file")
+        print("  --full          Count everything from the snapshot or the CSVs, without the state file")
+        print("  --no-snapshot   Parse the tweet CSVs even if a snapshot exists (by default, a first run or")
+        print("                  --rebuild seeds the state file from up-to-date snapshots)")
+        print("  --resolve-ids   Add a user_id column (cached lookups are free, others use the API,")
+        print("                  100 handles per request, within the users lookup rate limit)")
+        print("  --streaming     Approximate top-N in fixed memory instead of exact counts for every handle")
+        print("  --top=N         Number of handles to keep with --streaming (default 100)")
+        print("  --capacity=K    Candidate handles tracked with --streaming (default 10x top, at least 1000)")
+        print("  --compare       Rank each account separately in one pass, side by side, with shared and")
+        print("                  unique handles and distinctiveness scores (instead of one blended ranking)")
+        print("  --min-users=N   Users a handle needs to be listed as distinctive with --compare (default 5)")
+        print("  --verify-snapshot  With --compare, also compare from the CSVs alone and report any difference")
         return
 
-    account_names = [arg.lstrip('@') for arg in sys.argv[1:]]
+    use_snapshots = '--no-snapshot' not in sys.argv[1:]
+    account_names = [arg.lstrip('@') for arg in sys.argv[1:] if not arg.startswith('--')]
 
     print(f"\n Processing tweet files for {len(account_names)} account(s):")
     for account in account_names:
         print(f"   - @{account}")
     print()
 
-    handles_users = read_tweets_files(account_names)
+    if '--compare' in sys.argv[1:]:
+        if len(account_names) < 2:
+            print("❌ Error: --compare needs at least two account names")
+            return
+        handles_users_by_account, audiences = read_tweets_files_by_account(account_names, use_snapshots)
+        comparison = compare_rankings(handles_users_by_account, audiences)
+        if not comparison['rows']:
+            print(f"\n❌ No retweeted accounts found.")
+            return
+
+        handle_ids = None
+        if '--resolve-ids' in sys.argv[1:]:
+            print(f"\n Resolving user IDs for {len(comparison['rows'])} handles...")
+            handle_ids = resolve_handle_ids([row['handle'] for row in comparison['rows']])
+
+        show_comparison(comparison, parse_int_option('top', 10), parse_int_option('min-users', 5))
+        if '--verify-snapshot' in sys.argv[1:]:
+            verify_comparison(account_names, comparison)
+        filename = save_comparison(comparison, handle_ids)
+        print(f"\n🎉 Done! Comparison saved to {filename}")
+        return
+
+    if '--streaming' in sys.argv[1:]:
+        top = parse_int_option('top', 100)
+        capacity = parse_int_option('capacity', max(10 * top, 1000))
+        counter = DistinctHeavyHitters(capacity)
+        print(f" Streaming mode: top {top} handles, {capacity} candidates (~{counter.memory_bound() / 1e6:.0f} MB max)")
+        read_tweets_files(account_names, use_snapshots, counter)
+
+        if not counter.candidates:
+            print(f"\n❌ No retweeted accounts found.")
+            return
 
-    if not handles_users:
+        handle_ids = None
+        if '--resolve-ids' in sys.argv[1:]:
+            top_handles = [handle for handle, _, _ in counter.top(top)]
+            print(f"\n Resolving user IDs for {len(top_handles)} handles...")
+            handle_ids = resolve_handle_ids(top_handles)
+
+        save_top_retweeted_accounts(counter, top, account_names, handle_ids)
+        return
+
+    if '--full' in sys.argv[1:]:
+        handle_counts = {handle: len(users) for handle, users in read_tweets_files(account_names, use_snapshots).items()}
+    else:
+        handle_counts = update_handle_counts(account_names, '--rebuild' in sys.argv[1:], use_snapshots)
+
+    if not handle_counts:
         print(f"\n❌ No retweeted accounts found.")
         print(f"   Make sure you've run 3.get_user_retweets.py for these accounts:")
         for account in account_names:
             print(f"   - python 3.get_user_retweets.py {account}")
         return
 
-    save_retweeted_accounts(handles_users, account_names)
+    handle_ids = None
+    if '--resolve-ids' in sys.argv[1:]:
+        print(f"\n Resolving user IDs for {len(handle_counts)} handles...")
+        handle_ids = resolve_handle_ids(list(handle_counts))
+
+    save_handle_counts(handle_counts, account_names, handle_ids)
 
     accounts_str = '_'.join(account_names)
     output_file = f'{accounts_str}_retweeted_accounts.csv'
@@ -172,4 +593,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    run_main(globals())
@@ -0,0 +1,127 @@
+import os
+import sys
+from utils.stages import load_stage
+from utils.csv_io import write_csv_atomic
+from utils.clustering import METHODS, IncidenceBuilder, cluster_users, summarize_segments, sklearn_available
+from utils.profiling import run_main
+
+OUTPUT_DIR = "twitter_files/5_audience_segments"
+
+# Key functions timed with --profile (see utils/profiling.py)
+PROFILED_FUNCTIONS = {
+    'read_incidence': 'aggregate',
+    'cluster_users': 'cluster',
+    'summarize_segments': 'aggregate',
+    'save_segments': 'csv',
+}
+
+
+def parse_option(name, default):
+    for arg in sys.argv[1:]:
+        if arg.startswith(f'--{name}='):
+            return arg[len(name) + 3:]
+    return default
+
+
+def read_incidence(account_names, min_users, use_snapshots=True):
+    """
+    Stream the accounts' (handle, user) pairs (from snapshots or CSVs, as in Script 4)
+    straight into the sparse user x handle matrix.
+    Returns the Incidence, or None if no retweeted handle was found.
+    """
+    builder = IncidenceBuilder()
+    load_stage(4).read_tweets_files(account_names, use_snapshots, builder)
+    if not builder.handles:
+        return None
+    return builder.build(min_users)
+
+
+def save_segments(incidence, labels, segments, account_names):
+    """
+    Save the segments' top accounts and each user's segment.
+    Returns (segments file, user segments file).
+    """
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    accounts_str = '_'.join(account_names)
+
+    segments_file = os.path.join(OUTPUT_DIR, f'{accounts_str}_segments.csv')
+    rows = []
+    for segment in segments:
+        for rank, (handle, users, share, lift) in enumerate(segment['accounts'], 1):
+            rows.append([segment['segment'], segment['size'], rank, handle, users, f"{share:.4f}", f"{lift:.2f}"])
+    write_csv_atomic(segments_file, ['segment', 'segment_size', 'rank', 'username', 'users_in_segment', 'share', 'lift'], rows)
+
+    users_file = os.path.join(OUTPUT_DIR, f'{accounts_str}_user_segments.csv')
+    write_csv_atomic(users_file, ['user_id', 'segment'], zip(incidence.users, labels))
+
+    return segments_file, users_file
+
+
+def main():
+    print(" Audience Segmenter")
+    print("=" * 50)
+
+    # Check for command line arguments
+    if len(sys.argv) < 2:
+        print("\n❌ Error: Please provide at least one account name")
+        print("\nUsage:")
+        print("  python 5.cluster_audience.py <account_name1> [account_name2] ...")
+        print("\nExamples:")
+        print("  python 5.cluster_audience.py ethstatus")
+        print("  python 5.cluster_audience.py ethstatus keycard --segments=8")
+        print("\nThis reads the same tweet files (or snapshots) as 4.get_retweeted_accounts.py")
+        print("\nOptions:")
+        print("  --segments=K      Number of audience segments (default 12)")
+        print("  --method=NAME     kmeans (needs scikit-learn) or sparse-kmeans (default: kmeans if installed)")
+        print("  --min-users=N     Ignore handles retweeted by fewer than N users (default 3)")
+        print("  --top=N           Top accounts listed per segment (default 10)")
+        print("  --no-snapshot     Parse the tweet CSVs even if a snapshot exists")
+        return
+
+    account_names = [arg.lstrip('@') for arg in sys.argv[1:] if not arg.startswith('--')]
+    n_segments = int(parse_option('segments', '12'))
+    min_users = int(parse_option('min-users', '3'))
+    top = int(parse_option('top', '10'))
+    method = parse_option('method', None)
+
+    if method not in (None,) + METHODS:
+        print(f"❌ Unknown method: {method} (use {' or '.join(METHODS)})")
+        return
+    if method == 'kmeans' and not sklearn_available():
+        print("❌ The kmeans method needs numpy, scipy and scikit-learn: pip install scikit-learn")
+        return
+
+    print(f"\n Segmenting the engaged audience of {len(account_names)} account(s):")
+    for account in account_names:
+        print(f"   - @{account}")
+    print()
+
+    incidence = read_incidence(account_names, min_users, '--no-snapshot' not in sys.argv[1:])
+    if incidence is None:
+        print(f"\n❌ No retweeted accounts found.")
+        print(f"   Make sure you've run 3.get_user_retweets.py for these accounts")
+        return
+
+    if not incidence.users:
+        print(f"\n❌ No handle is retweeted by at least {min_users} users, lower --min-users")
+        return
+
+    print(f"\n Matrix: {len(incidence.users)} users x {len(incidence.handles)} handles, {incidence.pairs} pairs")
+
+    labels, method = cluster_users(incidence, n_segments, method)
+    segments = summarize_segments(incidence, labels, top)
+    print(f" Found {len(segments)} segments with {method}")
+
+    segments_file, users_file = save_segments(incidence, labels, segments, account_names)
+
+    for segment in segments:
+        accounts = ', '.join(f"@{handle} (x{lift:.1f})" for handle, _, _, lift in segment['accounts'][:5])
+        print(f"\n   Segment {segment['segment']}: {segment['size']} users")
+        print(f"      Top accounts: {accounts}")
+
+    print(f"\n🎉 Done! Segments saved to {segments_file}")
+    print(f"   User segments saved to {users_file}")
+
+
+if __name__ == "__main__":
+    run_main(globals())
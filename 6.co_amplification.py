@@ -0,0 +1,174 @@
+import os
+import sys
+from utils.csv_io import account_of_file, find_entity_files
+from utils.cograph import (CoGraph, CoGraphBuilder, DEFAULT_MAX_USER_HANDLES, DEFAULT_MIN_SUPPORT,
+                           get_graph_path, get_state_path, read_user_handles)
+from utils.profiling import run_main
+
+INPUT_DIR = "twitter_files/3_user_retweets"
+
+# Key functions timed with --profile (see utils/profiling.py)
+PROFILED_FUNCTIONS = {
+    'find_changed_files': 'read',
+    'read_user_handles': 'csv',
+    'update_graph': 'aggregate',
+    'show_neighbors': 'query',
+}
+
+
+def parse_option(name, default):
+    for arg in sys.argv[1:]:
+        if arg.startswith(f'--{name}='):
+            return arg[len(name) + 3:]
+    return default
+
+
+def find_changed_files(account_names, sources):
+    """
+    Compare the accounts' tweet files with the counted ones. Returns (changed, deleted):
+    the (account, file, mtime, size) of new or rewritten files, and the counted files that are gone.
+    """
+    changed = []
+    current = set()
+    for account_name in account_names:
+        for csv_file in find_entity_files(INPUT_DIR, account_name, '_tweets.csv'):
+            stat = os.stat(csv_file)
+            current.add(csv_file)
+            if sources.get(csv_file, [None, None])[:2] != [stat.st_mtime, stat.st_size]:
+                changed.append((account_name, csv_file, stat.st_mtime, stat.st_size))
+    deleted = [csv_file for csv_file in sources if csv_file not in current]
+    return changed, deleted
+
+
+def update_graph(account_names, min_support, max_user_handles, rebuild=False):
+    """
+    Count the co-amplification pairs of new, rewritten or deleted tweet files and rewrite the graph.
+    A user's handles are the union over all of their files (a re-fetched user can show up
+    in two shard files). Returns the graph path, or None if there was nothing to count.
+    """
+    state_path = get_state_path(account_names)
+    builder = None if rebuild else CoGraphBuilder.load(state_path)
+    if builder and (builder.min_support, builder.max_user_handles) != (min_support, max_user_handles):
+        print(f" Pruning settings changed, rebuilding from scratch")
+        builder = None
+    if builder and not all(isinstance(source, list) for source in builder.sources.values()):
+        print(f" State from an older version without the file manifest, rebuilding from scratch")
+        builder = None
+    if builder is None:
+        builder = CoGraphBuilder(min_support, max_user_handles)
+    else:
+        print(f" Loaded state with {len(builder.users)} users and {len(builder.pairs)} counted pairs")
+
+    changed_files, deleted_files = find_changed_files(account_names, builder.sources)
+    graph_path = get_graph_path(account_names)
+    if not changed_files and not deleted_files and os.path.exists(graph_path):
+        print(f" No new, changed or deleted tweet files, the graph is up to date")
+        return graph_path
+    if not changed_files and not builder.users:
+        print(f"❌ No tweet files found")
+        return None
+
+    print(f" Counting {len(changed_files)} new or changed tweet files"
+          + (f", dropping {len(deleted_files)} deleted ones" if deleted_files else "") + "...")
+    touched = set()
+    for csv_file in deleted_files:
+        touched.update(builder.sources.pop(csv_file)[2])
+    file_handles = {}
+    for account_name, csv_file, mtime, size in changed_files:
+        if csv_file in builder.sources:
+            touched.update(builder.sources[csv_file][2])
+        file_handles[csv_file] = read_user_handles(csv_file, account_name)
+        builder.sources[csv_file] = [mtime, size, sorted(file_handles[csv_file])]
+        touched.update(file_handles[csv_file])
+
+    user_files = {}
+    for csv_file, (_, _, user_ids) in builder.sources.items():
+        for user_id in user_ids:
+            if user_id in touched:
+                user_files.setdefault(user_id, []).append(csv_file)
+
+    user_handles = {}
+    for user_id in touched:
+        handles = user_handles[user_id] = set()
+        for csv_file in user_files.get(user_id, ()):
+            if csv_file not in file_handles:
+                # An unchanged file of a user who also is in a changed one
+                account_name = account_of_file(os.path.basename(csv_file), account_names, '_tweets.csv')
+                file_handles[csv_file] = read_user_handles(csv_file, account_name)
+            handles.update(file_handles[csv_file][user_id])
+    removed = [user_id for user_id in touched if user_id not in user_files]
+    for user_id in removed:
+        del user_handles[user_id]
+
+    builder.remove(removed)
+    changed_users = builder.update(user_handles)
+    builder.save(state_path)
+    edge_count = builder.write_graph(graph_path)
+
+    print(f"\n📊 Statistics:")
+    print(f"   - Users added or updated: {changed_users}, removed: {len(removed)}")
+    print(f"   - Users total: {len(builder.users)}")
+    print(f"   - Handles total: {len(builder.handles)} ({len(builder.frequent)} retweeted by {min_support}+ users)")
+    print(f"   - Pairs counted: {len(builder.pairs)}")
+    print(f"   - Edges kept (support >= {min_support}): {edge_count}")
+    return graph_path
+
+
+def show_neighbors(graph_path, handle, top):
+    with CoGraph.open(graph_path) as graph:
+        neighbors = graph.neighbors(handle, top)
+        if graph.handle_id(handle) is None:
+            print(f"\n❌ @{handle.lstrip('@')} is not in the graph")
+            return
+        print(f"\n Accounts most often retweeted by the same users as @{handle.lstrip('@')}:")
+        if not neighbors:
+            print(f"   (none with {graph.header['min_support']}+ shared users)")
+        for i, (other, co_users, cosine) in enumerate(neighbors, 1):
+            print(f"   {i}. @{other} - {co_users} shared users (cosine {cosine:.3f})")
+
+
+def main():
+    print(" Co-Amplification Graph")
+    print("=" * 50)
+
+    # Check for command line arguments
+    if len(sys.argv) < 2:
+        print("\n❌ Error: Please provide at least one account name")
+        print("\nUsage:")
+        print("  python 6.co_amplification.py <account_name1> [account_name2] ... [--neighbors=HANDLE]")
+        print("\nExamples:")
+        print("  python 6.co_amplification.py ethstatus")
+        print("  python 6.co_amplification.py ethstatus --neighbors=VitalikButerin --top=20")
+        print("\nThis links handles retweeted by the same users, reading the same tweet files as")
+        print("4.get_retweeted_accounts.py. Re-runs only count new, rewritten or deleted files.")
+        print("\nOptions:")
+        print(f"  --min-support=N       Keep pairs shared by at least N users (default {DEFAULT_MIN_SUPPORT})")
+        print(f"  --max-user-handles=N  Skip users with more than N distinct handles (default {DEFAULT_MAX_USER_HANDLES})")
+        print("  --rebuild             Count everything from scratch")
+        print("  --neighbors=HANDLE    Show the handle's strongest co-amplified accounts")
+        print("  --top=N               Number of neighbors to show (default 20)")
+        return
+
+    account_names = [arg.lstrip('@') for arg in sys.argv[1:] if not arg.startswith('--')]
+    min_support = int(parse_option('min-support', DEFAULT_MIN_SUPPORT))
+    max_user_handles = int(parse_option('max-user-handles', DEFAULT_MAX_USER_HANDLES))
+
+    print(f"\n Building the co-amplification graph for {len(account_names)} account(s):")
+    for account in account_names:
+        print(f"   - @{account}")
+    print()
+
+    graph_path = update_graph(account_names, min_support, max_user_handles, '--rebuild' in sys.argv[1:])
+    if not graph_path:
+        print(f"   Make sure you've run 3.get_user_retweets.py for these accounts")
+        return
+
+    handle = parse_option('neighbors', None)
+    if handle:
+        show_neighbors(graph_path, handle, int(parse_option('top', 20)))
+
+    print(f"\n🎉 Done! Graph saved to {graph_path}")
+
+
+if __name__ == "__main__":
+    run_main(globals())
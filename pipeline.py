@@ -0,0 +1,183 @@
+"""
+Pipeline CLI
+One entry point for all stages and local queries:
+
+    python pipeline.py <command> [args...]
+
+Commands are imported only when they run, so local commands (2, 4, 5, 6,
+snapshot, overlap, report, serve, profile, cache) never import `requests` or the API utilities and start fast.
+"""
+
+import sys
+
+USAGE = """
+Usage:
+  python pipeline.py <command> [args...]
+
+Network stages (use the Twitter API):
+  0 <username> [...]           Get original tweets          (0.get_tweets.py)
+  1 <account> [...]            Get retweeting users         (1.get_retweets.py)
+  3 <account>                  Get user retweets            (3.get_user_retweets.py)
+
+Local commands (no API calls):
+  2 <account>                  Aggregate engaged accounts   (2.get_engaged_accounts.py)
+  4 <account> [...]            Rank retweeted accounts      (4.get_retweeted_accounts.py)
+  5 <account> [...]            Segment the engaged audience (5.cluster_audience.py)
+  6 <account> [...]            Co-amplification graph       (6.co_amplification.py)
+  snapshot <account>           Compact stage 3 files into a binary snapshot
+  replay <stage> <account>     Regenerate outputs from the raw archive (replay_archive.py)
+  overlap <account> <account> [...]
+                               Shared engaged users between accounts
+  report <account> [...] [--top=N]
+                               Top retweeted accounts from a stage 4 ranking
+  serve [account ...] [--port=N]
+                               Local HTTP query API over the outputs (query_server.py)
+  profile <report.json> [<new.json>]
+                               Show a --profile report, or compare two runs
+  cache [--clear]              HTTP response cache hit rates and size, or empty it
+
+Options of each stage are passed through, e.g.:
+  python pipeline.py 3 ethstatus --sharded
+  python pipeline.py 4 ethstatus --profile     (also --profile=cprofile or --profile=sample)
+"""
+
+
+def run_stage(number, args):
+    """
+    Run a numbered stage script's main() as if it had been started directly.
+    """
+    from utils.stages import load_stage, STAGE_FILES
+    from utils.profiling import run_main
+
+    sys.argv = [STAGE_FILES[number]] + args
+    run_main(vars(load_stage(number)))
+
+
+def run_snapshot(args):
+    from utils.snapshot_utils import build_snapshot
+
+    if not args:
+        print("❌ Error: Please provide an account name")
+        return
+    build_snapshot(args[0].lstrip('@'))
+
+
+def run_replay(args):
+    import replay_archive
+
+    sys.argv = ['replay_archive.py'] + args
+    replay_archive.main()
+
+
+def run_serve(args):
+    import query_server
+
+    sys.argv = ['query_server.py'] + args
+    query_server.main()
+
+
+def run_profile(args):
+    import json
+    from utils.profiling import compare_reports, print_report
+
+    if len(args) == 1:
+        with open(args[0], 'r', encoding='utf-8') as f:
+            print_report(json.load(f))
+    elif len(args) == 2:
+        compare_reports(args[0], args[1])
+    else:
+        print("❌ Error: Please provide one profile report, or two to compare")
+
+
+def run_cache(args):
+    from utils.http_cache import CACHE_PATH, HttpCache
+
+    cache = HttpCache()
+    if '--clear' in args:
+        cache.clear()
+        print(f"🗑️  Cleared {CACHE_PATH}")
+        return
+
+    stats = cache.stats()
+    if not stats:
+        print(f"HTTP cache {CACHE_PATH} is empty")
+        return
+    print(f"HTTP cache {CACHE_PATH} (cap {cache.max_bytes / 1024 / 1024:.0f} MB):")
+    for endpoint, stat in sorted(stats.items()):
+        print(f"   {endpoint}: {stat['hits']} hits, {stat['misses']} misses ({stat['hit_rate']:.0%} hit rate), "
+              f"{stat['entries']} entries, {stat['bytes'] / 1024:.0f} KB, {stat['evictions']} evicted")
+
+
+def parse_top(args, default=10):
+    for arg in args:
+        if arg.startswith('--top='):
+            value = arg[len('--top='):]
+            if value.isdigit():
+                return int(value)
+    return default
+
+
+def run_overlap(args):
+    from utils.reports import engaged_overlap
+
+    account_names = [arg.lstrip('@') for arg in args if not arg.startswith('--')]
+    if len(account_names) < 2:
+        print("❌ Error: Please provide at least two account names")
+        return
+
+    overlap = engaged_overlap(account_names)
+    print("Engaged audience sizes:")
+    for account, size in overlap['audience_sizes'].items():
+        print(f"   @{account}: {size} users")
+    print("Shared engaged users:")
+    for pair in overlap['pairs']:
+        first, second = pair['accounts']
+        print(f"   @{first} & @{second}: {pair['shared']} users (Jaccard {pair['jaccard']:.3f})")
+    if len(account_names) > 2:
+        print(f"   Engaged with all {len(account_names)} accounts: {overlap['shared_by_all']} users")
+
+
+def run_report(args):
+    from utils.reports import read_ranking, get_ranking_path
+
+    account_names = [arg.lstrip('@') for arg in args if not arg.startswith('--')]
+    top = parse_top(args)
+    rows = read_ranking(account_names, top)
+    if rows is None:
+        print(f"❌ {get_ranking_path(account_names)} not found")
+        print(f"   Please run: python pipeline.py 4 {' '.join(account_names)}")
+        return
+
+    print(f"Top {len(rows)} retweeted accounts for {', '.join('@' + a for a in account_names) or 'all accounts'}:")
+    for i, row in enumerate(rows, 1):
+        print(f"   {i}. @{row['username']} - retweeted by {row['unique_users_count']} unique users")
+
+
+COMMANDS = {
+    'snapshot': run_snapshot,
+    'replay': run_replay,
+    'overlap': run_overlap,
+    'report': run_report,
+    'serve': run_serve,
+    'profile': run_profile,
+    'cache': run_cache,
+}
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] in ('-h', '--help', 'help'):
+        print(USAGE)
+        return
+
+    command, args = sys.argv[1], sys.argv[2:]
+    if command.isdigit() and int(command) <= 6:
+        run_stage(int(command), args)
+    elif command in COMMANDS:
+        COMMANDS[command](args)
+    else:
+        print(f"❌ Unknown command: {command}")
+        print(USAGE)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Local Query Server
+Long-running HTTP service over the aggregated outputs, for dashboards that would
+otherwise re-run 4.get_retweeted_accounts.py (and re-parse every file) per request.
+
+    python query_server.py [account ...] [--port=8765] [--host=127.0.0.1]
+                           [--reload-interval=5] [--cache-size=1024]
+
+The accounts' indexes are loaded into memory once (see utils/query_index.py),
+answers are cached in an LRU cache, and a background thread reloads an account
+when new stage outputs land on disk. Without account names, every account with
+an engaged accounts file is served (and new ones are picked up).
+
+Endpoints (GET, JSON responses):
+    /status                                  loaded accounts, generation, cache stats
+    /ranking?accounts=a,b&top=100&since=&until=
+                                             most retweeted handles, optionally in a time window
+    /overlap?accounts=a,b                    shared engaged users between accounts
+    /users/<user_id>?accounts=&since=&until=&top=20
+                                             a user's engagement and most retweeted handles
+
+since/until are epoch seconds or UTC dates (2024-01-31 or 2024-01-31T12:00:00), like the
+API's created_at; the window is [since, until). first_retweet/last_retweet are epoch seconds.
+"""
+
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from utils.query_index import DEFAULT_CACHE_SIZE, QueryIndex
+from utils.snapshot_utils import to_epoch
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_RELOAD_INTERVAL = 5
+
+
+def parse_option(name, default):
+    for arg in sys.argv[1:]:
+        if arg.startswith(f'--{name}='):
+            return arg[len(name) + 3:]
+    return default
+
+
+def parse_time(value):
+    """
+    Epoch seconds or an ISO date/time, None if not given. Raises ValueError otherwise.
+    """
+    if not value:
+        return None
+    if value.isdigit():
+        return int(value)
+    epoch = to_epoch(value if 'T' in value else f"{value}T00:00:00")
+    if not epoch:
+        raise ValueError(f"Invalid time {value!r}, use epoch seconds or YYYY-MM-DD[THH:MM:SS]")
+    return epoch
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    index = None  # set by serve()
+
+    def log_message(self, format, *args):
+        pass  # one line per request would drown the reload messages
+
+    def send_json(self, status, body):
+        data = json.dumps(body, separators=(',', ':')).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split('/') if part]
+        account_names = [name.lstrip('@') for name in query.get('accounts', '').split(',') if name]
+
+        try:
+            since, until = parse_time(query.get('since')), parse_time(query.get('until'))
+            top = int(query.get('top', 0)) or None
+            if parts == ['status']:
+                result = self.index.status()
+            elif parts == ['ranking']:
+                result = self.index.ranking(account_names, top or 100, since, until)
+            elif parts == ['overlap']:
+                result = self.index.overlap(account_names)
+            elif len(parts) == 2 and parts[0] == 'users' and parts[1].isdigit():
+                result = self.index.user(parts[1], account_names, since, until, top or 20)
+                if result is None:
+                    self.send_json(404, {'error': f"User {parts[1]} not found"})
+                    return
+            else:
+                self.send_json(404, {'error': f"Unknown endpoint {url.path}"})
+                return
+        except KeyError as e:
+            self.send_json(404, {'error': e.args[0]})
+            return
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        self.send_json(200, result)
+
+
+def watch_for_changes(index, interval):
+    """
+    Reload the accounts whose outputs changed, every `interval` seconds.
+    """
+    while True:
+        time.sleep(interval)
+        try:
+            started = time.time()
+            reloaded = index.reload_changed()
+            if reloaded:
+                print(f"🔄 Reloaded {', '.join('@' + name for name in reloaded)} in {time.time() - started:.1f}s")
+        except Exception as e:
+            print(f"   ⚠️  Reload failed, still serving the previous data: {e}")
+
+
+def serve(account_names, host, port, reload_interval, cache_size):
+    started = time.time()
+    index = QueryIndex(account_names, cache_size)
+    index.reload_changed()  # records the current file state
+    for account in index.status()['accounts']:
+        print(f"   - @{account['account']}: {account['engaged_users']} engaged users, "
+              f"{account['retweets']} retweets of {account['handles']} handles ({account['source']})")
+    print(f" Loaded {len(index.accounts)} account(s) in {time.time() - started:.1f}s")
+
+    if reload_interval > 0:
+        threading.Thread(target=watch_for_changes, args=(index, reload_interval), daemon=True).start()
+
+    QueryHandler.index = index
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    print(f"\n🌐 Serving on http://{host}:{port}/ (try /status, /ranking?top=10)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n Stopped")
+    finally:
+        server.server_close()
+
+
+def main():
+    print(" Local Query Server")
+    print("=" * 50)
+
+    if any(arg in ('-h', '--help') for arg in sys.argv[1:]):
+        print(__doc__)
+        return
+
+    account_names = [arg.lstrip('@') for arg in sys.argv[1:] if not arg.startswith('--')]
+    print(f"\n Loading {'@' + ', @'.join(account_names) if account_names else 'every account'}...")
+    serve(account_names,
+          parse_option('host', DEFAULT_HOST),
+          int(parse_option('port', DEFAULT_PORT)),
+          float(parse_option('reload-interval', DEFAULT_RELOAD_INTERVAL)),
+          int(parse_option('cache-size', DEFAULT_CACHE_SIZE)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import csv
+import os
+import sys
+from utils.stages import load_stage
+from utils.raw_archive import list_segments, segments_for_entities, iter_complete_entities
+
+# Archived stage -> archive name used by the stage's --archive flag
+ARCHIVE_STAGES = {
+    0: '0_original_tweets',
+    1: '1_retweeting_users',
+    3: '3_user_retweets',
+}
+
+
+def read_usernames(account_name):
+    """
+    Map user IDs to usernames from the account's engaged accounts file (stage 3 file names use IDs,
+    the messages use usernames).
+    """
+    csv_path = os.path.join("twitter_files/2_engaged_accounts", f"{account_name}_engaged_accounts.csv")
+    usernames = {}
+    if os.path.exists(csv_path):
+        with open(csv_path, 'r', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                usernames[row.get('user_id', '').strip()] = row.get('username', '').strip()
+    return usernames
+
+
+def replay_original_tweets(account_name, entities):
+    stage = load_stage(0)
+    count = 0
+    for user_id, pages in entities:
+        tweets = []
+        for page in pages:
+            tweets.extend(stage.filter_original_tweets(page.get('data', [])))
+        stage.save_original_tweets_to_csv(tweets, account_name)
+        count += 1
+    return count
+
+
+def replay_retweeting_users(account_name, entities, writer=None):
+    stage = load_stage(1)
+    count = 0
+    for tweet_id, pages in entities:
+        users = []
+        for page in pages:
+            users.extend(page.get('data', []))
+        stage.save_retweeting_users_to_csv(tweet_id, users, account_name, writer)
+        count += 1
+    return count
+
+
+def replay_user_retweets(account_name, entities, writer=None):
+    stage = load_stage(3)
+    usernames = read_usernames(account_name)
+    count = 0
+    for user_id, pages in entities:
+        rows = []
+        for page in pages:
+            rows.extend(stage.parse_retweet_rows(page.get('data', [])))
+        stage.save_user_tweets_to_csv(user_id, usernames.get(user_id, user_id), rows, account_name, writer)
+        count += 1
+    return count
+
+
+def main():
+    print(" Raw Archive Replay")
+    print("=" * 50)
+
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    if len(args) < 2 or not args[0].isdigit() or int(args[0]) not in ARCHIVE_STAGES:
+        print("\n❌ Error: Please provide a stage (0, 1 or 3) and an account name")
+        print("\nUsage:")
+        print("  python replay_archive.py <stage> <account_name> [--sharded] [--only=ID,ID,...]")
+        print("\nExample:")
+        print("  python replay_archive.py 3 ethstatus")
+        print("\nThis regenerates the stage's output files from the raw pages saved with --archive,")
+        print("without any API calls.")
+        print("\nOptions:")
+        print("  --sharded         Write rolling shard files instead of one file per entity (stages 1 and 3)")
+        print("  --only=IDS        Only replay these tweet/user IDs (comma separated)")
+        return
+
+    stage_number = int(args[0])
+    account_name = args[1].lstrip('@')
+    if stage_number == 0:
+        account_name = account_name.lower()
+
+    only = []
+    for arg in sys.argv[1:]:
+        if arg.startswith('--only='):
+            only = [entity_id for entity_id in arg[len('--only='):].split(',') if entity_id]
+
+    stage_name = ARCHIVE_STAGES[stage_number]
+    if only:
+        segments = segments_for_entities(stage_name, account_name, only)
+    else:
+        segments = list_segments(stage_name, account_name)
+
+    if not segments:
+        print(f"❌ No archived pages found for stage {stage_number} of @{account_name}")
+        print(f"   Please run the stage with --archive first")
+        return
+
+    print(f"\n Replaying {len(segments)} archive segment(s) for @{account_name}...")
+    entities = iter_complete_entities(segments, only or None)
+
+    writer = None
+    if '--sharded' in sys.argv[1:] and stage_number != 0:
+        writer = load_stage(stage_number).open_sharded_writer(account_name)
+
+    if stage_number == 0:
+        count = replay_original_tweets(account_name, entities)
+    elif stage_number == 1:
+        count = replay_retweeting_users(account_name, entities, writer)
+    else:
+        count = replay_user_retweets(account_name, entities, writer)
+
+    if writer:
+        writer.close()
+        print(f"💾 Wrote {len(writer.finalized)} shard file(s) to {writer.output_dir}")
+
+    print(f"\n🎉 Done! Regenerated the output of {count} entities from the archive (0 API calls)")
+
+
+if __name__ == "__main__":
+    main()
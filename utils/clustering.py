@@ -0,0 +1,328 @@
+"""
+Audience Clustering
+Segments engaged users by the accounts they retweet.
+
+The user -> handle relation is packed into a sparse CSR incidence matrix
+(one row per user, int32 handle indices), which costs a few bytes per
+(user, handle) pair instead of a Python set entry. IncidenceBuilder fills it
+straight from the streamed (handle, user) pairs, so no per-handle user sets
+are ever built. Two methods run on it:
+
+    kmeans         TF-IDF weighting, truncated SVD and mini-batch k-means
+                   (needs numpy, scipy and scikit-learn)
+    sparse-kmeans  Spherical k-means directly on the idf-weighted sparse rows,
+                   pure Python, used when scikit-learn is not installed
+"""
+
+import importlib.util
+import math
+import random
+from array import array
+
+METHODS = ('kmeans', 'sparse-kmeans')
+MIN_LIFT = 1.5
+
+
+def sklearn_available():
+    return importlib.util.find_spec('sklearn') is not None
+
+
+class Incidence:
+    """
+    Sparse user x handle matrix in CSR form.
+
+    Row i (user users[i]) holds the handle indices indices[indptr[i]:indptr[i + 1]].
+    handle_degree[j] is the number of users who retweeted handles[j].
+    """
+
+    def __init__(self, users, handles, indptr, indices, handle_degree):
+        self.users = users
+        self.handles = handles
+        self.indptr = indptr
+        self.indices = indices
+        self.handle_degree = handle_degree
+
+    @property
+    def pairs(self):
+        return len(self.indices)
+
+    def row(self, user_index):
+        return self.indices[self.indptr[user_index]:self.indptr[user_index + 1]]
+
+
+class IncidenceBuilder:
+    """
+    Collects (handle, user) pairs as two int32 columns and packs them into an Incidence.
+
+    Usage:
+        builder = IncidenceBuilder()
+        for handle, user_id in pairs:   # duplicates are fine
+            builder.add(handle, user_id)
+        incidence = builder.build(min_users=3)
+
+    add() has the same signature as DistinctHeavyHitters.add, so stage 4's
+    read_tweets_files can stream into either.
+    """
+
+    def __init__(self):
+        self.handles = []
+        self.handle_ids = {}
+        self.users = []
+        self.user_ids = {}
+        self.pair_users = array('i')
+        self.pair_handles = array('i')
+
+    def add(self, handle, user_id):
+        handle_id = self.handle_ids.get(handle)
+        if handle_id is None:
+            handle_id = self.handle_ids[handle] = len(self.handles)
+            self.handles.append(handle)
+        user = self.user_ids.get(user_id)
+        if user is None:
+            user = self.user_ids[user_id] = len(self.users)
+            self.users.append(user_id)
+        self.pair_users.append(user)
+        self.pair_handles.append(handle_id)
+
+    def build(self, min_users=2):
+        """
+        Pack the pairs into an Incidence. Handles retweeted by fewer than min_users users
+        carry no segment signal and are dropped, as are users left without any handle.
+        Users are sorted by ID and handles by (-users, handle). The pair columns are
+        released on the way.
+        """
+        n_users = len(self.users)
+
+        # Counting sort of the pairs by user, then deduplicate each user's handles
+        starts = array('q', [0]) * (n_users + 1)
+        for user in self.pair_users:
+            starts[user + 1] += 1
+        for user in range(n_users):
+            starts[user + 1] += starts[user]
+        grouped = array('i', [0]) * len(self.pair_handles)
+        cursor = array('q', starts)
+        for user, handle_id in zip(self.pair_users, self.pair_handles):
+            grouped[cursor[user]] = handle_id
+            cursor[user] += 1
+        self.pair_users = array('i')
+        self.pair_handles = array('i')
+        del cursor
+
+        # Deduplicate each user's handles in place; starts becomes the deduplicated row pointers
+        degree = array('i', [0]) * len(self.handles)
+        write = 0
+        for user in range(n_users):
+            row = sorted(set(grouped[starts[user]:starts[user + 1]]))
+            starts[user] = write
+            grouped[write:write + len(row)] = array('i', row)
+            write += len(row)
+            for handle_id in row:
+                degree[handle_id] += 1
+        starts[n_users] = write
+        del grouped[write:]
+
+        kept = sorted((handle_id for handle_id in range(len(self.handles)) if degree[handle_id] >= min_users),
+                      key=lambda handle_id: (-degree[handle_id], self.handles[handle_id]))
+        new_ids = array('i', [-1]) * len(self.handles)
+        for new_id, handle_id in enumerate(kept):
+            new_ids[handle_id] = new_id
+
+        users = []
+        indptr = array('q', [0])
+        indices = array('i')
+        for user in sorted(range(n_users), key=lambda user: self.users[user]):
+            row = sorted(new_ids[handle_id] for handle_id in grouped[starts[user]:starts[user + 1]]
+                         if new_ids[handle_id] >= 0)
+            if row:
+                users.append(self.users[user])
+                indices.extend(row)
+                indptr.append(len(indices))
+        del grouped, starts
+
+        handle_degree = array('i', (degree[handle_id] for handle_id in kept))
+        return Incidence(users, [self.handles[handle_id] for handle_id in kept], indptr, indices, handle_degree)
+
+
+def build_incidence(handles_users, min_users=2):
+    """
+    Build the user x handle matrix from a handle -> set of user IDs mapping
+    (see IncidenceBuilder.build for what is kept).
+    """
+    builder = IncidenceBuilder()
+    for handle, users in handles_users.items():
+        for user_id in users:
+            builder.add(handle, user_id)
+    return builder.build(min_users)
+
+
+def kmeans_segments(incidence, n_segments, components=64, seed=0):
+    """
+    TF-IDF + truncated SVD + mini-batch k-means. Returns one segment label per user.
+    """
+    if len(incidence.handles) < 2:
+        # Nothing to reduce or separate users by (TruncatedSVD needs two features)
+        return [0] * len(incidence.users)
+
+    import numpy as np
+    from scipy.sparse import csr_matrix
+    from sklearn.cluster import MiniBatchKMeans
+    from sklearn.decomposition import TruncatedSVD
+    from sklearn.feature_extraction.text import TfidfTransformer
+    from sklearn.preprocessing import normalize
+
+    indices = np.frombuffer(incidence.indices, dtype=np.int32)
+    indptr = np.frombuffer(incidence.indptr, dtype=np.int64)
+    data = np.ones(len(indices), dtype=np.float32)
+    matrix = csr_matrix((data, indices, indptr), shape=(len(incidence.users), len(incidence.handles)))
+
+    weighted = TfidfTransformer().fit_transform(matrix)
+    components = max(1, min(components, len(incidence.handles) - 1))
+    reduced = normalize(TruncatedSVD(n_components=components, random_state=seed).fit_transform(weighted))
+
+    kmeans = MiniBatchKMeans(n_clusters=n_segments, random_state=seed, batch_size=4096, n_init=3)
+    return kmeans.fit_predict(reduced).tolist()
+
+
+def _normalized(vector):
+    norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+    return {key: weight / norm for key, weight in vector.items()} if norm else {}
+
+
+def _truncate(vector, size):
+    if len(vector) <= size:
+        return vector
+    return dict(sorted(vector.items(), key=lambda item: -item[1])[:size])
+
+
+def sparse_kmeans_segments(incidence, n_segments, iterations=10, seed=0, centroid_size=1000, init_sample=5000):
+    """
+    Spherical k-means on the idf-weighted user rows, in pure Python. Returns one segment
+    label per user.
+
+    Handles are weighted by idf, so accounts everybody retweets barely count. Centroids
+    keep only their centroid_size heaviest handles and are looked up through an inverted
+    index, so an iteration costs about one pass over the (user, handle) pairs.
+    Centroids are seeded with k-means++ on a sample of users. Users whose handles all
+    fell outside the truncated centroids are assigned afterwards to the nearest full
+    centroid (the first segment if they share no handle with any).
+    """
+    rng = random.Random(seed)
+    n_users = len(incidence.users)
+    weights = [math.log((1 + n_users) / (1 + degree)) for degree in incidence.handle_degree]
+    norms = array('d', (math.sqrt(sum(weights[h] ** 2 for h in incidence.row(i))) or 1.0 for i in range(n_users)))
+
+    def user_vector(user_index):
+        return {h: weights[h] / norms[user_index] for h in incidence.row(user_index)}
+
+    def similarity(user_index, centroid):
+        return sum(weights[h] * centroid.get(h, 0.0) for h in incidence.row(user_index)) / norms[user_index]
+
+    sample = rng.sample(range(n_users), min(init_sample, n_users))
+    centroids = [user_vector(rng.choice(sample))]
+    best = [similarity(i, centroids[0]) for i in sample]
+    while len(centroids) < n_segments:
+        distances = [max(1.0 - sim, 0.0) ** 2 for sim in best]
+        if not sum(distances):
+            break
+        chosen = rng.choices(range(len(sample)), weights=distances)[0]
+        centroids.append(user_vector(sample[chosen]))
+        best = [max(sim, similarity(i, centroids[-1])) for sim, i in zip(best, sample)]
+
+    labels = array('i', [-1]) * n_users
+    sums = [{} for _ in centroids]
+    for _ in range(iterations):
+        inverted = {}
+        for label, centroid in enumerate(centroids):
+            for h, weight in centroid.items():
+                inverted.setdefault(h, []).append((label, weight))
+
+        sums = [{} for _ in centroids]
+        changed = 0
+        for user_index in range(n_users):
+            row = incidence.row(user_index)
+            scores = {}
+            for h in row:
+                entries = inverted.get(h)
+                if entries:
+                    user_weight = weights[h]
+                    for label, weight in entries:
+                        scores[label] = scores.get(label, 0.0) + user_weight * weight
+            label = max(scores, key=lambda k: (scores[k], -k)) if scores else -1
+            if label != labels[user_index]:
+                labels[user_index] = label
+                changed += 1
+            if label >= 0:
+                total = sums[label]
+                for h in row:
+                    total[h] = total.get(h, 0.0) + weights[h] / norms[user_index]
+
+        centroids = [_normalized(_truncate(total, centroid_size)) if total else centroid
+                     for total, centroid in zip(sums, centroids)]
+        if changed <= n_users // 1000:
+            break
+
+    # The last iteration's sums are the untruncated centroids of the final segments
+    full = [_normalized(total) if total else centroid for total, centroid in zip(sums, centroids)]
+    for user_index in range(n_users):
+        if labels[user_index] >= 0:
+            continue
+        scores = [similarity(user_index, centroid) for centroid in full]
+        labels[user_index] = max(range(len(full)), key=lambda k: (scores[k], -k))
+
+    return labels.tolist()
+
+
+def cluster_users(incidence, n_segments, method=None):
+    """
+    Segment the users of an incidence matrix. Returns (labels, method used), with labels
+    renumbered 0..k-1 from the largest segment down.
+    """
+    method = method or ('kmeans' if sklearn_available() else 'sparse-kmeans')
+    n_segments = max(1, min(n_segments, len(incidence.users)))
+
+    if method == 'kmeans':
+        labels = kmeans_segments(incidence, n_segments)
+    else:
+        labels = sparse_kmeans_segments(incidence, n_segments)
+
+    sizes = {}
+    for label in labels:
+        if label >= 0:
+            sizes[label] = sizes.get(label, 0) + 1
+    order = {label: rank for rank, label in enumerate(sorted(sizes, key=lambda label: (-sizes[label], label)))}
+    return [order.get(label, -1) for label in labels], method
+
+
+def summarize_segments(incidence, labels, top=10):
+    """
+    Top accounts of each segment. Returns a list (largest segment first) of
+    {'segment', 'size', 'accounts': [(handle, users, share, lift), ...]} where share is the
+    fraction of the segment retweeting the handle and lift is share / overall share.
+    Only accounts the segment over-represents (lift >= MIN_LIFT) are listed, most retweeted first,
+    so accounts the whole audience retweets do not top every segment.
+    """
+    n_users = len(incidence.users)
+    counts = {}
+    sizes = {}
+    for user_index, label in enumerate(labels):
+        if label < 0:
+            continue
+        sizes[label] = sizes.get(label, 0) + 1
+        segment_counts = counts.setdefault(label, {})
+        for handle_index in incidence.row(user_index):
+            segment_counts[handle_index] = segment_counts.get(handle_index, 0) + 1
+
+    segments = []
+    for label in sorted(sizes):
+        size = sizes[label]
+        ranked = sorted(counts[label].items(), key=lambda item: (-item[1], incidence.handles[item[0]]))
+        accounts = []
+        for handle_index, users in ranked:
+            share = users / size
+            lift = share / (incidence.handle_degree[handle_index] / n_users)
+            if lift >= MIN_LIFT:
+                accounts.append((incidence.handles[handle_index], users, share, lift))
+                if len(accounts) >= top:
+                    break
+        segments.append({'segment': label, 'size': size, 'accounts': accounts})
+    return segments
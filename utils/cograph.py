@@ -0,0 +1,309 @@
+"""
+Co-Amplification Graph
+Weighted handle-handle graph: two handles are linked by the number of
+engaged users who retweeted both.
+
+Counting every pair of every user's handles grows quadratically, so only
+pairs that can reach `min_support` are counted: a pair's support is at most
+the smaller of its two handles' user counts, so only handles retweeted by at
+least `min_support` users ("frequent" handles) take part, and users with more
+than `max_user_handles` distinct handles (retweet-everything accounts) are
+left out of pair counting.
+
+Two files are kept per analysis:
+    {accounts}_cograph.state   user rows, handle degrees, the pair counts
+                               among frequent handles and a manifest of the
+                               counted files (mtime, size, users), so new,
+                               re-fetched or deleted timelines update the
+                               counts incrementally
+    {accounts}_cograph.csr     the pruned graph as a CSR index (neighbors of
+                               each handle sorted by weight), memory-mapped
+                               for fast neighbor queries
+"""
+
+import math
+import os
+from array import array
+
+from utils.csv_io import iter_entity_rows
+from utils.snapshot_utils import RETWEET_HANDLE_PATTERN, ColumnFile, write_column_file
+
+COGRAPH_DIR = "twitter_files/6_co_amplification"
+STATE_MAGIC = b'TWCOST1\n'
+GRAPH_MAGIC = b'TWCOGR1\n'
+DEFAULT_MIN_SUPPORT = 3
+DEFAULT_MAX_USER_HANDLES = 500
+
+
+def get_state_path(account_names):
+    return os.path.join(COGRAPH_DIR, f"{'_'.join(account_names)}_cograph.state")
+
+
+def get_graph_path(account_names):
+    return os.path.join(COGRAPH_DIR, f"{'_'.join(account_names)}_cograph.csr")
+
+
+def read_user_handles(csv_file, account_name):
+    """
+    Return {user_id: set of retweeted handles} for one stage 3 file (per-user file or shard).
+    """
+    user_handles = {}
+    for user_id, row in iter_entity_rows(csv_file, account_name, '_tweets.csv', 'user_id'):
+        match = RETWEET_HANDLE_PATTERN.match(row.get('text', '').strip())
+        if match:
+            user_handles.setdefault(user_id, set()).add(match.group(1))
+        else:
+            user_handles.setdefault(user_id, set())
+    return user_handles
+
+
+def _pair_key(first, second):
+    return (first << 32) | second if first < second else (second << 32) | first
+
+
+class CoGraphBuilder:
+    """
+    Incrementally maintained pair counts among frequent handles.
+
+    Invariant: pairs holds, for every two frequent handles, the number of counted users
+    who retweeted both. Frequent handles never stop being frequent, so their counts are
+    never needed again from scratch.
+
+    Usage:
+        builder = CoGraphBuilder.load(state_path) or CoGraphBuilder()
+        builder.update(user_handles)
+        builder.save(state_path)
+        builder.write_graph(graph_path)
+    """
+
+    def __init__(self, min_support=DEFAULT_MIN_SUPPORT, max_user_handles=DEFAULT_MAX_USER_HANDLES):
+        self.min_support = min_support
+        self.max_user_handles = max_user_handles
+        self.handles = []
+        self.handle_ids = {}
+        self.degree = array('i')
+        self.users = {}
+        self.frequent = set()
+        self.pairs = {}
+        self.sources = {}  # path -> [mtime, size, user IDs]
+
+    def _handle_id(self, handle):
+        handle_id = self.handle_ids.get(handle)
+        if handle_id is None:
+            handle_id = self.handle_ids[handle] = len(self.handles)
+            self.handles.append(handle)
+            self.degree.append(0)
+        return handle_id
+
+    def _counted(self, row):
+        if len(row) > self.max_user_handles:
+            return []
+        return [handle_id for handle_id in row if handle_id in self.frequent]
+
+    def _count_pairs(self, handle_ids, delta):
+        pairs = self.pairs
+        for i, first in enumerate(handle_ids):
+            for second in handle_ids[i + 1:]:
+                key = _pair_key(first, second)
+                count = pairs.get(key, 0) + delta
+                if count:
+                    pairs[key] = count
+                else:
+                    del pairs[key]
+
+    def update(self, user_handles):
+        """
+        Add new users and replace the handles of known ones.
+        Returns the number of users whose handles changed.
+        """
+        changed = []
+        for user_id, handles in user_handles.items():
+            row = array('i', sorted(self._handle_id(handle) for handle in handles))
+            old_row = self.users.get(user_id)
+            if old_row is not None:
+                if old_row == row:
+                    continue
+                self._count_pairs(self._counted(old_row), -1)
+                for handle_id in old_row:
+                    self.degree[handle_id] -= 1
+            for handle_id in row:
+                self.degree[handle_id] += 1
+            self.users[user_id] = row
+            changed.append(user_id)
+
+        # Handles that just became frequent: add their pairs with unchanged users' handles
+        newly_frequent = {handle_id for handle_id, degree in enumerate(self.degree)
+                          if degree >= self.min_support and handle_id not in self.frequent}
+        if newly_frequent:
+            changed_set = set(changed)
+            for user_id, row in self.users.items():
+                if user_id in changed_set or len(row) > self.max_user_handles:
+                    continue
+                new = [handle_id for handle_id in row if handle_id in newly_frequent]
+                if not new:
+                    continue
+                old = [handle_id for handle_id in row if handle_id in self.frequent]
+                self._count_pairs(new, 1)
+                for first in new:
+                    for second in old:
+                        key = _pair_key(first, second)
+                        self.pairs[key] = self.pairs.get(key, 0) + 1
+            self.frequent |= newly_frequent
+
+        # Changed users are counted in full against the new frequent set
+        for user_id in changed:
+            self._count_pairs(self._counted(self.users[user_id]), 1)
+
+        return len(changed)
+
+    def remove(self, user_ids):
+        """
+        Drop users (e.g. whose tweet files were deleted) with their degrees and pairs.
+        """
+        for user_id in user_ids:
+            row = self.users.pop(user_id, None)
+            if row is None:
+                continue
+            self._count_pairs(self._counted(row), -1)
+            for handle_id in row:
+                self.degree[handle_id] -= 1
+
+    def edges(self):
+        """
+        Yield (first, second, weight) for the pairs with at least min_support users.
+        """
+        for key, count in self.pairs.items():
+            if count >= self.min_support:
+                yield key >> 32, key & 0xFFFFFFFF, count
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        user_ids = list(self.users)
+        user_indptr = array('q', [0])
+        user_handles = array('i')
+        for user_id in user_ids:
+            user_handles.extend(self.users[user_id])
+            user_indptr.append(len(user_handles))
+
+        pair_keys = array('q', self.pairs.keys())
+        pair_counts = array('i', self.pairs.values())
+
+        header = {
+            'min_support': self.min_support,
+            'max_user_handles': self.max_user_handles,
+            'handles': self.handles,
+            'users': user_ids,
+            'sources': self.sources,
+        }
+        columns = {
+            'user_indptr': user_indptr,
+            'user_handles': user_handles,
+            'degree': self.degree,
+            'frequent': array('i', sorted(self.frequent)),
+            'pair_keys': pair_keys,
+            'pair_counts': pair_counts,
+        }
+        return write_column_file(path, STATE_MAGIC, header, columns)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a saved builder, or return None if there is no state file.
+        """
+        if not os.path.exists(path):
+            return None
+        with CoGraphState.open(path) as state:
+            header = state.header
+            builder = cls(header['min_support'], header['max_user_handles'])
+            builder.handles = header['handles']
+            builder.handle_ids = {handle: i for i, handle in enumerate(builder.handles)}
+            builder.sources = header['sources']
+            builder.degree = array('i', state['degree'])
+            builder.frequent = set(state['frequent'])
+
+            user_indptr = state['user_indptr']
+            user_handles = state['user_handles']
+            for i, user_id in enumerate(header['users']):
+                builder.users[user_id] = array('i', user_handles[user_indptr[i]:user_indptr[i + 1]])
+
+            builder.pairs = dict(zip(state['pair_keys'], state['pair_counts']))
+        return builder
+
+    def write_graph(self, path):
+        """
+        Write the pruned graph as a CSR index, each handle's neighbors sorted by weight.
+        Returns the number of edges (pairs) written.
+        """
+        neighbors = {}
+        edge_count = 0
+        for first, second, weight in self.edges():
+            neighbors.setdefault(first, []).append((weight, second))
+            neighbors.setdefault(second, []).append((weight, first))
+            edge_count += 1
+
+        indptr = array('q', [0])
+        targets = array('i')
+        weights = array('i')
+        for handle_id in range(len(self.handles)):
+            for weight, other in sorted(neighbors.get(handle_id, ()), key=lambda item: (-item[0], item[1])):
+                targets.append(other)
+                weights.append(weight)
+            indptr.append(len(targets))
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        header = {
+            'min_support': self.min_support,
+            'users': len(self.users),
+            'edges': edge_count,
+            'handles': self.handles,
+        }
+        write_column_file(path, GRAPH_MAGIC, header,
+                          {'indptr': indptr, 'neighbors': targets, 'weights': weights, 'degree': self.degree})
+        return edge_count
+
+
+class CoGraphState(ColumnFile):
+    MAGIC = STATE_MAGIC
+
+
+class CoGraph(ColumnFile):
+    """
+    Memory-mapped CSR co-amplification graph.
+
+    Usage:
+        with CoGraph.open(get_graph_path(['ethstatus'])) as graph:
+            for handle, co_users, cosine in graph.neighbors('VitalikButerin', top=20):
+                ...
+    """
+
+    MAGIC = GRAPH_MAGIC
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.handles = self.header['handles']
+        self._handle_ids = None
+
+    def handle_id(self, handle):
+        """
+        Case-insensitive handle lookup; returns None for unknown handles.
+        """
+        if self._handle_ids is None:
+            self._handle_ids = {}
+            for i, name in enumerate(self.handles):
+                self._handle_ids.setdefault(name.lower(), i)
+        return self._handle_ids.get(handle.lstrip('@').lower())
+
+    def neighbors(self, handle, top=20):
+        """
+        The handles most often retweeted by the same users as `handle`, as
+        (handle, co_users, cosine) tuples with cosine = co_users / sqrt(degree_a * degree_b).
+        """
+        handle_id = self.handle_id(handle)
+        if handle_id is None:
+            return []
+        indptr, degree = self['indptr'], self['degree']
+        start, end = indptr[handle_id], min(indptr[handle_id + 1], indptr[handle_id] + top)
+        result = []
+        for other, weight in zip(self['neighbors'][start:end], self['weights'][start:end]):
+            result.append((self.handles[other], weight, weight / math.sqrt(degree[handle_id] * degree[other])))
+        return result
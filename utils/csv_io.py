@@ -0,0 +1,226 @@
+"""
+CSV Writers and Readers
+Atomic per-entity CSV files, buffered sharded rolling files, and readers
+that see both layouts the same way.
+
+Layouts:
+    per-entity: {account}_{entity_id}{suffix}          one file per tweet/user
+    sharded:    {account}_shard-{n:04d}{suffix}        many entities per file,
+                                                       with the entity ID as first column
+
+Entity IDs (tweet and user IDs) are numeric, while account names may contain
+underscores, so a file belongs to an account only if the rest of its name is
+an entity ID or a shard: eth_status_1111_tweets.csv is @eth_status's, not @eth's.
+"""
+
+import csv
+import glob
+import os
+import re
+import threading
+
+SHARD_MARKER = 'shard-'
+# What follows "{account}_" in an account's file names (shards of a work shard part: part-000_shard-0001)
+ACCOUNT_FILE_REST = re.compile(r'^(?:\d+|(?:part-\d+_)?shard-\d+)$')
+DEFAULT_SHARD_ROWS = 100000
+DEFAULT_FLUSH_ROWS = 1000
+
+_created_dirs = set()
+
+
+def ensure_dir(path):
+    """
+    os.makedirs once per directory and process, instead of once per saved file.
+    """
+    if path not in _created_dirs:
+        os.makedirs(path, exist_ok=True)
+        _created_dirs.add(path)
+
+
+def write_csv_atomic(filename, header, rows):
+    """
+    Write a whole CSV through a temp file and an atomic rename, so a crash never
+    leaves a half-written file behind.
+    """
+    tmp_path = filename + '.tmp'
+    with open(tmp_path, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(header)
+        writer.writerows(rows)
+    os.replace(tmp_path, filename)
+    return filename
+
+
+class ShardedCsvWriter:
+    """
+    Appends the rows of many entities to rolling shard files.
+
+    Rows are buffered and flushed every `flush_rows` rows into the open shard,
+    which is only a .tmp file until it is full (`shard_rows`) or the writer is
+    closed; then it is renamed to its final .csv name. Readers never see a
+    partially written shard, and the entities of a shard lost in a crash are
+    simply fetched again. New shards are numbered after the highest existing
+    one, .tmp files included, so a writer never reopens another one's file.
+
+    Usage:
+        with ShardedCsvWriter(output_dir, 'ethstatus', '_tweets.csv', 'user_id', header) as writer:
+            writer.write_entity(user_id, rows)
+    """
+
+    def __init__(self, output_dir, account_name, suffix, entity_column, header,
+                 shard_rows=DEFAULT_SHARD_ROWS, flush_rows=DEFAULT_FLUSH_ROWS):
+        self.output_dir = output_dir
+        self.prefix = f"{account_name}_" if account_name else ''
+        self.suffix = suffix
+        self.header = [entity_column] + list(header)
+        self.shard_rows = shard_rows
+        self.flush_rows = flush_rows
+        self.buffer = []
+        self.file = None
+        self.writer = None
+        self.shard_number = self._last_shard_number()
+        self.rows_in_shard = 0
+        self.lock = threading.Lock()
+        self.finalized = []
+        ensure_dir(output_dir)
+
+    def _last_shard_number(self):
+        pattern = os.path.join(self.output_dir, f"{self.prefix}{SHARD_MARKER}*{self.suffix}")
+        numbers = [0]
+        for path in glob.glob(pattern) + glob.glob(pattern + '.tmp'):
+            name = os.path.basename(path)
+            if name.endswith('.tmp'):
+                name = name[:-len('.tmp')]
+            number = name[len(self.prefix) + len(SHARD_MARKER):-len(self.suffix)]
+            if number.isdigit():
+                numbers.append(int(number))
+        return max(numbers)
+
+    def _shard_path(self):
+        return os.path.join(self.output_dir, f"{self.prefix}{SHARD_MARKER}{self.shard_number:04d}{self.suffix}")
+
+    def _open_shard(self):
+        self.shard_number += 1
+        self.file = open(self._shard_path() + '.tmp', 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(self.header)
+        self.rows_in_shard = 0
+
+    def _finalize_shard(self):
+        if not self.file:
+            return
+        self.file.close()
+        os.replace(self._shard_path() + '.tmp', self._shard_path())
+        self.finalized.append(self._shard_path())
+        self.file = None
+
+    def _flush(self):
+        if not self.buffer:
+            return
+        if not self.file:
+            self._open_shard()
+        self.writer.writerows(self.buffer)
+        self.rows_in_shard += len(self.buffer)
+        self.buffer = []
+        if self.rows_in_shard >= self.shard_rows:
+            self._finalize_shard()
+
+    def write_entity(self, entity_id, rows):
+        """
+        Buffer all rows of one entity. An entity's rows always end up in the same shard.
+        """
+        with self.lock:
+            self.buffer.extend([entity_id] + list(row) for row in rows)
+            if len(self.buffer) >= self.flush_rows:
+                self._flush()
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self._finalize_shard()
+
+    def discard(self):
+        """
+        Drop everything this writer wrote: buffered rows, the open .tmp shard and the
+        shards it already finalized. Returns the number of files removed.
+        """
+        with self.lock:
+            self.buffer = []
+            removed = 0
+            if self.file:
+                self.file.close()
+                self.file = None
+                os.remove(self._shard_path() + '.tmp')
+                removed += 1
+            for path in self.finalized:
+                if os.path.exists(path):
+                    os.remove(path)
+                    removed += 1
+            self.finalized = []
+            return removed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def split_entity_filename(filename, account_name, suffix):
+    """
+    Return (entity_id, is_shard) for a file name of either layout.
+    The entity ID is the last part of the name, whatever the account name looks like.
+    """
+    last = filename[:-len(suffix)].rsplit('_', 1)[-1]
+    if last.startswith(SHARD_MARKER):
+        return None, True
+    return last, False
+
+
+def account_of_file(filename, account_names, suffix):
+    """
+    Return which of the accounts a file name belongs to, or None.
+    """
+    if not filename.endswith(suffix):
+        return None
+    core = filename[:-len(suffix)]
+    for account_name in account_names:
+        if core.startswith(f"{account_name}_") and ACCOUNT_FILE_REST.match(core[len(account_name) + 1:]):
+            return account_name
+    return None
+
+
+def find_entity_files(input_dir, account_name, suffix):
+    """
+    List an account's files of both layouts (per-entity files and finalized shards).
+    """
+    if account_name:
+        pattern = os.path.join(input_dir, f'{account_name}_*{suffix}')
+        return [path for path in glob.glob(pattern) if account_of_file(os.path.basename(path), [account_name], suffix)]
+    return glob.glob(os.path.join(input_dir, f'*{suffix}'))
+
+
+def find_accounts_files(input_dir, account_names, suffix):
+    """
+    List the files of several accounts with one scan of the directory.
+    Returns {account: [paths]}.
+    """
+    files = {account_name: [] for account_name in account_names}
+    if not os.path.isdir(input_dir):
+        return files
+    for entry in os.scandir(input_dir):
+        account_name = account_of_file(entry.name, account_names, suffix)
+        if account_name is not None:
+            files[account_name].append(entry.path)
+    return files
+
+
+def iter_entity_rows(csv_file, account_name, suffix, entity_column):
+    """
+    Yield (entity_id, row) for every row of a per-entity file or a shard.
+    """
+    entity_id, is_shard = split_entity_filename(os.path.basename(csv_file), account_name, suffix)
+    with open(csv_file, 'r', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield (row.get(entity_column, '') if is_shard else entity_id), row
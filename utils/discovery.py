@@ -0,0 +1,106 @@
+"""
+Discovery Planning
+Orders stage 1's retweeted_by jobs by how many users they are expected to
+discover per request, from the retweet counts stage 0 records.
+
+retweeted_by costs one request per page of up to 100 users, so a tweet with
+retweet_count n needs ceil(n / 100) requests and yields n / ceil(n / 100)
+users per request: tweets nobody retweeted are skipped (they would spend a
+request on an empty page), and the fullest pages are fetched first. Tweets
+without a known count (stage 0 files from before the column existed) still
+get one request each and go last.
+
+Because the most productive tweets go first, the number of new unique users
+per request falls as the run goes on. SaturationTracker measures it over the
+last requests, so a run can stop once it has leveled off.
+"""
+
+import math
+import threading
+from collections import deque
+
+PAGE_SIZE = 100
+DEFAULT_SATURATION_WINDOW = 50
+
+
+def predicted_pages(retweet_count):
+    """
+    Requests needed to page through a tweet's retweeters (1 if the count is unknown).
+    """
+    if retweet_count is None:
+        return 1
+    return math.ceil(retweet_count / PAGE_SIZE)
+
+
+def expected_yield(retweet_count):
+    """
+    Retweeting users expected per request (0 if the count is unknown or zero).
+    """
+    pages = predicted_pages(retweet_count)
+    if retweet_count is None or not pages:
+        return 0.0
+    return retweet_count / pages
+
+
+def plan_tweets(tweet_ids, retweet_counts):
+    """
+    Split tweets into (planned, skipped). planned is a list of (tweet_id, priority,
+    predicted pages), most users per request first; skipped are the tweet IDs
+    without any retweet. Priorities are scheduler priorities (higher goes first).
+    """
+    planned = []
+    skipped = []
+    for tweet_id in tweet_ids:
+        retweet_count = retweet_counts.get(tweet_id)
+        pages = predicted_pages(retweet_count)
+        if not pages:
+            skipped.append(tweet_id)
+            continue
+        planned.append((tweet_id, expected_yield(retweet_count), pages))
+    planned.sort(key=lambda plan: -plan[1])
+    return planned, skipped
+
+
+class SaturationTracker:
+    """
+    New unique users per request over the last `window` requests of one account.
+
+    Usage:
+        tracker = SaturationTracker(min_rate=2.0)
+        new_users = tracker.record(users)   # after every page
+        if tracker.saturated():
+            ...  # stop queueing more tweets
+    """
+
+    def __init__(self, min_rate, window=DEFAULT_SATURATION_WINDOW):
+        self.min_rate = min_rate
+        self.window = window
+        self.seen = set()
+        self.recent = deque(maxlen=window)
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def record(self, users):
+        """
+        Count one page of users (dicts with an 'id'); returns how many were new.
+        """
+        with self.lock:
+            before = len(self.seen)
+            self.seen.update(user.get('id') for user in users)
+            new_users = len(self.seen) - before
+            self.recent.append(new_users)
+            self.requests += 1
+        return new_users
+
+    def rate(self):
+        """
+        New unique users per request over the window (None until the window is full).
+        """
+        with self.lock:
+            if len(self.recent) < self.window:
+                return None
+            return sum(self.recent) / len(self.recent)
+
+    def saturated(self):
+        rate = self.rate()
+        return rate is not None and rate < self.min_rate
@@ -0,0 +1,194 @@
+"""
+Incremental Handle Counts
+Unique-user counts per retweeted handle for Script 4, kept up to date by
+reading only the tweet files that changed since the last run.
+
+The state file ({accounts}_retweeted_accounts.state, next to the ranking) is
+a manifest of every counted stage 3 file (mtime and size) together with the
+file's contribution: the users it holds and the handles each of them
+retweeted. On a rerun, only new, rewritten and deleted files are read. The
+users they touch are recounted from their files' contributions (a user's
+handles are the union over all of their files, since a re-fetched user can
+show up in two shard files), and the difference is subtracted from or added
+to the handle counts. A refresh costs one stat() per file plus the changed
+files, not a parse of the whole dataset.
+"""
+
+import os
+from array import array
+
+from utils.snapshot_utils import ColumnFile, write_column_file
+
+COUNTS_DIR = "twitter_files/4_retweeted_accounts"
+STATE_MAGIC = b'TWHCST1\n'
+
+
+def get_counts_state_path(account_names):
+    return os.path.join(COUNTS_DIR, f"{'_'.join(account_names)}_retweeted_accounts.state")
+
+
+class HandleCountsState(ColumnFile):
+    MAGIC = STATE_MAGIC
+
+
+class HandleCounts:
+    """
+    Handle counts with the per-file contributions they were computed from.
+
+    Invariant: counts[h] is the number of users whose handles, over all of their
+    counted files, include handle h.
+
+    Usage:
+        counts = HandleCounts.load(state_path) or HandleCounts()
+        counts.update({path: (mtime, size, user_handles)}, deleted_paths)
+        counts.save(state_path)
+        ranking = counts.as_dict()
+    """
+
+    def __init__(self):
+        self.handles = []
+        self.handle_ids = {}
+        self.counts = array('i')
+        self.users = []
+        self.user_ids = {}
+        self.sources = {}  # path -> [mtime, size]
+        self.files = {}  # path -> {user index: array of handle IDs}
+        self.user_files = {}  # user index -> set of paths
+
+    def _handle_id(self, handle):
+        handle_id = self.handle_ids.get(handle)
+        if handle_id is None:
+            handle_id = self.handle_ids[handle] = len(self.handles)
+            self.handles.append(handle)
+            self.counts.append(0)
+        return handle_id
+
+    def _user_index(self, user_id):
+        index = self.user_ids.get(user_id)
+        if index is None:
+            index = self.user_ids[user_id] = len(self.users)
+            self.users.append(user_id)
+        return index
+
+    def _user_handles(self, user):
+        handles = set()
+        for path in self.user_files.get(user, ()):
+            handles.update(self.files[path][user])
+        return handles
+
+    def _remove_file(self, path):
+        for user in self.files.pop(path, {}):
+            paths = self.user_files[user]
+            paths.discard(path)
+            if not paths:
+                del self.user_files[user]
+        self.sources.pop(path, None)
+
+    def update(self, changed, deleted=()):
+        """
+        Replace the contributions of changed files ({path: (mtime, size, {user_id: handles})})
+        and drop those of deleted files. Returns the number of users whose handles changed.
+        """
+        rows = {}
+        touched = set()
+        for path in deleted:
+            touched.update(self.files.get(path, ()))
+        for path, (mtime, size, user_handles) in changed.items():
+            touched.update(self.files.get(path, ()))
+            rows[path] = {self._user_index(user_id): array('i', sorted(self._handle_id(handle) for handle in handles))
+                          for user_id, handles in user_handles.items()}
+            touched.update(rows[path])
+
+        before = {user: self._user_handles(user) for user in touched}
+
+        for path in deleted:
+            self._remove_file(path)
+        for path, (mtime, size, _) in changed.items():
+            self._remove_file(path)
+            self.files[path] = rows[path]
+            self.sources[path] = [mtime, size]
+            for user in rows[path]:
+                self.user_files.setdefault(user, set()).add(path)
+
+        changed_users = 0
+        for user, old_handles in before.items():
+            new_handles = self._user_handles(user)
+            if new_handles == old_handles:
+                continue
+            changed_users += 1
+            for handle_id in old_handles - new_handles:
+                self.counts[handle_id] -= 1
+            for handle_id in new_handles - old_handles:
+                self.counts[handle_id] += 1
+        return changed_users
+
+    def user_count(self):
+        return len(self.user_files)
+
+    def as_dict(self):
+        """
+        Return {handle: unique users} for the handles retweeted by at least one user.
+        """
+        return {handle: count for handle, count in zip(self.handles, self.counts) if count}
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Users without any file left are dropped, so user indexes are renumbered
+        users = sorted(self.user_files)
+        renumbered = {user: i for i, user in enumerate(users)}
+
+        file_indptr = array('q', [0])
+        entry_users = array('i')
+        entry_indptr = array('q', [0])
+        entry_handles = array('i')
+        paths = list(self.files)
+        for file_path in paths:
+            for user, handle_ids in self.files[file_path].items():
+                entry_users.append(renumbered[user])
+                entry_handles.extend(handle_ids)
+                entry_indptr.append(len(entry_handles))
+            file_indptr.append(len(entry_users))
+
+        header = {
+            'handles': self.handles,
+            'users': [self.users[user] for user in users],
+            'files': [[file_path] + self.sources[file_path] for file_path in paths],
+        }
+        columns = {
+            'counts': self.counts,
+            'file_indptr': file_indptr,
+            'entry_users': entry_users,
+            'entry_indptr': entry_indptr,
+            'entry_handles': entry_handles,
+        }
+        return write_column_file(path, STATE_MAGIC, header, columns)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load saved counts, or return None if there is no state file.
+        """
+        if not os.path.exists(path):
+            return None
+        with HandleCountsState.open(path) as state:
+            header = state.header
+            counts = cls()
+            counts.handles = header['handles']
+            counts.handle_ids = {handle: i for i, handle in enumerate(counts.handles)}
+            counts.counts = array('i', state['counts'])
+            counts.users = header['users']
+            counts.user_ids = {user_id: i for i, user_id in enumerate(counts.users)}
+
+            file_indptr = state['file_indptr']
+            entry_users = state['entry_users']
+            entry_indptr = state['entry_indptr']
+            entry_handles = state['entry_handles']
+            for i, (file_path, mtime, size) in enumerate(header['files']):
+                rows = {}
+                for entry in range(file_indptr[i], file_indptr[i + 1]):
+                    user = entry_users[entry]
+                    rows[user] = array('i', entry_handles[entry_indptr[entry]:entry_indptr[entry + 1]])
+                    counts.user_files.setdefault(user, set()).add(file_path)
+                counts.files[file_path] = rows
+                counts.sources[file_path] = [mtime, size]
+        return counts
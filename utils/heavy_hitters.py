@@ -0,0 +1,182 @@
+"""
+Heavy-Hitter Counting
+Bounded-memory top-N of handles by unique retweeting users, in one pass.
+
+`DistinctHeavyHitters` is a Space-Saving summary whose counters count
+distinct users instead of events: it keeps at most `capacity` candidate
+handles, and a new handle evicts the candidate with the lowest estimate and
+inherits that estimate as its error bound. Each candidate counts its users
+exactly while it has few of them and switches to a HyperLogLog sketch once it
+passes `exact_threshold`, so memory stays fixed however long the tail is.
+
+An estimate is too high by at most the candidate's `error` (inherited on
+eviction), and once the candidate is sketched it also carries the
+HyperLogLog standard error (`relative_error`, about 3% at the default
+precision) in either direction.
+"""
+
+import hashlib
+import heapq
+import itertools
+import math
+
+DEFAULT_PRECISION = 10       # 2**10 registers of one byte per sketched candidate
+DEFAULT_EXACT_THRESHOLD = 64
+
+
+def _hash64(value):
+    return int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HyperLogLog:
+    """
+    HyperLogLog distinct counter with an incrementally maintained estimate.
+    """
+
+    def __init__(self, precision=DEFAULT_PRECISION):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(self.m)
+        self.alpha = 0.7213 / (1 + 1.079 / self.m)
+        # Running sum of 2**-register and count of empty registers, so count() is O(1)
+        self.inverse_sum = float(self.m)
+        self.zeros = self.m
+
+    def add_hash(self, hashed):
+        index = hashed >> (64 - self.precision)
+        rest = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        old = self.registers[index]
+        if rank > old:
+            self.registers[index] = rank
+            self.inverse_sum += 2.0 ** -rank - 2.0 ** -old
+            if old == 0:
+                self.zeros -= 1
+
+    def add(self, value):
+        self.add_hash(_hash64(value))
+
+    def count(self):
+        estimate = self.alpha * self.m * self.m / self.inverse_sum
+        if estimate <= 2.5 * self.m and self.zeros:
+            # Small range correction (linear counting)
+            estimate = self.m * math.log(self.m / self.zeros)
+        return int(round(estimate))
+
+    @property
+    def relative_error(self):
+        return 1.04 / math.sqrt(self.m)
+
+
+class _Candidate:
+    """
+    One monitored handle: an exact user set that turns into a HyperLogLog when it grows.
+    """
+
+    __slots__ = ('error', 'users', 'sketch', 'precision', 'exact_threshold', 'entry')
+
+    def __init__(self, error, precision, exact_threshold):
+        self.error = error
+        self.users = set()
+        self.sketch = None
+        self.precision = precision
+        self.exact_threshold = exact_threshold
+        self.entry = None  # sequence number of the candidate's live heap entry
+
+    def add(self, user_id):
+        """
+        Add a user. Returns True when the candidate just switched to a sketch, whose
+        estimate can be lower than the exact count it replaces.
+        """
+        if self.sketch is not None:
+            self.sketch.add(user_id)
+            return False
+        self.users.add(str(user_id))
+        if len(self.users) > self.exact_threshold:
+            self.sketch = HyperLogLog(self.precision)
+            for user in self.users:
+                self.sketch.add(user)
+            self.users = None
+            return True
+        return False
+
+    def estimate(self):
+        return self.error + (self.sketch.count() if self.sketch is not None else len(self.users))
+
+
+class DistinctHeavyHitters:
+    """
+    Space-Saving top-N over distinct (handle, user) pairs with fixed memory.
+
+    Usage:
+        counter = DistinctHeavyHitters(capacity=1000)
+        for handle, user_id in pairs:
+            counter.add(handle, user_id)
+        for handle, estimate, error in counter.top(100):
+            ...
+    """
+
+    def __init__(self, capacity=1000, precision=DEFAULT_PRECISION, exact_threshold=DEFAULT_EXACT_THRESHOLD):
+        self.capacity = capacity
+        self.precision = precision
+        self.exact_threshold = exact_threshold
+        self.candidates = {}
+        # Min-heap of (estimate when pushed, seq, handle). Estimates grow while counted exactly,
+        # so outdated keys are refreshed lazily at pop time; a switch to a sketch can lower an
+        # estimate, so the candidate is re-pushed then and its older entry is skipped by seq.
+        self.heap = []
+        self.sequence = itertools.count()
+        self.pairs = 0
+        self.evictions = 0
+
+    def _push(self, handle, candidate):
+        candidate.entry = next(self.sequence)
+        heapq.heappush(self.heap, (candidate.estimate(), candidate.entry, handle))
+
+    def _evict_min(self):
+        while True:
+            pushed_estimate, entry, handle = heapq.heappop(self.heap)
+            candidate = self.candidates.get(handle)
+            if candidate is None or entry != candidate.entry:
+                continue
+            estimate = candidate.estimate()
+            if estimate == pushed_estimate:
+                del self.candidates[handle]
+                self.evictions += 1
+                return estimate
+            self._push(handle, candidate)
+
+    def add(self, handle, user_id):
+        self.pairs += 1
+        candidate = self.candidates.get(handle)
+        if candidate is None:
+            error = self._evict_min() if len(self.candidates) >= self.capacity else 0
+            candidate = _Candidate(error, self.precision, self.exact_threshold)
+            self.candidates[handle] = candidate
+            candidate.add(user_id)
+            self._push(handle, candidate)
+            return
+        if candidate.add(user_id):
+            self._push(handle, candidate)
+
+    def top(self, n):
+        """
+        Return the n handles with the highest estimates as (handle, estimate, error) tuples.
+        """
+        ranked = [(handle, candidate.estimate(), candidate.error) for handle, candidate in self.candidates.items()]
+        ranked.sort(key=lambda item: (-item[1], item[0]))
+        return ranked[:n]
+
+    @property
+    def relative_error(self):
+        """
+        HyperLogLog standard error of sketched candidates (exactly counted candidates have none).
+        """
+        return 1.04 / math.sqrt(1 << self.precision)
+
+    def memory_bound(self):
+        """
+        Rough upper bound in bytes of the sketch registers and exact user sets.
+        """
+        per_candidate = max(1 << self.precision, self.exact_threshold * 64)
+        return self.capacity * per_candidate
@@ -0,0 +1,264 @@
+"""
+HTTP Response Cache
+On-disk cache of successful API responses for requests that are repeated
+verbatim across runs and stages, answered locally without touching the
+network or the rate budget.
+
+What is cached, and for how long, is decided per endpoint (CACHE_POLICIES):
+    users_me       the authentication check every networked stage starts with,
+                   keyed by access token
+    retweeted_by   pages of old tweets only: retweeters of a tweet older than
+                   OLD_TWEET_DAYS barely change, recent tweets are always fetched
+Timelines (users_tweets) are not cached. Username lookups already go through
+the user cache (utils/user_cache.py).
+
+Entries live in one SQLite file with their expiry and last access time; once
+the cache grows beyond its size cap, the least recently used entries are
+evicted. Hits and misses are counted per endpoint, persistently.
+
+Configuration (environment variables, like the API credentials):
+    TWITTER_HTTP_CACHE=off              disable the cache
+    TWITTER_HTTP_CACHE_MB=256           size cap
+    TWITTER_HTTP_CACHE_TTL=retweeted_by=0,users_me=600
+                                        override endpoint TTLs in seconds (0 = never cache)
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+CACHE_PATH = "twitter_files/.cache/http_cache.sqlite"
+DEFAULT_MAX_MB = 256
+OLD_TWEET_DAYS = 30
+TWITTER_EPOCH_MS = 1288834974657
+
+
+def tweet_age_seconds(tweet_id):
+    """
+    Age of a tweet from its snowflake ID (None for non-snowflake IDs).
+    """
+    if not str(tweet_id).isdigit() or int(tweet_id) < (1 << 22):
+        return None
+    return time.time() - ((int(tweet_id) >> 22) + TWITTER_EPOCH_MS) / 1000
+
+
+def retweeted_by_ttl(url, params):
+    """
+    Cache the retweeters of old tweets for a week; never cache recent tweets.
+    """
+    age = tweet_age_seconds(url.rstrip('/').split('/')[-2])
+    if age is None or age < OLD_TWEET_DAYS * 86400:
+        return 0
+    return 7 * 86400
+
+
+# Endpoint -> (TTL in seconds, or a function of (url, params) returning one; keyed by access token)
+CACHE_POLICIES = {
+    'users_me': (15 * 60, True),
+    'retweeted_by': (retweeted_by_ttl, False),
+}
+
+
+class CachedResponse:
+    """
+    The parts of a requests.Response the stages use, rebuilt from a cache entry.
+    """
+
+    status_code = 200
+    from_cache = True
+
+    def __init__(self, content, headers):
+        self.content = content
+        self.headers = headers
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class HttpCache:
+    """
+    SQLite-backed response cache with per-endpoint TTLs, an LRU size cap and hit/miss counters.
+
+    Usage:
+        cache = get_http_cache()
+        response = cache.get('retweeted_by', url, params, headers) if cache else None
+        if response is None:
+            response = requests.get(url, headers=headers, params=params)
+            if cache and response.status_code == 200:
+                cache.put('retweeted_by', url, params, headers, response)
+    """
+
+    def __init__(self, path=CACHE_PATH, max_bytes=DEFAULT_MAX_MB * 1024 * 1024, ttl_overrides=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_overrides = ttl_overrides or {}
+        self.lock = threading.Lock()
+        self.session = {}  # endpoint -> {'hits', 'misses'} of this process
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS entries (
+                                       key TEXT PRIMARY KEY, endpoint TEXT, url TEXT, body BLOB, headers TEXT,
+                                       size INTEGER, stored_at REAL, expires_at REAL, last_access REAL)""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS stats (
+                                       endpoint TEXT PRIMARY KEY, hits INTEGER, misses INTEGER,
+                                       stores INTEGER, evictions INTEGER)""")
+
+    def ttl(self, endpoint, url, params=None):
+        """
+        Seconds a response of this request may be served from the cache (0: not cacheable).
+        """
+        if endpoint in self.ttl_overrides:
+            return self.ttl_overrides[endpoint]
+        policy = CACHE_POLICIES.get(endpoint)
+        if policy is None:
+            return 0
+        ttl = policy[0]
+        return ttl(url, params) if callable(ttl) else ttl
+
+    def _key(self, endpoint, url, params, headers):
+        parts = [endpoint, url, json.dumps(sorted((params or {}).items()), default=str)]
+        if CACHE_POLICIES.get(endpoint, (0, False))[1]:
+            parts.append((headers or {}).get('Authorization', ''))
+        return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()
+
+    @contextmanager
+    def _transaction(self):
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def _count(self, endpoint, column, n=1):
+        self.connection.execute("INSERT OR IGNORE INTO stats VALUES (?, 0, 0, 0, 0)", (endpoint,))
+        self.connection.execute(f"UPDATE stats SET {column} = {column} + ? WHERE endpoint = ?", (n, endpoint))
+
+    def _count_session(self, endpoint, outcome):
+        session = self.session.setdefault(endpoint, {'hits': 0, 'misses': 0})
+        session[outcome] += 1
+
+    def get(self, endpoint, url, params=None, headers=None):
+        """
+        Return a CachedResponse for a fresh entry, or None (a miss).
+        Requests that are not cacheable are not counted.
+        """
+        if not self.ttl(endpoint, url, params):
+            return None
+        key = self._key(endpoint, url, params, headers)
+        now = time.time()
+        with self._transaction():
+            row = self.connection.execute("SELECT body, headers FROM entries WHERE key = ? AND expires_at > ?",
+                                          (key, now)).fetchone()
+            if row is None:
+                self._count(endpoint, 'misses')
+                self._count_session(endpoint, 'misses')
+                return None
+            self.connection.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+            self._count(endpoint, 'hits')
+            self._count_session(endpoint, 'hits')
+        return CachedResponse(row[0], json.loads(row[1]))
+
+    def put(self, endpoint, url, params, headers, response):
+        """
+        Store a successful response if its endpoint's policy allows it, then enforce the size cap.
+        """
+        ttl = self.ttl(endpoint, url, params)
+        if not ttl or response.status_code != 200:
+            return
+        key = self._key(endpoint, url, params, headers)
+        body = response.content
+        kept_headers = {name: value for name, value in response.headers.items() if name.lower().startswith('content-')}
+        now = time.time()
+        with self._transaction():
+            self.connection.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                    (key, endpoint, url, body, json.dumps(kept_headers), len(body), now, now + ttl, now))
+            self._count(endpoint, 'stores')
+            self._evict()
+
+    def _evict(self):
+        """
+        Drop expired entries, then the least recently used ones, until the cache fits its cap.
+        """
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        self.connection.execute("DELETE FROM entries WHERE expires_at <= ?", (time.time(),))
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        evicted = {}
+        for key, endpoint, size in self.connection.execute(
+                "SELECT key, endpoint, size FROM entries ORDER BY last_access").fetchall():
+            if total <= self.max_bytes:
+                break
+            self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            evicted[endpoint] = evicted.get(endpoint, 0) + 1
+        for endpoint, count in evicted.items():
+            self._count(endpoint, 'evictions', count)
+
+    def stats(self):
+        """
+        Per-endpoint counters since the cache was created, with entries, size and hit rate.
+        """
+        with self.lock:
+            counters = {row[0]: {'hits': row[1], 'misses': row[2], 'stores': row[3], 'evictions': row[4]}
+                        for row in self.connection.execute("SELECT * FROM stats")}
+            for endpoint, entries, size in self.connection.execute(
+                    "SELECT endpoint, COUNT(*), SUM(size) FROM entries GROUP BY endpoint"):
+                counters.setdefault(endpoint, {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0})
+                counters[endpoint].update(entries=entries, bytes=size)
+        for counter in counters.values():
+            counter.setdefault('entries', 0)
+            counter.setdefault('bytes', 0)
+            lookups = counter['hits'] + counter['misses']
+            counter['hit_rate'] = counter['hits'] / lookups if lookups else 0.0
+        return counters
+
+    def clear(self):
+        with self._transaction():
+            self.connection.execute("DELETE FROM entries")
+            self.connection.execute("DELETE FROM stats")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def parse_ttl_overrides(value):
+    """
+    Parse "endpoint=seconds,endpoint=seconds" into a dict.
+    """
+    overrides = {}
+    for item in (value or '').split(','):
+        endpoint, _, seconds = item.partition('=')
+        if endpoint.strip() and seconds.strip().isdigit():
+            overrides[endpoint.strip()] = int(seconds)
+    return overrides
+
+
+def get_http_cache():
+    """
+    The process-wide cache configured from the environment, or None if it is disabled.
+    """
+    global _cache
+    if os.getenv('TWITTER_HTTP_CACHE', '').lower() in ('0', 'off', 'no', 'false'):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            max_mb = os.getenv('TWITTER_HTTP_CACHE_MB', '')
+            _cache = HttpCache(max_bytes=(int(max_mb) if max_mb.isdigit() else DEFAULT_MAX_MB) * 1024 * 1024,
+                               ttl_overrides=parse_ttl_overrides(os.getenv('TWITTER_HTTP_CACHE_TTL')))
+        return _cache
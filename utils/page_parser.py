@@ -0,0 +1,123 @@
+"""
+Page Parsing
+Single-pass parsing of API tweet pages into typed columns, shared by the
+filtering and the CSV writing of stages 0 and 3.
+
+Each page is decoded once (with orjson when it is installed) and its tweets
+are walked once: tweet IDs, a bitmask of reference types, the retweeted
+tweet IDs and the retweet counts land in typed arrays that both filters and row builders reuse,
+instead of every consumer walking `referenced_tweets` again.
+"""
+
+import json
+from array import array
+from itertools import compress
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Reference type bits
+RETWEETED = 1
+QUOTED = 2
+REPLIED_TO = 4
+
+MISSING_ID = -1
+MISSING_COUNT = -1
+
+REFERENCE_TYPES = {
+    'retweeted': RETWEETED,
+    'quoted': QUOTED,
+    'replied_to': REPLIED_TO,
+}
+
+
+def decode_json(content):
+    """
+    Decode a JSON response body (bytes), with orjson if available.
+    """
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def _to_id(value):
+    return int(value) if value else MISSING_ID
+
+
+def _id_str(value):
+    return '' if value == MISSING_ID else str(value)
+
+
+def _count_str(value):
+    return '' if value == MISSING_COUNT else str(value)
+
+
+class TweetPage:
+    """
+    Columns of one page of tweets, built in a single pass.
+
+    Columns (one entry per tweet):
+        ids            int64 tweet IDs (MISSING_ID if missing)
+        flags          uint8 bitmask of RETWEETED / QUOTED / REPLIED_TO
+        retweeted_ids  int64 ID of the retweeted tweet (MISSING_ID if not a retweet)
+        retweet_counts int64 public_metrics.retweet_count (MISSING_COUNT if not requested)
+    """
+
+    def __init__(self, tweets):
+        self.tweets = tweets
+        self.ids = array('q')
+        self.flags = array('B')
+        self.retweeted_ids = array('q')
+        self.retweet_counts = array('q')
+
+        for tweet in tweets:
+            flags = 0
+            retweeted_id = MISSING_ID
+            for ref in tweet.get('referenced_tweets', ()):
+                bit = REFERENCE_TYPES.get(ref.get('type'), 0)
+                if bit == RETWEETED and not flags & RETWEETED:
+                    retweeted_id = _to_id(ref.get('id'))
+                flags |= bit
+            self.ids.append(_to_id(tweet.get('id')))
+            self.flags.append(flags)
+            self.retweeted_ids.append(retweeted_id)
+            self.retweet_counts.append(tweet.get('public_metrics', {}).get('retweet_count', MISSING_COUNT))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def mask(self, bit, present=True):
+        """
+        Selector per tweet: whether its flags have (or, with present=False, lack) the bit.
+        """
+        if present:
+            return [flags & bit != 0 for flags in self.flags]
+        return [flags & bit == 0 for flags in self.flags]
+
+    def original_rows(self):
+        """
+        Stage 0 CSV rows [id, retweet_count] of the tweets that are not quote tweets
+        (retweet_count is empty when the page was fetched without public_metrics).
+        """
+        selected = self.mask(QUOTED, present=False)
+        return [[_id_str(tweet_id), _count_str(count)]
+                for tweet_id, count in compress(zip(self.ids, self.retweet_counts), selected)]
+
+    def retweet_rows(self):
+        """
+        Stage 3 CSV rows (see USER_TWEETS_HEADER) of the page's retweets.
+        """
+        rows = []
+        selected = self.mask(RETWEETED)
+        for tweet, tweet_id, retweeted_id in compress(zip(self.tweets, self.ids, self.retweeted_ids), selected):
+            rows.append([
+                _id_str(tweet_id),
+                tweet.get('text', '').replace('\n', ' '),
+                tweet.get('created_at', ''),
+                _id_str(retweeted_id),
+                tweet.get('lang', ''),
+                tweet.get('conversation_id', '')
+            ])
+        return rows
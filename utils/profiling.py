@@ -0,0 +1,397 @@
+"""
+Stage Profiling
+Opt-in profiling of the stage scripts, enabled with --profile on any stage:
+
+    --profile            low-overhead timers around the stage's key functions and
+                         the shared hot spots (network, sleeps, JSON, CSV writes)
+    --profile=cprofile   timers plus cProfile of every thread
+    --profile=sample     timers plus a stack sampler over every thread
+
+Nothing is wrapped unless --profile is given: the timers replace the functions'
+module bindings for the duration of the run and restore them afterwards. Each
+timer records calls, inclusive time and self time (inclusive minus the time of
+nested timed calls), per thread, so a page fetch that sleeps on the rate limit
+shows its time under time.sleep rather than twice.
+
+At exit a ranked breakdown is printed and a JSON report is written to
+twitter_files/profiles/{stage}_{timestamp}.json; compare two reports with
+`python pipeline.py profile <old.json> <new.json>`.
+"""
+
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+PROFILE_DIR = "twitter_files/profiles"
+MODES = ('timers', 'cprofile', 'sample')
+SAMPLE_INTERVAL = 0.005
+REPORT_TOP = 25
+
+# (module, attribute, category) of the hot spots shared by the stages. Modules
+# that the running stage never imported are skipped, so local stages stay local.
+SHARED_TARGETS = [
+    ('requests', 'get', 'network'),
+    ('time', 'sleep', 'sleep'),
+    ('utils.page_parser', 'decode_json', 'json'),
+    ('utils.csv_io', 'write_csv_atomic', 'csv'),
+    ('utils.csv_io', 'ShardedCsvWriter.write_entity', 'csv'),
+    ('utils.snapshot_utils', 'build_snapshot', 'snapshot'),
+]
+
+
+def profile_mode(args):
+    """
+    Return the profiling mode requested in args (None without --profile).
+    Raises ValueError for an unknown mode.
+    """
+    for arg in args:
+        if arg == '--profile':
+            return 'timers'
+        if arg.startswith('--profile='):
+            mode = arg[len('--profile='):]
+            if mode not in MODES:
+                raise ValueError(f"Unknown profile mode {mode!r} (use {', '.join(MODES)})")
+            return mode
+    return None
+
+
+class FunctionTimers:
+    """
+    Per-function call counts, inclusive and self time, shared by all threads.
+    """
+
+    def __init__(self):
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def record(self, name, category, elapsed, own):
+        with self.lock:
+            entry = self.stats.get(name)
+            if entry is None:
+                entry = self.stats[name] = {'category': category, 'calls': 0, 'total': 0.0, 'self': 0.0, 'max': 0.0}
+            entry['calls'] += 1
+            entry['total'] += elapsed
+            entry['self'] += own
+            if elapsed > entry['max']:
+                entry['max'] = elapsed
+
+    def wrap(self, name, category, function):
+        timers = self
+        perf_counter = time.perf_counter
+
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            stack = getattr(timers.local, 'stack', None)
+            if stack is None:
+                stack = timers.local.stack = []
+            stack.append(0.0)
+            started = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - started
+                nested = stack.pop()
+                if stack:
+                    stack[-1] += elapsed
+                timers.record(name, category, elapsed, elapsed - nested)
+
+        return timed
+
+
+class StackSampler(threading.Thread):
+    """
+    Samples the innermost frame of every other thread every `interval` seconds.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        super().__init__(name='profile-sampler', daemon=True)
+        self.interval = interval
+        self.own = {}
+        self.cumulative = {}
+        self.samples = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        sampler_id = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == sampler_id:
+                    continue
+                self.samples += 1
+                label = _frame_label(frame)
+                self.own[label] = self.own.get(label, 0) + 1
+                seen = set()
+                while frame is not None:
+                    label = _frame_label(frame)
+                    if label not in seen:
+                        seen.add(label)
+                        self.cumulative[label] = self.cumulative.get(label, 0) + 1
+                    frame = frame.f_back
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def report(self, top=REPORT_TOP):
+        ranked = sorted(self.own.items(), key=lambda item: -item[1])[:top]
+        return [{'function': label, 'samples': count, 'share': count / self.samples,
+                 'cumulative_share': self.cumulative[label] / self.samples} for label, count in ranked]
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}({code.co_name})"
+
+
+class ThreadProfiles:
+    """
+    cProfile of the main thread and of every thread started while it is active.
+    On Python versions where one profiler already sees every thread, the per-thread
+    hook steps aside.
+    """
+
+    def __init__(self):
+        self.profiles = []
+        self.lock = threading.Lock()
+
+    def _enable(self):
+        import cProfile
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            return
+        with self.lock:
+            self.profiles.append(profile)
+
+    def _thread_hook(self, frame, event, arg):
+        sys.setprofile(None)
+        self._enable()
+
+    def start(self):
+        threading.setprofile(self._thread_hook)
+        self._enable()
+
+    def stop(self):
+        threading.setprofile(None)
+        if self.profiles:
+            self.profiles[0].disable()
+
+    def report(self, top=REPORT_TOP):
+        import io
+        import pstats
+
+        if not self.profiles:
+            return []
+        stats = pstats.Stats(self.profiles[0], stream=io.StringIO())
+        for profile in self.profiles[1:]:
+            stats.add(profile)
+        rows = []
+        for (filename, line, name), (_, ncalls, tottime, cumtime, _) in stats.stats.items():
+            rows.append({'function': f"{os.path.basename(filename)}:{line}({name})",
+                         'calls': ncalls, 'self': tottime, 'total': cumtime})
+        rows.sort(key=lambda row: -row['self'])
+        return rows[:top]
+
+
+class StageProfiler:
+    """
+    Wraps a stage's key functions and the shared hot spots for one run.
+
+    Usage:
+        with StageProfiler('3.get_user_retweets', 'timers', namespace, {'get_user_tweets': 'fetch'}):
+            main()
+    """
+
+    def __init__(self, stage, mode, namespace, functions):
+        self.stage = stage
+        self.mode = mode
+        self.namespace = namespace
+        self.functions = functions
+        self.timers = FunctionTimers()
+        self.patched = []
+        self.sampler = StackSampler() if mode == 'sample' else None
+        self.thread_profiles = ThreadProfiles() if mode == 'cprofile' else None
+
+    def _replace_everywhere(self, original, replacement):
+        """
+        Rebind every module-level name bound to original (e.g. names imported with
+        `from module import function`) to replacement.
+        """
+        for module in list(sys.modules.values()):
+            namespace = getattr(module, '__dict__', None)
+            if not isinstance(namespace, dict):
+                continue
+            for attr, value in list(namespace.items()):
+                if value is original:
+                    namespace[attr] = replacement
+                    self.patched.append((namespace, attr, original))
+
+    def _wrap_attribute(self, owner, attr, name, category):
+        original = getattr(owner, attr, None)
+        if not callable(original):
+            return
+        wrapped = self.timers.wrap(name, category, original)
+        if isinstance(owner, type):
+            setattr(owner, attr, wrapped)
+            self.patched.append((owner, attr, original))
+        else:
+            self._replace_everywhere(original, wrapped)
+
+    def start(self):
+        for module_name, path, category in SHARED_TARGETS:
+            module = sys.modules.get(module_name)
+            if module is None:
+                continue
+            owner, _, attr = path.rpartition('.')
+            self._wrap_attribute(getattr(module, owner) if owner else module, attr,
+                                 f"{module_name}.{path}", category)
+
+        for name, category in self.functions.items():
+            original = self.namespace.get(name)
+            if callable(original):
+                wrapped = self.timers.wrap(name, category, original)
+                self._replace_everywhere(original, wrapped)
+                self.namespace[name] = wrapped
+
+        self.started = time.perf_counter()
+        self.started_at = datetime.now()
+        if self.sampler:
+            self.sampler.start()
+        if self.thread_profiles:
+            self.thread_profiles.start()
+
+    def stop(self):
+        if self.thread_profiles:
+            self.thread_profiles.stop()
+        if self.sampler:
+            self.sampler.stop()
+        self.wall_time = time.perf_counter() - self.started
+        for owner, attr, original in reversed(self.patched):
+            if isinstance(owner, dict):
+                owner[attr] = original
+            else:
+                setattr(owner, attr, original)
+        self.patched = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        report = self.report()
+        print_report(report)
+        path = save_report(report)
+        print(f"\n⏱️  Profile saved to {path}")
+
+    def report(self):
+        functions = [dict(entry, function=name) for name, entry in self.timers.stats.items()]
+        functions.sort(key=lambda entry: -entry['self'])
+        categories = {}
+        for entry in functions:
+            categories[entry['category']] = categories.get(entry['category'], 0.0) + entry['self']
+
+        report = {
+            'stage': self.stage,
+            'mode': self.mode,
+            'argv': sys.argv[1:],
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'wall_time': self.wall_time,
+            'categories': dict(sorted(categories.items(), key=lambda item: -item[1])),
+            'functions': functions,
+        }
+        if self.thread_profiles:
+            report['cprofile'] = self.thread_profiles.report()
+        if self.sampler:
+            report['samples'] = self.sampler.samples
+            report['sampled'] = self.sampler.report()
+        return report
+
+
+def print_report(report, top=REPORT_TOP):
+    wall_time = report['wall_time']
+    print(f"\n⏱️  Profile of {report['stage']} ({report['mode']}): {wall_time:.2f}s wall time")
+    print("   Times summed over all threads; self = time not spent in other timed functions\n")
+    print(f"   {'category':<10} {'self':>9} {'% wall':>7}")
+    for category, seconds in report['categories'].items():
+        print(f"   {category:<10} {seconds:>8.2f}s {100 * seconds / wall_time if wall_time else 0:>6.1f}%")
+
+    print(f"\n   {'function':<40} {'calls':>8} {'self':>9} {'total':>9} {'mean':>9} {'max':>9}")
+    for entry in report['functions'][:top]:
+        mean = entry['total'] / entry['calls'] if entry['calls'] else 0.0
+        print(f"   {entry['function'][:40]:<40} {entry['calls']:>8} {entry['self']:>8.3f}s {entry['total']:>8.3f}s "
+              f"{1000 * mean:>7.2f}ms {1000 * entry['max']:>7.1f}ms")
+
+    if report.get('cprofile'):
+        print(f"\n   cProfile, by self time:")
+        for row in report['cprofile'][:top]:
+            print(f"   {row['function'][:60]:<60} {row['calls']:>8} {row['self']:>8.3f}s {row['total']:>8.3f}s")
+    if report.get('sampled'):
+        print(f"\n   Sampled stacks ({report['samples']} samples), innermost frame:")
+        for row in report['sampled'][:top]:
+            print(f"   {row['function'][:60]:<60} {100 * row['share']:>6.1f}% (in stack {100 * row['cumulative_share']:.1f}%)")
+
+
+def save_report(report):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = report['started_at'].replace(':', '').replace('-', '')
+    path = os.path.join(PROFILE_DIR, f"{report['stage']}_{stamp}.json")
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1)
+    os.replace(tmp_path, path)
+    return path
+
+
+def compare_reports(old_path, new_path, top=REPORT_TOP):
+    """
+    Print the per-category and per-function self time of two saved reports side by side.
+    """
+    with open(old_path, 'r', encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, 'r', encoding='utf-8') as f:
+        new = json.load(f)
+
+    def delta(before, after):
+        return f"{after - before:+.3f}s" + (f" ({100 * (after - before) / before:+.0f}%)" if before else '')
+
+    print(f"Wall time: {old['wall_time']:.2f}s -> {new['wall_time']:.2f}s  {delta(old['wall_time'], new['wall_time'])}")
+    print(f"\n   {'category':<10} {'old':>9} {'new':>9}  change")
+    for category in dict.fromkeys(list(new['categories']) + list(old['categories'])):
+        before, after = old['categories'].get(category, 0.0), new['categories'].get(category, 0.0)
+        print(f"   {category:<10} {before:>8.2f}s {after:>8.2f}s  {delta(before, after)}")
+
+    old_functions = {entry['function']: entry for entry in old['functions']}
+    new_functions = {entry['function']: entry for entry in new['functions']}
+    names = sorted(set(old_functions) | set(new_functions),
+                   key=lambda name: -abs(new_functions.get(name, {}).get('self', 0.0) - old_functions.get(name, {}).get('self', 0.0)))
+    print(f"\n   {'function (self time)':<40} {'old':>9} {'new':>9}  change")
+    for name in names[:top]:
+        before = old_functions.get(name, {}).get('self', 0.0)
+        after = new_functions.get(name, {}).get('self', 0.0)
+        print(f"   {name[:40]:<40} {before:>8.3f}s {after:>8.3f}s  {delta(before, after)}")
+
+
+def run_main(namespace):
+    """
+    Run a stage script's main(), profiled if --profile is on the command line.
+    The stage lists its key functions in PROFILED_FUNCTIONS ({name: category}).
+    """
+    try:
+        mode = profile_mode(sys.argv[1:])
+    except ValueError as e:
+        print(f"❌ {e}")
+        return
+    if mode is None:
+        return namespace['main']()
+
+    stage = os.path.splitext(os.path.basename(namespace['__file__']))[0]
+    with StageProfiler(stage, mode, namespace, namespace.get('PROFILED_FUNCTIONS', {})):
+        return namespace['main']()
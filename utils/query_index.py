@@ -0,0 +1,376 @@
+"""
+Query Index
+In-memory indexes over the aggregated outputs of one or more accounts, for the
+local query server (query_server.py).
+
+Each account is loaded once from its engaged accounts (stage 2) and its stage 3
+retweets (the columnar snapshot when it is fresh, the CSVs otherwise). Retweets
+are kept as int columns sorted by time, so a time window is two binary searches,
+and the all-time ranking is computed at load time.
+
+Hot reload is cheap to poll: the engaged accounts files and the stage 3
+directory are stat()ed, and an account is only reloaded when its own files
+changed. A reload builds the new index aside and swaps it in, so queries never
+wait for it; results cached before the swap are dropped (see LRUCache).
+"""
+
+import csv
+import glob
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+from utils.csv_io import iter_entity_rows
+from utils.reports import ENGAGED_ACCOUNTS_DIR, audience_overlap, get_engaged_accounts_path
+from utils.snapshot_utils import (RETWEET_HANDLE_PATTERN, SNAPSHOT_DIR, get_snapshot_path, list_tweet_files,
+                                  load_fresh_snapshot, to_epoch)
+
+DEFAULT_CACHE_SIZE = 1024
+_MISSING = object()  # cache miss marker, so None results (unknown users) are cached too
+
+
+def discover_accounts():
+    """
+    Accounts that have an engaged accounts file.
+    """
+    suffix = '_engaged_accounts.csv'
+    return sorted(os.path.basename(path)[:-len(suffix)]
+                  for path in glob.glob(os.path.join(ENGAGED_ACCOUNTS_DIR, f'*{suffix}')))
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def source_signature(account_name):
+    """
+    What an account's index was built from: the engaged accounts file, the tweet files
+    (count and newest mtime) and the snapshot. Any change means a reload.
+    """
+    csv_files = list_tweet_files(account_name)
+    newest = max((os.stat(path).st_mtime for path in csv_files), default=0.0)
+    return (_mtime(get_engaged_accounts_path(account_name)), len(csv_files), newest,
+            _mtime(get_snapshot_path(account_name)))
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache of query results with hit/miss counters.
+    Keys include the index generation, so clear() on reload is only about memory.
+    """
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.entries), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+
+class AccountIndex:
+    """
+    One account's engaged users and their retweets.
+
+    Retweets with a handle are stored as parallel columns sorted by created_at
+    (epoch seconds, UTC): row_time, row_user, row_handle (index into handles) and
+    row_retweet (the retweet's tweet ID, 0 if missing).
+    user_rows maps a user ID to its row numbers; handle_users holds the distinct
+    users of each handle, and ranking the all-time (handle index, users) order.
+    """
+
+    def __init__(self, account_name):
+        self.account_name = account_name
+        self.signature = source_signature(account_name)
+        self.loaded_at = time.time()
+        self.engaged = self._read_engaged()
+        self.handles = []
+        self.source = None
+        rows = self._read_rows()
+
+        rows.sort()
+        self.row_time = array('q', (row[0] for row in rows))
+        self.row_user = array('q', (row[1] for row in rows))
+        self.row_handle = array('i', (row[2] for row in rows))
+        self.row_retweet = array('q', (row[3] for row in rows))
+        del rows
+
+        self.user_rows = {}
+        self.handle_users = [set() for _ in self.handles]
+        for i, (user_id, handle_id) in enumerate(zip(self.row_user, self.row_handle)):
+            self.user_rows.setdefault(user_id, array('i')).append(i)
+            self.handle_users[handle_id].add(user_id)
+        self.ranking = sorted(((handle_id, len(users)) for handle_id, users in enumerate(self.handle_users) if users),
+                              key=lambda item: (-item[1], self.handles[item[0]]))
+
+    def _read_engaged(self):
+        """
+        {user_id (int): (username, engagement_count)} from the stage 2 file.
+        """
+        engaged = {}
+        path = get_engaged_accounts_path(self.account_name)
+        if not os.path.exists(path):
+            return engaged
+        with open(path, 'r', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                user_id = row.get('user_id', '').strip()
+                if user_id.isdigit():
+                    count = row.get('engagement_count', '').strip()
+                    engaged[int(user_id)] = (row.get('username', ''), int(count) if count.isdigit() else 0)
+        return engaged
+
+    def _handle_id(self, handle, handle_ids):
+        handle_id = handle_ids.get(handle)
+        if handle_id is None:
+            handle_id = handle_ids[handle] = len(self.handles)
+            self.handles.append(handle)
+        return handle_id
+
+    def _read_rows(self):
+        """
+        (created_at, user_id, handle index, retweet ID) of every retweet with a handle.
+        """
+        rows = []
+        snapshot = load_fresh_snapshot(self.account_name)
+        if snapshot:
+            with snapshot:
+                self.source = snapshot.path
+                self.handles = list(snapshot.dictionary('handle'))
+                for created_at, user_id, code, retweet_id in zip(snapshot['created_at'], snapshot['user_id'],
+                                                                 snapshot['handle'], snapshot['retweet_id']):
+                    if code >= 0:
+                        rows.append((created_at, user_id, code, retweet_id))
+            return rows
+
+        self.source = SNAPSHOT_DIR
+        handle_ids = {}
+        for csv_file in list_tweet_files(self.account_name):
+            for user_id, row in iter_entity_rows(csv_file, self.account_name, '_tweets.csv', 'user_id'):
+                match = RETWEET_HANDLE_PATTERN.match(row.get('text', '').strip())
+                if match and user_id.isdigit():
+                    retweet_id = row.get('retweet_id', '').strip()
+                    rows.append((to_epoch(row.get('created_at')), int(user_id),
+                                 self._handle_id(match.group(1), handle_ids),
+                                 int(retweet_id) if retweet_id.isdigit() else 0))
+        return rows
+
+    def window(self, since=None, until=None):
+        """
+        Row range [start, end) of the retweets created in [since, until).
+        """
+        start = 0 if since is None else bisect_left(self.row_time, since)
+        end = len(self.row_time) if until is None else bisect_left(self.row_time, until)
+        return start, max(start, end)
+
+    def describe(self):
+        return {
+            'account': self.account_name,
+            'engaged_users': len(self.engaged),
+            'users_with_retweets': len(self.user_rows),
+            'retweets': len(self.row_time),
+            'handles': len(self.handles),
+            'first_retweet': self.row_time[0] if self.row_time else None,
+            'last_retweet': self.row_time[-1] if self.row_time else None,
+            'source': self.source,
+            'loaded_at': int(self.loaded_at),
+        }
+
+
+class QueryIndex:
+    """
+    The loaded accounts and the queries over them. Query results are plain
+    JSON-serializable dicts, cached in an LRUCache.
+
+    Usage:
+        index = QueryIndex(['ethstatus'])   # or QueryIndex() for every account with outputs
+        index.ranking(['ethstatus'], top=20, since=1704067200)
+        index.reload_changed()              # called periodically by the server
+    """
+
+    def __init__(self, account_names=None, cache_size=DEFAULT_CACHE_SIZE):
+        self.fixed_accounts = list(account_names or [])
+        self.accounts = {}
+        self.generation = 0
+        self.cache = LRUCache(cache_size)
+        self.lock = threading.Lock()
+        self.poll_state = None
+        for account_name in self.fixed_accounts or discover_accounts():
+            self.accounts[account_name] = AccountIndex(account_name)
+
+    def _poll_state(self):
+        return (_mtime(ENGAGED_ACCOUNTS_DIR), _mtime(SNAPSHOT_DIR),
+                tuple(_mtime(get_engaged_accounts_path(account)) for account in sorted(self.accounts)))
+
+    def reload_changed(self):
+        """
+        Reload the accounts whose files changed (and load new ones when serving every account).
+        Returns the reloaded account names.
+        """
+        poll_state = self._poll_state()
+        if poll_state == self.poll_state:
+            return []
+        self.poll_state = poll_state
+
+        reloaded = []
+        for account_name in self.fixed_accounts or discover_accounts():
+            current = self.accounts.get(account_name)
+            if current and current.signature == source_signature(account_name):
+                continue
+            account_index = AccountIndex(account_name)
+            with self.lock:
+                self.accounts[account_name] = account_index
+                self.generation += 1
+            reloaded.append(account_name)
+        if reloaded:
+            self.cache.clear()
+        return reloaded
+
+    def _get_accounts(self, account_names):
+        with self.lock:
+            names = account_names or sorted(self.accounts)
+            missing = [name for name in names if name not in self.accounts]
+            if missing:
+                raise KeyError(f"Unknown account(s): {', '.join(missing)}")
+            return self.generation, [self.accounts[name] for name in names]
+
+    def cached(self, query, account_names, *args):
+        """
+        Run query(account_indexes, *args) through the LRU cache.
+        """
+        generation, account_indexes = self._get_accounts(account_names)
+        key = (generation, query.__name__, tuple(index.account_name for index in account_indexes), args)
+        result = self.cache.get(key, _MISSING)
+        if result is _MISSING:
+            result = query(account_indexes, *args)
+            self.cache.put(key, result)
+        return result
+
+    def ranking(self, account_names=None, top=100, since=None, until=None):
+        return self.cached(_ranking, account_names, top, since, until)
+
+    def overlap(self, account_names=None):
+        return self.cached(_overlap, account_names)
+
+    def user(self, user_id, account_names=None, since=None, until=None, top=20):
+        return self.cached(_user, account_names, int(user_id), since, until, top)
+
+    def status(self):
+        with self.lock:
+            accounts = [index.describe() for index in self.accounts.values()]
+            generation = self.generation
+        return {'generation': generation, 'accounts': accounts, 'cache': self.cache.stats()}
+
+
+def _ranking(account_indexes, top, since, until):
+    """
+    Handles retweeted by the most distinct users, over the whole history or a time window.
+    """
+    if len(account_indexes) == 1 and since is None and until is None:
+        index = account_indexes[0]
+        ranked = [(index.handles[handle_id], users) for handle_id, users in index.ranking[:top]]
+        users_total = len(index.user_rows)
+    else:
+        handles_users = {}
+        window_users = set()
+        for index in account_indexes:
+            start, end = index.window(since, until)
+            if start == 0 and end == len(index.row_time):
+                for handle_id, users in enumerate(index.handle_users):
+                    handles_users.setdefault(index.handles[handle_id], set()).update(users)
+                window_users.update(index.user_rows)
+                continue
+            for user_id, handle_id in zip(index.row_user[start:end], index.row_handle[start:end]):
+                handles_users.setdefault(index.handles[handle_id], set()).add(user_id)
+                window_users.add(user_id)
+        ranked = sorted(((handle, len(users)) for handle, users in handles_users.items() if users),
+                        key=lambda item: (-item[1], item[0]))[:top]
+        users_total = len(window_users)
+
+    return {
+        'accounts': [index.account_name for index in account_indexes],
+        'since': since,
+        'until': until,
+        'users': users_total,
+        'ranking': [{'username': handle, 'unique_users_count': users} for handle, users in ranked],
+    }
+
+
+def _overlap(account_indexes):
+    overlap = audience_overlap({index.account_name: set(index.engaged) for index in account_indexes})
+    overlap['accounts'] = [index.account_name for index in account_indexes]
+    return overlap
+
+
+def _user(account_indexes, user_id, since, until, top):
+    """
+    One user's engagement with each account and the handles they retweet the most.
+    A retweet is counted once by its ID, even if the timeline was fetched for several
+    accounts (or twice into shard files); retweets without an ID are all counted.
+    """
+    accounts = []
+    handle_counts = {}
+    seen = set()
+    retweets = 0
+    first = last = None
+    for index in account_indexes:
+        engaged = index.engaged.get(user_id)
+        if engaged:
+            accounts.append({'account': index.account_name, 'username': engaged[0], 'engagement_count': engaged[1]})
+        start, end = index.window(since, until)
+        for row in index.user_rows.get(user_id, ()):
+            if not start <= row < end:
+                continue
+            retweet_id = index.row_retweet[row]
+            if retweet_id:
+                if retweet_id in seen:
+                    continue
+                seen.add(retweet_id)
+            handle = index.handles[index.row_handle[row]]
+            created_at = index.row_time[row]
+            retweets += 1
+            handle_counts[handle] = handle_counts.get(handle, 0) + 1
+            first = created_at if first is None else min(first, created_at)
+            last = created_at if last is None else max(last, created_at)
+
+    if not accounts and not retweets:
+        return None
+    ranked = sorted(handle_counts.items(), key=lambda item: (-item[1], item[0]))[:top]
+    return {
+        'user_id': str(user_id),
+        'engaged_with': accounts,
+        'since': since,
+        'until': until,
+        'retweets': retweets,
+        'first_retweet': first,
+        'last_retweet': last,
+        'retweeted_handles': [{'username': handle, 'retweets': count} for handle, count in ranked],
+    }
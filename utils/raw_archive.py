@@ -0,0 +1,229 @@
+"""
+Raw Response Archive
+Optional capture of every raw API page into compressed, newline-delimited
+JSON segments with an index, so outputs can be regenerated offline (see
+replay_archive.py) without spending any API calls.
+
+Layout:
+    twitter_files/raw_archive/{stage}_{account}/
+        segment-00001.jsonl.zst   (or .jsonl.gz without the zstandard package)
+        index.csv                 segment, entity_id, pagination_token, line
+
+A segment is written as a .tmp file and renamed once it is full or the run
+ends, so readers only ever see complete segments. New segments are numbered
+after the highest existing one, .tmp leftovers of an interrupted run
+included, so a segment is never overwritten. When a fetch fails for good, a
+failure record (no response) marks the entity as finished.
+"""
+
+import csv
+import glob
+import gzip
+import io
+import json
+import os
+import re
+import threading
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ARCHIVE_DIR = "twitter_files/raw_archive"
+DEFAULT_SEGMENT_PAGES = 1000
+INDEX_FIELDS = ['segment', 'entity_id', 'pagination_token', 'line']
+SEGMENT_NAME = re.compile(r'^segment-(\d+)\.jsonl\.(?:gz|zst)(?:\.tmp)?$')
+
+
+def get_archive_dir(stage, account_name=''):
+    name = f"{stage}_{account_name}" if account_name else stage
+    return os.path.join(ARCHIVE_DIR, name)
+
+
+def _open_writer(path, compression):
+    if compression == 'zst':
+        raw = open(path, 'wb')
+        return io.TextIOWrapper(zstandard.ZstdCompressor(level=3).stream_writer(raw), encoding='utf-8')
+    return gzip.open(path, 'wt', encoding='utf-8')
+
+
+def _open_reader(path):
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError(f"{path} needs the zstandard package: pip install zstandard")
+        raw = open(path, 'rb')
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(raw), encoding='utf-8')
+    return gzip.open(path, 'rt', encoding='utf-8')
+
+
+class RawArchive:
+    """
+    Appends raw API pages to rolling compressed segments.
+
+    Usage:
+        archive = RawArchive('3_user_retweets', 'ethstatus')
+        archive.append(user_id, pagination_token, response_json)
+        ...
+        archive.close()
+    """
+
+    def __init__(self, stage, account_name='', compression=None, segment_pages=DEFAULT_SEGMENT_PAGES):
+        self.directory = get_archive_dir(stage, account_name)
+        self.compression = compression or ('zst' if zstandard else 'gz')
+        self.segment_pages = segment_pages
+        self.lock = threading.Lock()
+        self.file = None
+        self.index_rows = []
+        self.pages = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self.segment_number = _last_segment_number(self.directory)
+
+    def _segment_name(self):
+        return f"segment-{self.segment_number:05d}.jsonl.{self.compression}"
+
+    def _open_segment(self):
+        self.segment_number += 1
+        self.file = _open_writer(os.path.join(self.directory, self._segment_name()) + '.tmp', self.compression)
+        self.lines = 0
+
+    def _finalize_segment(self):
+        if not self.file:
+            return
+        self.file.close()
+        path = os.path.join(self.directory, self._segment_name())
+        os.replace(path + '.tmp', path)
+
+        index_path = os.path.join(self.directory, 'index.csv')
+        is_new = not os.path.exists(index_path)
+        with open(index_path, 'a', newline='', encoding='utf-8') as csvfile:
+            writer = csv.writer(csvfile)
+            if is_new:
+                writer.writerow(INDEX_FIELDS)
+            writer.writerows(self.index_rows)
+
+        self.index_rows = []
+        self.file = None
+
+    def append(self, entity_id, pagination_token, data):
+        """
+        Archive one raw page (the decoded JSON body of a 200 response).
+        """
+        self._write({
+            'entity_id': str(entity_id),
+            'pagination_token': pagination_token,
+            'fetched_at': int(time.time()),
+            'response': data,
+        })
+
+    def append_failure(self, entity_id, pagination_token, error):
+        """
+        Record that a page failed for good (a RequestFailed error), so readers drop the entity.
+        """
+        self._write({
+            'entity_id': str(entity_id),
+            'pagination_token': pagination_token,
+            'fetched_at': int(time.time()),
+            'failed': error.failure_class,
+        })
+
+    def _write(self, record):
+        entity_id = record['entity_id']
+        pagination_token = record['pagination_token']
+        with self.lock:
+            if not self.file:
+                self._open_segment()
+            self.file.write(json.dumps(record, separators=(',', ':')) + '\n')
+            self.index_rows.append([self._segment_name(), entity_id, pagination_token or '', self.lines])
+            self.lines += 1
+            if 'response' in record:
+                self.pages += 1
+            if self.lines >= self.segment_pages:
+                self._finalize_segment()
+
+    def close(self):
+        with self.lock:
+            self._finalize_segment()
+
+
+def _complete_segments(directory):
+    segments = glob.glob(os.path.join(directory, 'segment-*.jsonl.gz')) + glob.glob(os.path.join(directory, 'segment-*.jsonl.zst'))
+    return sorted(segments)
+
+
+def _last_segment_number(directory):
+    numbers = [int(match.group(1)) for match in map(SEGMENT_NAME.match, os.listdir(directory)) if match]
+    return max(numbers, default=0)
+
+
+def list_segments(stage, account_name=''):
+    """
+    Complete segments of an archive, in write order.
+    """
+    return _complete_segments(get_archive_dir(stage, account_name))
+
+
+def segments_for_entities(stage, account_name, entity_ids):
+    """
+    Use the index to find only the segments that hold pages of the given entities.
+    Without an index (e.g. the run never closed a segment), every complete segment is returned.
+    """
+    directory = get_archive_dir(stage, account_name)
+    index_path = os.path.join(directory, 'index.csv')
+    if not os.path.exists(index_path):
+        segments = _complete_segments(directory)
+        if segments:
+            print(f"   ⚠️  No index in {directory}, scanning all {len(segments)} segment(s)")
+        return segments
+
+    wanted = set(str(entity_id) for entity_id in entity_ids)
+    segments = set()
+    with open(index_path, 'r', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            if row['entity_id'] in wanted:
+                segments.add(os.path.join(directory, row['segment']))
+    return sorted(segments)
+
+
+def iter_pages(segments):
+    """
+    Stream archived page records from the given segments, one at a time.
+    """
+    for segment in segments:
+        with _open_reader(segment) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def iter_complete_entities(segments, entity_ids=None):
+    """
+    Group streamed pages per entity and yield (entity_id, pages) once an entity's
+    last page (no next_token) is read. Entities whose pagination failed are dropped
+    at their failure record. Only entities with pages in flight are held in memory,
+    so memory stays bounded however large the archive is (archives written before
+    failure records existed hold a failed entity's pages until the end).
+    """
+    wanted = set(str(entity_id) for entity_id in entity_ids) if entity_ids else None
+    in_flight = {}
+
+    for record in iter_pages(segments):
+        entity_id = record['entity_id']
+        if wanted is not None and entity_id not in wanted:
+            continue
+
+        if 'failed' in record:
+            in_flight.pop(entity_id, None)
+            continue
+
+        # A first page (no pagination token) restarts the entity, e.g. after a re-queue
+        if not record['pagination_token']:
+            in_flight[entity_id] = []
+        elif entity_id not in in_flight:
+            continue
+
+        in_flight[entity_id].append(record['response'])
+
+        if not record['response'].get('meta', {}).get('next_token'):
+            yield entity_id, in_flight.pop(entity_id)
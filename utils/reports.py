@@ -0,0 +1,151 @@
+"""
+Local Reports
+Read-only queries over the pipeline's output files (no API calls, no network
+imports), cheap enough to run from dashboards and cron jobs.
+"""
+
+import csv
+import os
+from itertools import combinations
+
+ENGAGED_ACCOUNTS_DIR = "twitter_files/2_engaged_accounts"
+RETWEETED_ACCOUNTS_DIR = "twitter_files/4_retweeted_accounts"
+
+
+def get_engaged_accounts_path(account_name):
+    return os.path.join(ENGAGED_ACCOUNTS_DIR, f'{account_name}_engaged_accounts.csv')
+
+
+def get_ranking_path(account_names):
+    if account_names:
+        return os.path.join(RETWEETED_ACCOUNTS_DIR, f"{'_'.join(account_names)}_retweeted_accounts.csv")
+    return os.path.join(RETWEETED_ACCOUNTS_DIR, 'retweeted_accounts.csv')
+
+
+def read_engaged_user_ids(account_name):
+    """
+    Return the set of user IDs in an account's engaged accounts file (empty if missing).
+    """
+    path = get_engaged_accounts_path(account_name)
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'r', encoding='utf-8') as f:
+        return {row['user_id'] for row in csv.DictReader(f) if row.get('user_id')}
+
+
+def engaged_overlap(account_names):
+    """
+    Compare the engaged audiences of several accounts.
+    Returns {'audience_sizes': {account: n}, 'pairs': [...], 'shared_by_all': n}
+    with one pair entry (accounts, shared, jaccard) per pair of accounts, most shared first.
+    """
+    return audience_overlap({account: read_engaged_user_ids(account) for account in account_names})
+
+
+def audience_overlap(audiences):
+    """
+    engaged_overlap over already loaded audiences ({account: set of user IDs}).
+    """
+    account_names = list(audiences)
+    pairs = []
+    for first, second in combinations(account_names, 2):
+        shared = len(audiences[first] & audiences[second])
+        union = len(audiences[first] | audiences[second])
+        pairs.append({
+            'accounts': [first, second],
+            'shared': shared,
+            'jaccard': shared / union if union else 0.0,
+        })
+    pairs.sort(key=lambda pair: (-pair['shared'], pair['accounts']))
+
+    shared_by_all = set.intersection(*audiences.values()) if audiences else set()
+    return {
+        'audience_sizes': {account: len(users) for account, users in audiences.items()},
+        'pairs': pairs,
+        'shared_by_all': len(shared_by_all),
+    }
+
+
+def read_ranking(account_names, top=None):
+    """
+    Read the stage 4 ranking of one or more accounts (as written by 4.get_retweeted_accounts.py).
+    Only the first `top` rows are read when top is given. Returns None if the file is missing.
+    """
+    path = get_ranking_path(account_names)
+    if not os.path.exists(path):
+        return None
+
+    rows = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            if top is not None and len(rows) >= top:
+                break
+            row['unique_users_count'] = int(row['unique_users_count'])
+            rows.append(row)
+    return rows
+
+
+def get_comparison_path(account_names):
+    return os.path.join(RETWEETED_ACCOUNTS_DIR, f"{'_'.join(account_names)}_comparison.csv")
+
+
+def compare_rankings(handles_users_by_account, audiences):
+    """
+    Compare what the engaged audiences of several accounts retweet.
+
+    handles_users_by_account is {account: {handle: set of user IDs}} and audiences is
+    {account: set of user IDs read for it}. For every handle and account, returns the
+    account's unique users, their share of its audience, and a distinctiveness score:
+    the share in this account's audience over the share in the other accounts' combined
+    audience (+1 smoothed), so 1.0 is "as popular as elsewhere" and 5.0 "five times more".
+
+    Returns {'accounts', 'audience_sizes', 'rows', 'shared_by_all', 'unique'}: rows are
+    {'handle', 'total_users', 'accounts_count', 'users', 'share', 'distinctiveness'}
+    (per-account dicts), most unique users overall first; 'unique' counts per account
+    the handles no other account's audience retweeted.
+    """
+    account_names = list(handles_users_by_account)
+    all_handles = set()
+    for handles_users in handles_users_by_account.values():
+        all_handles.update(handles_users)
+    others = {account: set().union(*(audiences[other] for other in account_names if other != account))
+              for account in account_names}
+
+    rows = []
+    unique = {account: 0 for account in account_names}
+    shared_by_all = 0
+    empty = set()
+    for handle in all_handles:
+        user_sets = {account: handles_users_by_account[account].get(handle, empty) for account in account_names}
+        present = [account for account in account_names if user_sets[account]]
+        if len(present) == len(account_names):
+            shared_by_all += 1
+        elif len(present) == 1:
+            unique[present[0]] += 1
+
+        share = {}
+        distinctiveness = {}
+        for account in account_names:
+            size = len(audiences[account])
+            share[account] = len(user_sets[account]) / size if size else 0.0
+            other_users = set().union(*(user_sets[other] for other in account_names if other != account))
+            other_share = (len(other_users) + 1) / (len(others[account]) + 1)
+            distinctiveness[account] = ((len(user_sets[account]) + 1) / (size + 1)) / other_share
+
+        rows.append({
+            'handle': handle,
+            'total_users': len(set().union(*user_sets.values())),
+            'accounts_count': len(present),
+            'users': {account: len(user_sets[account]) for account in account_names},
+            'share': share,
+            'distinctiveness': distinctiveness,
+        })
+    rows.sort(key=lambda row: (-row['total_users'], row['handle']))
+
+    return {
+        'accounts': account_names,
+        'audience_sizes': {account: len(audiences[account]) for account in account_names},
+        'rows': rows,
+        'shared_by_all': shared_by_all,
+        'unique': unique,
+    }
@@ -0,0 +1,287 @@
+"""
+Retry Utilities
+Retry layer for Twitter API requests: failure classification, jittered
+exponential backoff with per-class retry budgets, a circuit breaker per
+endpoint for repeated 5xx errors, and a dead-letter list of permanently
+failed IDs that can be re-queued later.
+"""
+
+import csv
+import os
+import random
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+from utils.http_cache import get_http_cache
+
+REQUEST_TIMEOUT = 30  # seconds
+DEAD_LETTER_DIR = "twitter_files/dead_letter"
+
+# Failure classes
+RATE_LIMIT = 'rate_limit'   # 429
+SERVER = 'server'           # 5xx
+NETWORK = 'network'         # timeouts, connection resets
+AUTH = 'auth'               # 401, token expired
+CLIENT = 'client'           # 400/403/404: protected, deleted or suspended
+UNEXPECTED = 'unexpected'   # anything else
+
+# Classes retried in place, with their retry budgets (retries per request)
+DEFAULT_RETRY_BUDGETS = {
+    RATE_LIMIT: 3,
+    SERVER: 5,
+    NETWORK: 5,
+    UNEXPECTED: 2,
+}
+
+
+class RequestFailed(Exception):
+    """
+    Raised when a request failed permanently or ran out of retries.
+    """
+
+    def __init__(self, failure_class, status=None, detail=''):
+        self.failure_class = failure_class
+        self.status = status
+        self.detail = detail
+        super().__init__(f"{failure_class} failure ({status or 'no response'}): {detail}")
+
+
+def classify_failure(response=None, exception=None):
+    """
+    Map an unsuccessful response or a request exception to a failure class.
+    """
+    if exception is not None:
+        if isinstance(exception, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+            return NETWORK
+        return UNEXPECTED
+
+    status = response.status_code
+    if status == 429:
+        return RATE_LIMIT
+    if status >= 500:
+        return SERVER
+    if status == 401:
+        return AUTH
+    if status in (400, 403, 404):
+        return CLIENT
+    return UNEXPECTED
+
+
+def backoff_delay(attempt, base=2.0, cap=300.0):
+    """
+    Full-jitter exponential backoff: uniform in [0, min(cap, base * 2**attempt)].
+    """
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def rate_limit_delay(response, default=900):
+    """
+    Seconds until the rate limit window resets, from the x-rate-limit-reset header.
+    """
+    reset = response.headers.get('x-rate-limit-reset', '')
+    if reset.isdigit():
+        return max(int(reset) - time.time(), 0) + 1
+    return default
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive server errors on one endpoint and makes
+    every caller wait `cooldown` seconds before the next trial request.
+    """
+
+    def __init__(self, threshold=5, cooldown=300):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def wait_if_open(self, endpoint):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            wait_time = self.opened_at + self.cooldown - time.time()
+        if wait_time > 0:
+            print(f"   🔌 Circuit open for {endpoint} after repeated server errors. Waiting {wait_time/60:.1f} minutes...")
+            time.sleep(wait_time)
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_server_error(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.time()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(endpoint):
+    with _breakers_lock:
+        if endpoint not in _breakers:
+            _breakers[endpoint] = CircuitBreaker()
+        return _breakers[endpoint]
+
+
+_rate_budget = threading.local()
+
+
+def set_rate_budget(acquire):
+    """
+    Make every request attempt of this thread that goes to the network call acquire()
+    first (e.g. take a token from a RequestScheduler endpoint's bucket), retries
+    included, until rate_budget_used() is called. Cache hits never do.
+    """
+    _rate_budget.acquire = acquire
+    _rate_budget.used = 0
+
+
+def rate_budget_used():
+    """
+    Number of times the budget set with set_rate_budget was taken, and clear it.
+    """
+    used = getattr(_rate_budget, 'used', 0)
+    _rate_budget.acquire = None
+    _rate_budget.used = 0
+    return used
+
+
+def _take_rate_budget():
+    acquire = getattr(_rate_budget, 'acquire', None)
+    if acquire:
+        _rate_budget.used += 1
+        acquire()
+
+
+def get_with_retry(url, headers, params=None, endpoint='', retry_budgets=None):
+    """
+    GET a Twitter API URL, retrying transient failures with jittered exponential backoff.
+    Returns the successful (200) response, from the HTTP cache if the endpoint's policy
+    allows it (see utils/http_cache.py); every attempt that goes to the network, retries
+    included, takes rate budget.
+    Raises RequestFailed for permanent failures (401/403/404...) or when a class's retry budget is spent.
+    """
+    cache = get_http_cache()
+    if cache:
+        cached = cache.get(endpoint, url, params, headers)
+        if cached is not None:
+            return cached
+
+    budgets = dict(DEFAULT_RETRY_BUDGETS if retry_budgets is None else retry_budgets)
+    breaker = get_circuit_breaker(endpoint or url)
+    attempt = 0
+
+    while True:
+        breaker.wait_if_open(endpoint or url)
+        _take_rate_budget()
+
+        response = None
+        try:
+            response = requests.get(url, headers=headers, params=params, timeout=REQUEST_TIMEOUT)
+        except Exception as e:
+            failure_class = classify_failure(exception=e)
+            detail = str(e)
+        else:
+            if response.status_code == 200:
+                breaker.record_success()
+                if cache:
+                    cache.put(endpoint, url, params, headers, response)
+                return response
+            failure_class = classify_failure(response=response)
+            detail = response.text[:500]
+
+        if failure_class == SERVER:
+            breaker.record_server_error()
+
+        status = response.status_code if response is not None else None
+        if budgets.get(failure_class, 0) <= 0:
+            raise RequestFailed(failure_class, status, detail)
+        budgets[failure_class] -= 1
+
+        if failure_class == RATE_LIMIT:
+            wait_time = rate_limit_delay(response)
+            print(f"⚠️  Rate limit reached. Waiting {wait_time/60:.1f} minutes...")
+        else:
+            wait_time = backoff_delay(attempt)
+            attempt += 1
+            print(f"   🔁 {failure_class} error ({status or detail}), retrying in {wait_time:.1f}s...")
+        time.sleep(wait_time)
+
+
+class DeadLetterLog:
+    """
+    CSV list of IDs whose fetch failed permanently, so they can be re-queued cheaply.
+
+    Usage:
+        dead_letters = DeadLetterLog('1_retweeting_users', 'ethstatus')
+        dead_letters.add(tweet_id, error, items_fetched=200)
+        ...
+        retry_ids = dead_letters.read_ids()
+    """
+
+    FIELDS = ['id', 'failure_class', 'status', 'detail', 'items_fetched', 'failed_at']
+
+    def __init__(self, stage, account_name=''):
+        name = f"{stage}_{account_name}" if account_name else stage
+        self.path = os.path.join(DEAD_LETTER_DIR, f"{name}_dead_letter.csv")
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def add(self, entity_id, error, items_fetched=0):
+        with self.lock:
+            os.makedirs(DEAD_LETTER_DIR, exist_ok=True)
+            is_new = not os.path.exists(self.path)
+            with open(self.path, 'a', newline='', encoding='utf-8') as csvfile:
+                writer = csv.writer(csvfile)
+                if is_new:
+                    writer.writerow(self.FIELDS)
+                writer.writerow([
+                    entity_id,
+                    error.failure_class,
+                    error.status or '',
+                    error.detail.replace('\n', ' '),
+                    items_fetched,
+                    datetime.now().isoformat(timespec='seconds')
+                ])
+            self.count += 1
+
+    def read_ids(self, include_client_errors=False):
+        """
+        Return the dead-lettered IDs worth re-queueing (client errors such as deleted or
+        protected items are skipped unless include_client_errors is set).
+        """
+        if not os.path.exists(self.path):
+            return []
+        ids = []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                if row['failure_class'] == CLIENT and not include_client_errors:
+                    continue
+                ids.append(row['id'])
+        return list(dict.fromkeys(ids))
+
+    def clear(self, entity_ids):
+        """
+        Remove IDs (e.g. successfully re-queued ones) from the list.
+        """
+        entity_ids = set(entity_ids)
+        with self.lock:
+            if not os.path.exists(self.path):
+                return
+            with open(self.path, 'r', encoding='utf-8') as f:
+                rows = [row for row in csv.DictReader(f) if row['id'] not in entity_ids]
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', newline='', encoding='utf-8') as csvfile:
+                writer = csv.DictWriter(csvfile, fieldnames=self.FIELDS)
+                writer.writeheader()
+                writer.writerows(rows)
+            os.replace(tmp_path, self.path)
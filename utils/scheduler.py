@@ -0,0 +1,271 @@
+"""
+Request Scheduler
+Central scheduler that runs paginated API jobs on several endpoints at the
+same time, each endpoint with its own priority queue and token bucket.
+
+Within one endpoint, jobs are served by priority first, then in turn across
+targets, so several target accounts share one rate budget without any of
+them waiting for another one to finish.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+
+from utils.retry_utils import RequestFailed, rate_budget_used, set_rate_budget
+
+
+class PageJob:
+    """
+    A paginated fetch for one entity, e.g. all users who retweeted one tweet.
+
+    fetch_page(pagination_token) returns (items, next_token) and raises
+    RequestFailed when the page cannot be fetched. on_complete(items, error) is
+    called once, after the last page (error=None) or after a failed page (with
+    the RequestFailed error and the items of the pages fetched so far).
+    """
+
+    def __init__(self, key, fetch_page, on_complete):
+        self.key = key
+        self.fetch_page = fetch_page
+        self.on_complete = on_complete
+        self.items = []
+        self.next_token = None
+        self.pages = 0
+        self.error = None
+
+    def step(self):
+        """
+        Fetch the next page. Returns True when the job is finished.
+        """
+        try:
+            items, self.next_token = self.fetch_page(self.next_token)
+        except RequestFailed as e:
+            self.error = e
+            self.on_complete(self.items, e)
+            return True
+
+        self.pages += 1
+        self.items.extend(items)
+
+        if self.next_token:
+            return False
+
+        self.on_complete(self.items, None)
+        return True
+
+
+class TokenBucket:
+    """
+    Token bucket sized so that no window ever sees more than `limit` requests.
+
+    The bucket holds at most `burst` tokens and refills at (limit - burst) / window
+    tokens per second: a full burst plus one window of refill equals the limit.
+    """
+
+    def __init__(self, limit, window=900, burst=None):
+        self.limit = limit
+        self.window = window
+        self.capacity = burst or max(1, limit // 10)
+        self.rate = max(limit - self.capacity, 1) / window
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.waited = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """
+        Take one token, sleeping until one is available.
+        """
+        self._refill()
+        if self.tokens < 1:
+            wait_time = (1 - self.tokens) / self.rate
+            if wait_time > 60:
+                print(f"\n⏳ Rate budget used up. Waiting {wait_time/60:.1f} minutes before continuing...")
+            time.sleep(wait_time)
+            self.waited += wait_time
+            self._refill()
+            # The sleep covered the missing fraction; ignore float rounding
+            self.tokens = max(self.tokens, 1.0)
+        self.tokens -= 1
+
+
+class Endpoint:
+    """
+    Queue and rate budget of one API endpoint.
+    """
+
+    def __init__(self, name, limit, window=900, min_interval=0):
+        self.name = name
+        self.bucket = TokenBucket(limit, window)
+        self.min_interval = min_interval
+        self.queue = []
+        self.requests = 0
+        self.cache_hits = 0
+        self.completed = 0
+        self.started = None
+
+    def utilization(self):
+        """
+        Share of the endpoint's rate budget used since it started working.
+        """
+        if not self.started:
+            return 0.0
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        budget = self.bucket.capacity + elapsed * self.bucket.rate
+        return min(self.requests / budget, 1.0)
+
+
+class RequestScheduler:
+    """
+    Runs jobs on all registered endpoints concurrently (one worker thread per endpoint).
+
+    Usage:
+        scheduler = RequestScheduler()
+        scheduler.register_endpoint('retweeted_by', limit=75)
+        scheduler.register_endpoint('users_tweets', limit=900)
+        scheduler.submit('users_tweets', PageJob(...), priority=12, target='ethstatus')
+        scheduler.run()
+
+    Jobs with a higher priority go first. Jobs of equal priority are served in
+    turn across targets, and a job's remaining pages are fetched before the
+    target's next job starts. on_complete callbacks may submit new jobs, also
+    to other endpoints.
+    """
+
+    def __init__(self, progress_every=25):
+        self.endpoints = {}
+        self.progress_every = progress_every
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.target_slots = {}
+        self.sequence = itertools.count()
+        self.requests = 0
+
+    def register_endpoint(self, name, limit, window=900, min_interval=0):
+        self.endpoints[name] = Endpoint(name, limit, window, min_interval)
+        return self.endpoints[name]
+
+    def submit(self, endpoint, job, priority=0, target=''):
+        with self.condition:
+            slot = self.target_slots.get((endpoint, target), 0)
+            self.target_slots[(endpoint, target)] = slot + 1
+            self._push(self.endpoints[endpoint], job, priority, slot)
+            self.condition.notify_all()
+
+    def _push(self, endpoint, job, priority, slot):
+        heapq.heappush(endpoint.queue, (-priority, slot, next(self.sequence), job))
+
+    def cancel(self, endpoint, predicate):
+        """
+        Drop the queued jobs of an endpoint that have not fetched any page yet and
+        match predicate(job). Jobs already paginating are kept. Returns the dropped jobs.
+        """
+        with self.condition:
+            endpoint = self.endpoints[endpoint]
+            cancelled = [entry[-1] for entry in endpoint.queue if not entry[-1].pages and predicate(entry[-1])]
+            if cancelled:
+                dropped = set(map(id, cancelled))
+                endpoint.queue = [entry for entry in endpoint.queue if id(entry[-1]) not in dropped]
+                heapq.heapify(endpoint.queue)
+                self.condition.notify_all()
+            return cancelled
+
+    def pending(self):
+        with self.condition:
+            return sum(len(endpoint.queue) for endpoint in self.endpoints.values()) + self.in_flight
+
+    def _next_job(self, endpoint):
+        """
+        Pop the endpoint's next job, or return None once all endpoints are out of work.
+        """
+        with self.condition:
+            while True:
+                if endpoint.queue:
+                    self.in_flight += 1
+                    return heapq.heappop(endpoint.queue)
+                if self.in_flight == 0 and not any(e.queue for e in self.endpoints.values()):
+                    self.condition.notify_all()
+                    return None
+                self.condition.wait()
+
+    def _worker(self, endpoint):
+        endpoint.started = time.monotonic()
+
+        while True:
+            entry = self._next_job(endpoint)
+            if entry is None:
+                return
+            priority, slot, _, job = entry
+
+            # A token is taken per network attempt (retries included), none for HTTP cache hits
+            set_rate_budget(endpoint.bucket.acquire)
+            try:
+                finished = job.step()
+            except Exception as e:
+                print(f"❌ Unexpected error in job {job.key} on {endpoint.name}: {e}")
+                finished = True
+            networked = rate_budget_used()
+
+            with self.condition:
+                if networked:
+                    endpoint.requests += networked
+                    self.requests += networked
+                else:
+                    endpoint.cache_hits += 1
+                if finished:
+                    endpoint.completed += 1
+                else:
+                    # Same slot: the job's next page goes before the target's next job
+                    self._push(endpoint, job, -priority, slot)
+                self.in_flight -= 1
+                show = (self.progress_every and networked
+                        and self.requests // self.progress_every != (self.requests - networked) // self.progress_every)
+                self.condition.notify_all()
+
+            if show:
+                self.show_progress()
+
+            if endpoint.min_interval and networked:
+                time.sleep(endpoint.min_interval)
+
+    def run(self):
+        """
+        Run until every endpoint's queue is empty and no job is in flight.
+        """
+        workers = [
+            threading.Thread(target=self._worker, args=(endpoint,), name=f"scheduler-{endpoint.name}", daemon=True)
+            for endpoint in self.endpoints.values()
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    def stats(self):
+        """
+        Per-endpoint queue depth, request count and rate budget utilization.
+        """
+        with self.condition:
+            return {
+                name: {
+                    'queue_depth': len(endpoint.queue),
+                    'requests': endpoint.requests,
+                    'cache_hits': endpoint.cache_hits,
+                    'completed_jobs': endpoint.completed,
+                    'utilization': endpoint.utilization(),
+                    'rate_wait_seconds': endpoint.bucket.waited,
+                }
+                for name, endpoint in self.endpoints.items()
+            }
+
+    def show_progress(self):
+        for name, stat in self.stats().items():
+            cached = f" (+{stat['cache_hits']} from cache)" if stat['cache_hits'] else ''
+            print(f"   📊 {name}: {stat['requests']} requests{cached}, {stat['completed_jobs']} jobs done, "
+                  f"{stat['queue_depth']} queued, {stat['utilization']:.0%} of rate budget used")
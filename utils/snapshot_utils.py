@@ -0,0 +1,282 @@
+"""
+Columnar Snapshot Utilities
+Compact binary snapshots of stage 3 outputs for fast, memory-mapped loading.
+
+A snapshot holds one row per retweet with fixed-width int64 ID columns and
+dictionary-encoded string columns. The long `text` column is not stored; the
+retweeted handle is extracted once at compaction time instead. Each row also
+records its source file (an index into the header's `files`, which keeps
+every file's mtime and size), so per-file state can be seeded from it.
+
+File layout:
+    magic (8 bytes) | header length (uint64) | JSON header | padded columns
+"""
+
+import calendar
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import time
+from array import array
+
+from utils.csv_io import find_entity_files, iter_entity_rows
+
+SNAPSHOT_MAGIC = b'TWSNAP1\n'
+SNAPSHOT_VERSION = 3  # 2: created_at read as UTC (version 1 used the builder's local time); 3: source files
+SNAPSHOT_DIR = "twitter_files/3_user_retweets"
+
+RETWEET_HANDLE_PATTERN = re.compile(r'^RT @(\w+):')
+
+# Column name -> array typecode. Dictionary-encoded columns store int32 codes.
+ID_COLUMNS = ['user_id', 'retweet_id', 'retweeted_tweet_id', 'created_at']
+DICT_COLUMNS = ['handle', 'lang']
+
+
+def get_snapshot_path(account_name, input_dir=SNAPSHOT_DIR):
+    return os.path.join(input_dir, f"{account_name}_retweets.snap")
+
+
+def list_tweet_files(account_name, input_dir=SNAPSHOT_DIR):
+    """
+    List an account's stage 3 tweet files (per-user files and shards).
+    """
+    return find_entity_files(input_dir, account_name, '_tweets.csv')
+
+
+def _to_int(value):
+    value = (value or '').strip()
+    return int(value) if value.isdigit() else 0
+
+
+def to_epoch(created_at):
+    """
+    Convert an API timestamp (2024-01-31T12:00:00.000Z, always UTC) to epoch seconds, 0 if missing.
+    The result does not depend on the local timezone.
+    """
+    if not created_at:
+        return 0
+    try:
+        return calendar.timegm(time.strptime(created_at[:19], '%Y-%m-%dT%H:%M:%S'))
+    except ValueError:
+        return 0
+
+
+def _source_state(csv_files):
+    """
+    Return (file count, newest mtime) for the CSV files a snapshot was built from.
+    """
+    newest = 0.0
+    for path in csv_files:
+        newest = max(newest, os.stat(path).st_mtime)
+    return len(csv_files), newest
+
+
+def write_column_file(path, magic, header, columns, column_info=None):
+    """
+    Write typed arrays back to back, each aligned to 8 bytes, after the magic and a JSON
+    header describing them (written through a temp file and an atomic rename).
+    column_info adds extra header fields per column, e.g. a dictionary.
+    """
+    header = dict(header, byteorder=sys.byteorder, columns={})
+
+    offset = 0
+    payloads = []
+    for name, values in columns.items():
+        data = values.tobytes()
+        column = {'typecode': values.typecode, 'offset': offset, 'length': len(values)}
+        column.update((column_info or {}).get(name, {}))
+        header['columns'][name] = column
+        payloads.append(data)
+        offset += len(data) + (-len(data) % 8)
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    header_bytes += b' ' * (-(len(magic) + 8 + len(header_bytes)) % 8)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(magic)
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        for data in payloads:
+            f.write(data)
+            f.write(b'\0' * (-len(data) % 8))
+    os.replace(tmp_path, path)
+    return path
+
+
+def build_snapshot(account_name, input_dir=SNAPSHOT_DIR):
+    """
+    Compact all stage 3 CSVs of an account into a single columnar snapshot.
+    Returns the snapshot path, or None if there is nothing to compact.
+    """
+    csv_files = list_tweet_files(account_name, input_dir)
+    if not csv_files:
+        print(f"❌ No tweet files found for @{account_name} to compact")
+        return None
+
+    columns = {name: array('q') for name in ID_COLUMNS}
+    codes = {name: array('i') for name in DICT_COLUMNS}
+    dictionaries = {name: {} for name in DICT_COLUMNS}
+    row_files = array('i')
+    files = []
+
+    for file_index, csv_file in enumerate(csv_files):
+        stat = os.stat(csv_file)
+        files.append([csv_file, stat.st_mtime, stat.st_size])
+        for user_id, row in iter_entity_rows(csv_file, account_name, '_tweets.csv', 'user_id'):
+            text = row.get('text', '').strip()
+            if not text:
+                continue
+
+            match = RETWEET_HANDLE_PATTERN.match(text)
+            values = {
+                'handle': match.group(1) if match else None,
+                'lang': row.get('lang', '') or None,
+            }
+
+            columns['user_id'].append(_to_int(user_id))
+            columns['retweet_id'].append(_to_int(row.get('retweet_id')))
+            columns['retweeted_tweet_id'].append(_to_int(row.get('retweeted_tweet_id')))
+            columns['created_at'].append(to_epoch(row.get('created_at')))
+            row_files.append(file_index)
+
+            for name, value in values.items():
+                if value is None:
+                    codes[name].append(-1)
+                else:
+                    codes[name].append(dictionaries[name].setdefault(value, len(dictionaries[name])))
+
+    file_count, newest_mtime = _source_state(csv_files)
+    row_count = len(columns['user_id'])
+
+    header = {
+        'version': SNAPSHOT_VERSION,
+        'account': account_name,
+        'rows': row_count,
+        'source_files': file_count,
+        'source_mtime': newest_mtime,
+        'files': files,
+    }
+    column_arrays = dict(columns)
+    column_arrays.update(codes)
+    column_arrays['file'] = row_files
+
+    path = get_snapshot_path(account_name, input_dir)
+    write_column_file(path, SNAPSHOT_MAGIC, header, column_arrays,
+                      {name: {'dictionary': list(values)} for name, values in dictionaries.items()})
+
+    print(f"💾 Compacted {row_count} retweets from {file_count} files into {path}")
+    return path
+
+
+class ColumnFile:
+    """
+    Memory-mapped, read-only view of a file written by write_column_file.
+    """
+
+    MAGIC = None
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._views = {}
+
+        if self._mmap[:len(self.MAGIC)] != self.MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a {type(self).__name__} file")
+
+        start = len(self.MAGIC)
+        header_length = struct.unpack('<Q', self._mmap[start:start + 8])[0]
+        start += 8
+        self.header = json.loads(self._mmap[start:start + header_length])
+        self._data_start = start + header_length
+
+    @classmethod
+    def open(cls, path):
+        return cls(path)
+
+    def __getitem__(self, name):
+        """
+        Return a column as a zero-copy memoryview (or a swapped copy on foreign byte order).
+        """
+        if name not in self._views:
+            column = self.header['columns'][name]
+            itemsize = struct.calcsize(column['typecode'])
+            start = self._data_start + column['offset']
+            view = memoryview(self._mmap)[start:start + column['length'] * itemsize].cast(column['typecode'])
+            if self.header['byteorder'] != sys.byteorder:
+                swapped = array(column['typecode'], view)
+                swapped.byteswap()
+                view.release()
+                view = memoryview(swapped)
+            self._views[name] = view
+        return self._views[name]
+
+    def close(self):
+        for view in self._views.values():
+            view.release()
+        self._views = {}
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Snapshot(ColumnFile):
+    """
+    Memory-mapped, read-only view of a snapshot file.
+
+    Usage:
+        with Snapshot.open(path) as snapshot:
+            for code, user_id in zip(snapshot['handle'], snapshot['user_id']):
+                handle = snapshot.decode('handle', code)
+    """
+
+    MAGIC = SNAPSHOT_MAGIC
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.rows = self.header['rows']
+
+    def dictionary(self, name):
+        return self.header['columns'][name].get('dictionary', [])
+
+    def decode(self, name, code):
+        return None if code < 0 else self.header['columns'][name]['dictionary'][code]
+
+    def is_fresh(self, csv_files):
+        """
+        Check that the snapshot has the current format and that no CSV was added, removed
+        or rewritten since it was built.
+        """
+        if self.header.get('version') != SNAPSHOT_VERSION:
+            return False
+        file_count, newest_mtime = _source_state(csv_files)
+        return file_count == self.header['source_files'] and newest_mtime <= self.header['source_mtime']
+
+
+def load_fresh_snapshot(account_name, input_dir=SNAPSHOT_DIR):
+    """
+    Open the account's snapshot if it exists and is up to date with the CSVs.
+    Returns a Snapshot or None (caller falls back to parsing CSVs).
+    """
+    path = get_snapshot_path(account_name, input_dir)
+    if not os.path.exists(path):
+        return None
+
+    snapshot = Snapshot.open(path)
+    if not snapshot.is_fresh(list_tweet_files(account_name, input_dir)):
+        print(f"   ⚠️  Snapshot {path} is stale, re-run: python 3.get_user_retweets.py {account_name} --snapshot-only")
+        snapshot.close()
+        return None
+    return snapshot
@@ -0,0 +1,37 @@
+"""
+Stage Loader
+Import the numbered stage scripts (0.get_tweets.py, ...) as modules, so that
+one stage can reuse another stage's fetch and save functions.
+"""
+
+import importlib.util
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STAGE_FILES = {
+    0: '0.get_tweets.py',
+    1: '1.get_retweets.py',
+    2: '2.get_engaged_accounts.py',
+    3: '3.get_user_retweets.py',
+    4: '4.get_retweeted_accounts.py',
+    5: '5.cluster_audience.py',
+    6: '6.co_amplification.py',
+}
+
+
+def load_stage(number):
+    """
+    Load a stage script by number and return it as a module (loaded once per process).
+    """
+    module_name = f"stage_{number}"
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+
+    path = os.path.join(ROOT_DIR, STAGE_FILES[number])
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
@@ -7,6 +7,8 @@ import os
 import time
 import requests
 
+from utils.http_cache import get_http_cache
+
 # OAuth 2.0 credentials - set via environment variables or defaults
 ACCESS_TOKEN = os.getenv('TWITTER_ACCESS_TOKEN', '')
 REFRESH_TOKEN = os.getenv('TWITTER_REFRESH_TOKEN', '')
@@ -21,8 +23,14 @@ def test_authentication(access_token):
         "Content-Type": "application/json"
     }
 
+    # Cached for a few minutes per token (see utils/http_cache.py), so stage restarts skip the call
+    cache = get_http_cache()
     try:
-        response = requests.get(url, headers=headers)
+        response = cache.get('users_me', url, None, headers) if cache else None
+        if response is None:
+            response = requests.get(url, headers=headers)
+            if cache:
+                cache.put('users_me', url, None, headers, response)
         if response.status_code == 200:
             user_data = response.json()
             print(f"✅ Authentication successful!")
@@ -0,0 +1,176 @@
+"""
+Username <-> User ID Cache
+Persistent cache of Twitter user lookups, resolved in batches of up to 100
+usernames per request through GET /2/users/by.
+
+Entries expire after a TTL. When a user ID comes back with a different
+username than the one cached (the account was renamed), the old username
+mapping is dropped; a username is only forgotten when the API answers that
+it does not exist, never because a lookup failed. Lookups share a token
+bucket sized to the users lookup rate limit, so resolving many usernames
+waits for the budget instead of running into 429s.
+"""
+
+import json
+import os
+import time
+
+CACHE_FILE = "twitter_files/.cache/user_ids.json"
+DEFAULT_TTL = 7 * 24 * 3600  # 7 days in seconds
+LOOKUP_BATCH_SIZE = 100  # max usernames per GET /2/users/by request
+LOOKUP_RATE_LIMIT = 900  # GET /2/users/by requests per window
+LOOKUP_RATE_LIMIT_WINDOW = 900  # 15 minutes in seconds
+
+
+def normalize_username(username):
+    return username.strip().lstrip('@').lower()
+
+
+class UserCache:
+    """
+    Persistent username <-> user ID cache.
+
+    Usage:
+        cache = UserCache()
+        ids = cache.resolve(['ethstatus', 'keycard'], access_token)
+        # {'ethstatus': '123...', 'keycard': '456...'}
+        cache.save()
+    """
+
+    def __init__(self, path=CACHE_FILE, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.users = {}      # user_id -> {'username', 'name', 'resolved_at'}
+        self.usernames = {}  # lowercase username -> user_id
+        self.dirty = False
+        self.bucket = None
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.users = data.get('users', {})
+            self.usernames = data.get('usernames', {})
+        except (OSError, ValueError) as e:
+            print(f"   ⚠️  Could not read user cache {self.path}: {e}")
+
+    def save(self):
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'users': self.users, 'usernames': self.usernames}, f)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+    def get_id(self, username):
+        """
+        Return the cached user ID for a username, or None if unknown or expired.
+        """
+        user_id = self.usernames.get(normalize_username(username))
+        if not user_id:
+            return None
+        user = self.users.get(user_id)
+        if not user or time.time() - user['resolved_at'] > self.ttl:
+            return None
+        return user_id
+
+    def get_username(self, user_id):
+        user = self.users.get(str(user_id))
+        return user['username'] if user else None
+
+    def put(self, user_id, username, name=''):
+        """
+        Record a lookup result, invalidating the previous username of a renamed user.
+        """
+        user_id = str(user_id)
+        key = normalize_username(username)
+
+        previous = self.users.get(user_id)
+        if previous and normalize_username(previous['username']) != key:
+            print(f"   🔄 @{previous['username']} was renamed to @{username}")
+            if self.usernames.get(normalize_username(previous['username'])) == user_id:
+                del self.usernames[normalize_username(previous['username'])]
+
+        self.users[user_id] = {'username': username, 'name': name, 'resolved_at': time.time()}
+        self.usernames[key] = user_id
+        self.dirty = True
+
+    def invalidate(self, username):
+        user_id = self.usernames.pop(normalize_username(username), None)
+        if user_id:
+            self.users.pop(user_id, None)
+            self.dirty = True
+
+    def resolve(self, usernames, access_token):
+        """
+        Resolve usernames to user IDs, calling the API only for missing or expired entries.
+        Returns a dict of normalized username -> user ID (unresolvable usernames are left out).
+        """
+        from utils.retry_utils import RequestFailed, rate_budget_used, set_rate_budget
+        from utils.scheduler import TokenBucket
+
+        keys = list(dict.fromkeys(normalize_username(u) for u in usernames if normalize_username(u)))
+        missing = [key for key in keys if not self.get_id(key)]
+
+        if missing:
+            print(f" Resolving {len(missing)} username(s) via API ({len(keys) - len(missing)} cached)")
+            if self.bucket is None:
+                self.bucket = TokenBucket(LOOKUP_RATE_LIMIT, LOOKUP_RATE_LIMIT_WINDOW)
+            failed = 0
+            for start in range(0, len(missing), LOOKUP_BATCH_SIZE):
+                batch = missing[start:start + LOOKUP_BATCH_SIZE]
+                set_rate_budget(self.bucket.acquire)
+                try:
+                    users, not_found = lookup_usernames(batch, access_token)
+                except RequestFailed as e:
+                    # Nothing is known about this batch: keep whatever was cached
+                    print(f"❌ Error looking up users: {e}")
+                    failed += len(batch)
+                    continue
+                finally:
+                    rate_budget_used()
+                for user in users:
+                    self.put(user['id'], user['username'], user.get('name', ''))
+                # Usernames the API reports as not found were renamed or deleted
+                for key in not_found:
+                    self.invalidate(key)
+            if failed:
+                print(f"   ⚠️  {failed} username(s) could not be looked up and were left as they are")
+            self.save()
+
+        return {key: self.get_id(key) for key in keys if self.get_id(key)}
+
+
+def lookup_usernames(usernames, access_token):
+    """
+    Look up to 100 usernames in one request using Twitter API v2.
+    Returns (user objects found, normalized usernames the API reported as not found).
+    Raises RequestFailed when the lookup itself failed.
+    """
+    from utils.retry_utils import get_with_retry
+
+    url = "https://api.twitter.com/2/users/by"
+    headers = {
+        "Authorization": f"Bearer {access_token}",
+        "Content-Type": "application/json"
+    }
+    params = {
+        "usernames": ','.join(usernames),
+        "user.fields": "id,name,username"
+    }
+
+    response = get_with_retry(url, headers, params, endpoint='users_by')
+
+    data = response.json()
+    not_found = []
+    for error in data.get('errors', []):
+        print(f"   ⚠️  Could not resolve @{error.get('value', '?')}: {error.get('detail', error.get('title', ''))}")
+        if error.get('value') and (error.get('title') == 'Not Found Error'
+                                   or error.get('type', '').endswith('/resource-not-found')):
+            not_found.append(normalize_username(error['value']))
+    return data.get('data', []), not_found
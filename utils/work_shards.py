@@ -0,0 +1,278 @@
+"""
+Work Shards
+Splits stage 3's engaged-accounts list into deterministic shards, so separate
+workers (other machines, other credentials and rate budgets) can each fetch
+their own part of the audience, and merges their outputs back into one dataset.
+
+A user's shard only depends on its user_id and the shard count (a stable hash,
+not Python's per-process hash()), so every worker computes the same split from
+its own copy of the engaged-accounts CSV.
+
+Coordination needs no service:
+    --shard=I/N            static assignment, one worker per shard
+    --queue=PATH --shards=N
+                           workers claim shards from a SQLite file in a shared
+                           directory until none is left; shards of workers that
+                           stop renewing their claim are handed out again
+
+Each shard writes its rolling shard files and its dead-letter list under a
+part name ({account}_part-{i:03d}), so workers sharing an output directory never
+write the same file. Per-user files are disjoint across shards anyway.
+"""
+
+import os
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+from hashlib import blake2b
+
+from utils.csv_io import ensure_dir, find_entity_files, iter_entity_rows, split_entity_filename
+from utils.retry_utils import DEAD_LETTER_DIR
+
+DEFAULT_LEASE_SECONDS = 1800
+HEARTBEAT_SECONDS = 60
+
+
+def shard_of(user_id, shard_count):
+    """
+    Deterministic shard (0..shard_count-1) of a user ID.
+    """
+    digest = blake2b(str(user_id).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % shard_count
+
+
+def parse_shard(value):
+    """
+    Parse an "I/N" shard spec into (I, N). Raises ValueError for invalid specs.
+    """
+    index, _, count = value.partition('/')
+    if not (index.isdigit() and count.isdigit()) or not 0 <= int(index) < int(count):
+        raise ValueError(f"Invalid shard {value!r}, expected I/N with 0 <= I < N (e.g. 0/4)")
+    return int(index), int(count)
+
+
+def select_shard(user_accounts, shard, shard_count):
+    """
+    Keep the engaged accounts (dicts with a 'user_id') that belong to a shard.
+    """
+    return [account for account in user_accounts if shard_of(account['user_id'], shard_count) == shard]
+
+
+def get_part_name(account_name, shard):
+    """
+    Name under which a shard writes its rolling shard files and dead letters.
+    """
+    return f"{account_name}_part-{shard:03d}"
+
+
+def default_worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class ShardQueue:
+    """
+    SQLite work queue of the shards of one account, kept in a shared directory.
+
+    A claim is a lease: the worker renews it with heartbeat() while it works, and
+    a shard whose lease expired (crashed, killed or stalled worker) can be claimed
+    again. heartbeat(), finish() and release() only act on a claim the worker
+    still holds, so a worker that lost its shard can never overwrite the new
+    owner's state; heartbeat() tells it to stop.
+
+    Usage:
+        queue = ShardQueue(path, 'ethstatus', shard_count=16)
+        shard = queue.claim(worker)
+        while shard is not None:
+            ...  # fetch the shard, stopping if queue.heartbeat(shard, worker) returns False
+            queue.finish(shard, worker)
+            shard = queue.claim(worker)
+    """
+
+    def __init__(self, path, account_name, shard_count, lease_seconds=DEFAULT_LEASE_SECONDS):
+        self.path = path
+        self.account_name = account_name
+        self.lease_seconds = lease_seconds
+        self.last_heartbeat = {}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        with self._transaction() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS meta (account TEXT PRIMARY KEY, shard_count INTEGER)")
+            db.execute("""CREATE TABLE IF NOT EXISTS shards (
+                              account TEXT, shard INTEGER, status TEXT, worker TEXT,
+                              claimed_at REAL, finished_at REAL, users INTEGER,
+                              PRIMARY KEY (account, shard))""")
+            row = db.execute("SELECT shard_count FROM meta WHERE account = ?", (account_name,)).fetchone()
+            if row is None:
+                db.execute("INSERT INTO meta VALUES (?, ?)", (account_name, shard_count))
+                db.executemany("INSERT INTO shards (account, shard, status) VALUES (?, ?, 'pending')",
+                               [(account_name, shard) for shard in range(shard_count)])
+            elif row[0] != shard_count:
+                raise ValueError(f"{path} splits @{account_name} into {row[0]} shards, not {shard_count}")
+        self.shard_count = shard_count
+
+    def _transaction(self):
+        return _Transaction(self.connection, self.lock)
+
+    def claim(self, worker):
+        """
+        Claim the next pending (or expired) shard. Returns its number, or None when
+        every shard is finished or claimed by a live worker.
+        """
+        now = time.time()
+        with self._transaction() as db:
+            row = db.execute("""SELECT shard FROM shards
+                                WHERE account = ? AND (status = 'pending' OR (status = 'claimed' AND claimed_at < ?))
+                                ORDER BY shard LIMIT 1""",
+                             (self.account_name, now - self.lease_seconds)).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE shards SET status = 'claimed', worker = ?, claimed_at = ? WHERE account = ? AND shard = ?",
+                       (worker, now, self.account_name, row[0]))
+        self.last_heartbeat[row[0]] = now
+        return row[0]
+
+    def heartbeat(self, shard, worker):
+        """
+        Renew a claim; cheap to call often, it only writes once per HEARTBEAT_SECONDS.
+        Returns False once the worker no longer holds the claim (its lease expired
+        and another worker claimed the shard).
+        """
+        now = time.time()
+        if now - self.last_heartbeat.get(shard, 0) < HEARTBEAT_SECONDS:
+            return True
+        self.last_heartbeat[shard] = now
+        with self._transaction() as db:
+            cursor = db.execute("UPDATE shards SET claimed_at = ? "
+                                "WHERE account = ? AND shard = ? AND status = 'claimed' AND worker = ?",
+                                (now, self.account_name, shard, worker))
+        return cursor.rowcount == 1
+
+    def finish(self, shard, worker, users=None):
+        """
+        Mark a claimed shard done. Returns False if the worker no longer held the claim.
+        """
+        with self._transaction() as db:
+            cursor = db.execute("UPDATE shards SET status = 'done', finished_at = ?, users = ? "
+                                "WHERE account = ? AND shard = ? AND status = 'claimed' AND worker = ?",
+                                (time.time(), users, self.account_name, shard, worker))
+        return cursor.rowcount == 1
+
+    def release(self, shard, worker):
+        """
+        Give a claimed shard back (e.g. the worker was interrupted).
+        """
+        with self._transaction() as db:
+            db.execute("UPDATE shards SET status = 'pending', worker = NULL, claimed_at = NULL "
+                       "WHERE account = ? AND shard = ? AND status = 'claimed' AND worker = ?",
+                       (self.account_name, shard, worker))
+
+    def status(self):
+        """
+        Return {status: number of shards}.
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT status, COUNT(*) FROM shards WHERE account = ? GROUP BY status",
+                                           (self.account_name,)).fetchall()
+        return dict(rows)
+
+    def close(self):
+        self.connection.close()
+
+
+class _Transaction:
+    """
+    BEGIN IMMEDIATE ... COMMIT, so two workers can never claim the same shard.
+    The lock serializes the scheduler threads sharing the connection.
+    """
+
+    def __init__(self, connection, lock):
+        self.connection = connection
+        self.lock = lock
+
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            self.connection.execute("BEGIN IMMEDIATE")
+        except BaseException:
+            self.lock.release()
+            raise
+        return self.connection
+
+    def __exit__(self, exc_type, *exc_info):
+        try:
+            self.connection.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        finally:
+            self.lock.release()
+
+
+def _copy_if_newer(source, destination):
+    if os.path.exists(destination) and os.stat(destination).st_mtime >= os.stat(source).st_mtime:
+        return False
+    tmp_path = destination + '.tmp'
+    shutil.copy2(source, tmp_path)
+    os.replace(tmp_path, destination)
+    return True
+
+
+def _stage_dir(worker_dir, stage_dir):
+    """
+    A worker directory is its working directory (holding twitter_files/) or the stage directory itself.
+    """
+    nested = os.path.join(worker_dir, stage_dir)
+    return nested if os.path.isdir(nested) else worker_dir
+
+
+def merge_worker_outputs(worker_dirs, output_dir, account_name, suffix):
+    """
+    Copy an account's tweet files (per-user files and the shards' rolling shard files)
+    and the shards' dead-letter lists from each worker into the local directories.
+    A file already present locally is only replaced by a newer copy, so merging twice
+    is a no-op and re-fetched users win. Returns {'copied', 'skipped', 'dead_letters'}.
+    """
+    ensure_dir(output_dir)
+    stats = {'copied': 0, 'skipped': 0, 'dead_letters': 0}
+    for worker_dir in worker_dirs:
+        source_dir = _stage_dir(worker_dir, output_dir)
+        if os.path.abspath(source_dir) == os.path.abspath(output_dir):
+            continue  # shared output directory: the files are already here
+        for path in find_entity_files(source_dir, account_name, suffix):
+            if _copy_if_newer(path, os.path.join(output_dir, os.path.basename(path))):
+                stats['copied'] += 1
+            else:
+                stats['skipped'] += 1
+
+        dead_letter_dir = _stage_dir(worker_dir, DEAD_LETTER_DIR)
+        if os.path.isdir(dead_letter_dir) and os.path.abspath(dead_letter_dir) != os.path.abspath(DEAD_LETTER_DIR):
+            os.makedirs(DEAD_LETTER_DIR, exist_ok=True)
+            for name in os.listdir(dead_letter_dir):
+                if f"_{account_name}_part-" in name and name.endswith('_dead_letter.csv'):
+                    stats['dead_letters'] += _copy_if_newer(os.path.join(dead_letter_dir, name),
+                                                            os.path.join(DEAD_LETTER_DIR, name))
+    return stats
+
+
+def missing_users_by_shard(user_accounts, output_dir, account_name, suffix, entity_column, shard_count):
+    """
+    Return {shard: number of engaged users without any tweet file}, to tell which
+    shards still need a (re-)run after a merge. In the --sharded layout users without
+    any retweet leave no rows, so they count as missing too.
+    """
+    fetched = set()
+    for path in find_entity_files(output_dir, account_name, suffix):
+        entity_id, is_shard = split_entity_filename(os.path.basename(path), account_name, suffix)
+        if is_shard:
+            fetched.update(user_id for user_id, _ in iter_entity_rows(path, account_name, suffix, entity_column))
+        else:
+            fetched.add(entity_id)
+
+    missing = {}
+    for account in user_accounts:
+        if account['user_id'] not in fetched:
+            shard = shard_of(account['user_id'], shard_count)
+            missing[shard] = missing.get(shard, 0) + 1
+    return missing